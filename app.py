@@ -1,39 +1,181 @@
-from dash import Dash, html, dcc, callback, Output, Input
-from tsneakpeaks import TSneakPeaks
+from dash import Dash, html, dcc, callback, ctx, no_update, Output, Input, State
+from flask import Response, abort, jsonify
+from tsneakpeaks.dataset_registry import DatasetRegistry
+from tsneakpeaks.owl_cave import Metrics, get_config, setup_logging
+from tsneakpeaks.thumbnails import thumbnail_response
+from urllib.parse import parse_qs
 import plotly.graph_objects as go
+import os
 from pathlib import Path
 
 app = Dash(__name__)
 
-# Load data
-peaks = TSneakPeaks("test_data")
-peaks.load_data()
-fig = peaks.visualize()
+# Thumbnails shown in the similar images panel
+SIMILAR_IMAGES = 8
 
-# Get just filenames
-image_names = [Path(p).name for p in peaks.image_paths]
+# Every collection under TSNEAKPEAKS_DATA_ROOT, or test_data alone; each loads in
+# the background on its first view and the least recently viewed are evicted
+config = get_config()
+logger = setup_logging()
+# Stage metrics of every dataset, served at /metrics for Prometheus to scrape
+metrics = Metrics(logger=logger)
+registry = DatasetRegistry(max_bytes=config['app_memory_budget'], logger=logger, metrics=metrics)
+data_root = os.environ.get('TSNEAKPEAKS_DATA_ROOT')
+if data_root:
+    registry.register_root(data_root)
+else:
+    registry.register('test_data', 'test_data')
+
+def status(dataset):
+    # Polling must not load a dataset or keep it from being evicted
+    try:
+        loaded = registry.peek(dataset)
+    except KeyError:
+        abort(404)
+    if loaded is None:
+        return jsonify({'state': 'not loaded'}), 404
+    return jsonify(loaded.job.status())
+
+def thumbnail(dataset, name):
+    # Served from disk for datasets not loaded; never starts a projection
+    try:
+        store = registry.thumbnails(dataset)
+    except KeyError:
+        abort(404)
+    return thumbnail_response(store, name)
+
+app.server.add_url_rule('/status/<dataset>', 'status', status)
+app.server.add_url_rule(
+    '/metrics', 'metrics',
+    lambda: Response(metrics.to_prometheus(), mimetype='text/plain; version=0.0.4')
+)
+app.server.add_url_rule('/thumbnails/<dataset>/<name>', 'thumbnail', thumbnail)
 
 app.layout = html.Div([
+    # ?dataset=<name> selects a collection, so views can be linked
+    dcc.Location(id='url', refresh=False),
     html.Div([
-        dcc.Graph(id='3d-plot', figure=fig)
+        dcc.Dropdown(id='dataset', options=registry.names(), clearable=False),
+        dcc.Graph(id='3d-plot', figure=go.Figure()),
+        html.Div(id='progress'),
+        # Polls for new snapshots until the projection is done
+        dcc.Interval(id='progress-poll', interval=1000),
+        dcc.Store(id='shown-version', data=None)
     ], style={'width': '70%', 'float': 'left'}),
-    
+
     html.Div([
+        # Large embeddings show an overview; zooming fetches every point around the selection
+        html.Button('Zoom here', id='zoom-in'),
+        html.Button('Overview', id='zoom-out'),
         html.Img(id='selected-image', style={'width': '100%'}),
-        html.Div(id='click-data')  # Added this
+        html.Div(id='click-data'),  # Added this
+        # Images sharing the most quadrant colours with the clicked one
+        html.H4('Similar images'),
+        dcc.RadioItems(
+            id='similar-metric',
+            options=[{'label': 'Matching quadrants', 'value': 'count'},
+                     {'label': 'Weighted cosine', 'value': 'cosine'}],
+            value='count',
+            inline=True
+        ),
+        html.Div(id='similar-images')
     ], style={'width': '30%', 'float': 'right'})
 ])
 
+@callback(
+    [Output('dataset', 'value'),
+     Output('url', 'search')],
+    [Input('url', 'search'),
+     Input('dataset', 'value')]
+)
+def select_dataset(search, value):
+    if ctx.triggered_id == 'dataset' and value:
+        return value, f'?dataset={value}'
+    requested = parse_qs((search or '').lstrip('?')).get('dataset', [None])[0]
+    names = registry.names()
+    selected = requested if requested in names else (names[0] if names else None)
+    return selected, no_update
+
+@callback(
+    [Output('3d-plot', 'figure'),
+     Output('shown-version', 'data'),
+     Output('progress', 'children'),
+     Output('progress-poll', 'disabled')],
+    [Input('progress-poll', 'n_intervals'),
+     Input('dataset', 'value'),
+     Input('zoom-in', 'n_clicks'),
+     Input('zoom-out', 'n_clicks')],
+    [State('3d-plot', 'clickData'),
+     State('shown-version', 'data')]
+)
+def update_plot(n_intervals, name, zoom_in, zoom_out, clickData, shown_version):
+    if not name:
+        return no_update, shown_version, 'No datasets registered', True
+    job = registry.get(name).job
+    status = job.status()
+    if status['state'] == 'failed':
+        return no_update, shown_version, f"Projection failed: {status['error']}", True
+    if status['iteration'] is None:
+        progress = f"{status['state'].capitalize()}..."
+    else:
+        progress = f"Iteration {status['iteration']}/{status['n_iter']}, KL divergence {status['kl_divergence']:.3f}"
+    if job.ready:
+        progress = f"{name}: {status['n_images']} images"
+    done = status['state'] in ('ready', 'stopped')
+    version = [name, status['version']]
+
+    if ctx.triggered_id in ('zoom-in', 'zoom-out'):
+        if not done:
+            return no_update, shown_version, progress, False
+        if ctx.triggered_id == 'zoom-out' or not clickData:
+            return job.figure(), version, progress, True
+        point_index = clickData['points'][0]['customdata']
+        octree = job.peaks.visualizer.get_octree(job.peaks.coords_3d)
+        return job.figure(region=octree.box_around(point_index)), version, progress, True
+
+    if version == shown_version:
+        return no_update, shown_version, progress, done
+    figure = job.figure()
+    return figure if figure is not None else go.Figure(), version, progress, done
+
 @callback(
     [Output('selected-image', 'src'),
      Output('click-data', 'children')],
-    Input('3d-plot', 'clickData')
+    Input('3d-plot', 'clickData'),
+    State('dataset', 'value')
 )
-def display_image(clickData):
-    if not clickData:
+def display_image(clickData, name):
+    if not clickData or not name:
         return '', 'No click data'
-    point_index = clickData['points'][0]['pointNumber']
-    return f'/assets/{image_names[point_index]}', str(clickData)
+    point_index = clickData['points'][0]['customdata']
+    image_name = registry.get(name).job.peaks.visualizer.image_name(point_index)
+    # Only what the viewer needs; echoing clickData back doubled every response
+    return f'/thumbnails/{name}/{Path(image_name).stem}.png', f'Image {point_index}: {image_name}'
+
+@callback(
+    Output('similar-images', 'children'),
+    [Input('3d-plot', 'clickData'),
+     Input('similar-metric', 'value')],
+    State('dataset', 'value')
+)
+def display_similar(clickData, metric, name):
+    if not clickData or not name:
+        return []
+    peaks = registry.get(name).job.peaks
+    point_index = clickData['points'][0]['customdata']
+    try:
+        ids, scores = peaks.similar(point_index, k=SIMILAR_IMAGES, metric=metric)
+    except ValueError as e:
+        return str(e)
+    return [
+        html.Figure([
+            html.Img(src=f'/thumbnails/{name}/{Path(peaks.image_paths[i]).stem}.png',
+                     style={'width': '100%'}),
+            html.Figcaption(f'Image {i}: {score:.2f}')
+        ], style={'width': '23%', 'display': 'inline-block', 'margin': '1%'})
+        for i, score in zip(ids.tolist(), scores.tolist())
+    ]
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # The reloader would run a second copy of every background projection
+    app.run(debug=True, use_reloader=False)
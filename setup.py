@@ -14,6 +14,7 @@ setup(
     entry_points={
         "console_scripts": [
             "tsneakpeaks=tsneakpeaks.cli.cooper:main",
+            "tsneakpeaks-benchmark=tsneakpeaks.cli.hawk:main",
         ],
     },
     author="Your Name",
@@ -0,0 +1,15 @@
+# tests/conftest.py
+import numpy as np
+import pytest
+
+@pytest.fixture
+def make_family_labels():
+    """Factory of three colour families of quadrant labels, some quadrants recoloured at random"""
+    def make(n_per_family, seed, flip_rate=0.25):
+        rng = np.random.default_rng(seed)
+        families = np.array([[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10, 11]])
+        labels = np.repeat(families, n_per_family, axis=0)
+        flips = rng.random(labels.shape) < flip_rate
+        labels[flips] = rng.integers(0, 16, flips.sum())
+        return labels.astype(np.uint8)
+    return make
@@ -0,0 +1,63 @@
+# tests/test_benchmark.py
+import numpy as np
+import pytest
+from PIL import Image
+from tsneakpeaks.benchmark import (
+    STAGES,
+    compare_reports,
+    format_report,
+    load_report,
+    run_benchmark,
+    save_report,
+    scaling_exponents,
+    synthesize_dataset,
+)
+from tsneakpeaks.feature_extraction import DEFAULT_PALETTE
+
+def report_of(seconds, peak_bytes):
+    """A report holding one stage at two sizes"""
+    return {"params": {}, "results": [
+        {"n_images": n, "stage": "project", "seconds": s, "peak_bytes": b}
+        for n, s, b in zip((1000, 10000), seconds, peak_bytes)
+    ]}
+
+def test_synthetic_images_match_their_labels(tmp_path):
+    """Every image shows its quadrant colours, and a second call reuses the collection"""
+    data_dir = synthesize_dataset(tmp_path / "images", 300, random_state=3)
+    labels = np.load(data_dir / "labels.npy")
+    assert labels.shape == (300, 4)
+    for i in (0, 150, 299):
+        pixels = np.asarray(Image.open(data_dir / f"image_{i:04d}.png").convert("RGB"))
+        corners = pixels[0, 0], pixels[0, -1], pixels[-1, 0], pixels[-1, -1]
+        np.testing.assert_array_equal(corners, DEFAULT_PALETTE[labels[i]])
+
+    mtime = (data_dir / "labels.npy").stat().st_mtime_ns
+    synthesize_dataset(tmp_path / "images", 300, random_state=3)
+    assert (data_dir / "labels.npy").stat().st_mtime_ns == mtime
+
+def test_run_benchmark_measures_every_stage(tmp_path):
+    """One timing and peak per stage and size, surviving a JSON round trip"""
+    report = run_benchmark(tmp_path, sizes=[100, 200], n_iter=250, engine="exact")
+    assert [(r["n_images"], r["stage"]) for r in report["results"]] == [
+        (n, stage) for n in (100, 200) for stage in STAGES
+    ]
+    assert all(r["seconds"] >= 0 and r["peak_bytes"] >= 0 for r in report["results"])
+    assert report["params"]["n_iter"] == 250
+
+    save_report(report, tmp_path / "benchmark.json")
+    assert load_report(tmp_path / "benchmark.json") == report
+    assert len(format_report(report).splitlines()) == 1 + 2 * len(STAGES)
+
+def test_compare_flags_regressions():
+    """Slower or bigger stages are flagged, small or noisy ones are not"""
+    baseline = report_of((1.0, 100.0), (2**20, 2**30))
+    assert scaling_exponents(baseline)[10000, "project"] == pytest.approx(2.0)
+    assert compare_reports(baseline, report_of((1.1, 100.0), (2**20, 2**30))) == []
+
+    regressions = compare_reports(baseline, report_of((1.0, 200.0), (4 * 2**20, 2**31)))
+    assert [(r.n_images, r.metric) for r in regressions] == [
+        (1000, "peak_bytes"), (10000, "seconds"), (10000, "peak_bytes")
+    ]
+    assert regressions[1].ratio == 2.0
+    # Below the noise floor nothing counts
+    assert compare_reports(report_of((0.001, 1.0), (0, 0)), report_of((0.01, 1.0), (0, 0))) == []
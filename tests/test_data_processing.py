@@ -1,6 +1,13 @@
 # File: tests/test_data_processing.py
 
-from tsneakpeaks.data_processing import convert_to_sparse_one_hot
+import numpy as np
+import pytest
+from tsneakpeaks.data_processing import (
+    convert_to_sparse_one_hot,
+    encode_sparse_one_hot,
+    iter_sparse_one_hot,
+    unique_rows,
+)
 
 def test_sparse_one_hot_conversion():
     """
@@ -32,3 +39,55 @@ def test_sparse_one_hot_conversion():
 
     print("Test passed: Sparse one-hot encoding works correctly.")
 
+def test_batch_one_hot_matches_per_image():
+    """
+    Test that the batched encoder gives one row per image, matching the per-image encoder.
+    """
+    labels = np.array([[2, 5, 0, 8], [15, 15, 1, 0], [3, 3, 3, 3]], dtype=np.uint8)
+    num_quadrants, num_colors = 4, 16
+
+    batch = encode_sparse_one_hot(labels, num_colors, num_quadrants)
+
+    assert batch.shape == (3, num_quadrants * num_colors)
+    assert batch.dtype == np.float32
+    assert batch.nnz == labels.size
+    for row, image_data in zip(batch.toarray(), labels):
+        expected = convert_to_sparse_one_hot(image_data, num_quadrants, num_colors)
+        assert np.array_equal(row, expected.toarray().ravel())
+
+def test_batch_one_hot_chunked_and_streaming():
+    """
+    Test that chunked and streaming encodings agree with the single-pass encoding.
+    """
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 16, size=(1000, 4)).astype(np.uint8)
+
+    full = encode_sparse_one_hot(labels, 16)
+    chunked = encode_sparse_one_hot(labels, 16, chunk_size=97)
+    streamed = list(iter_sparse_one_hot(labels, 16, chunk_size=300))
+
+    assert (full != chunked).nnz == 0
+    assert [block.shape[0] for block in streamed] == [300, 300, 300, 100]
+    assert np.array_equal(np.vstack([b.toarray() for b in streamed]), full.toarray())
+
+def test_batch_one_hot_rejects_out_of_palette():
+    """
+    Test that colour indices outside the palette are rejected.
+    """
+    with pytest.raises(ValueError):
+        encode_sparse_one_hot(np.array([[0, 16, 1, 2]]), 16)
+
+def test_unique_rows_groups_dense_and_sparse_rows():
+    """
+    Test that identical rows are grouped like np.unique, for dense and one-hot input.
+    """
+    labels = np.random.default_rng(0).integers(0, 3, (1000, 4)).astype(np.uint8)
+    expected, expected_counts = np.unique(labels, axis=0, return_counts=True)
+
+    for data in (labels, encode_sparse_one_hot(labels, 3)):
+        index, inverse, counts = unique_rows(data, chunk_rows=128)
+        groups = labels[index]
+        assert np.array_equal(groups[inverse], labels)
+        order = np.lexsort(groups.T[::-1])
+        assert np.array_equal(groups[order], expected)
+        assert np.array_equal(counts[order], expected_counts)
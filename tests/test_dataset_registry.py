@@ -0,0 +1,116 @@
+# tests/test_dataset_registry.py
+import threading
+import numpy as np
+import pytest
+from PIL import Image
+from tsneakpeaks.dataset_registry import DatasetRegistry, dataset_bytes
+
+@pytest.fixture
+def data_root(tmp_path):
+    """Three small collections under one root, plus a directory without images"""
+    rng = np.random.default_rng(9)
+    for name in ("alpha", "beta", "gamma"):
+        data_dir = tmp_path / name
+        data_dir.mkdir()
+        for i in range(8):
+            Image.fromarray(rng.integers(0, 255, (16, 16, 3), dtype=np.uint8)).save(
+                data_dir / f"image_{i:04d}.png"
+            )
+        np.save(data_dir / "labels.npy", rng.integers(0, 16, (8, 4)) * 1.0)
+    (tmp_path / "empty").mkdir()
+    return tmp_path
+
+def wait(dataset):
+    dataset.job._thread.join(timeout=120)
+    assert dataset.job.ready
+
+def test_concurrent_requests_share_one_load(data_root):
+    """Many threads asking for a cold dataset get the same job"""
+    registry = DatasetRegistry(perplexity=2, n_iter=250)
+    assert registry.register_root(data_root) == ["alpha", "beta", "gamma"]
+
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(registry.get("beta"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(dataset.job) for dataset in seen}) == 1
+    assert registry.loaded() == ["beta"]
+    wait(seen[0])
+    with pytest.raises(KeyError):
+        registry.get("empty")
+
+def test_least_recently_viewed_is_evicted(data_root):
+    """Past the budget the least recently viewed dataset goes, never the current one"""
+    registry = DatasetRegistry(perplexity=2, n_iter=250)
+    registry.register_root(data_root)
+    for name in ("alpha", "beta"):
+        dataset = registry.get(name)
+        wait(dataset)
+        dataset.job.figure()
+    alpha_bytes = dataset_bytes(registry.get("alpha").job)
+    assert alpha_bytes > 0
+
+    # Viewing alpha again makes beta the least recently viewed
+    registry.max_bytes = int(2.5 * alpha_bytes)
+    wait(registry.get("gamma"))
+    registry.get("gamma").job.figure()
+    registry.get("gamma")
+    assert registry.loaded() == ["alpha", "gamma"]
+
+def test_peeking_never_loads_or_reorders(data_root):
+    """Status and thumbnails of a cold dataset come without a load, and do not count as views"""
+    registry = DatasetRegistry(perplexity=2, n_iter=250)
+    registry.register_root(data_root)
+    (data_root / "gamma" / "thumbnails").mkdir()
+    (data_root / "gamma" / "thumbnails" / "image_0000.png").write_bytes(b"thumbnail")
+
+    assert registry.peek("gamma") is None
+    assert registry.thumbnails("gamma").get("image_0000.png")[0] == b"thumbnail"
+    assert registry.loaded() == []
+
+    for name in ("alpha", "beta"):
+        wait(registry.get(name))
+    assert registry.peek("alpha").name == "alpha"
+    assert registry.thumbnails("alpha") is registry.peek("alpha").thumbnails
+    assert registry.loaded() == ["alpha", "beta"]
+    with pytest.raises(KeyError):
+        registry.peek("empty")
+
+def test_reviewing_a_draining_dataset_reuses_its_job(data_root, monkeypatch):
+    """An evicted job still running is taken back, never run twice on one directory"""
+    from tsneakpeaks import dataset_registry
+    loaded, release = threading.Event(), threading.Event()
+    generate = dataset_registry.generate_thumbnails
+
+    def slow_thumbnails(*args, **kwargs):
+        loaded.set()
+        release.wait(timeout=120)
+        return generate(*args, **kwargs)
+
+    monkeypatch.setattr(dataset_registry, "generate_thumbnails", slow_thumbnails)
+    registry = DatasetRegistry(max_bytes=0, perplexity=2, n_iter=250)
+    registry.register_root(data_root)
+
+    alpha = registry.get("alpha")
+    assert loaded.wait(timeout=120)
+    beta = registry.get("beta")
+    assert registry.loaded() == ["beta"]
+    assert alpha.job.running
+    # The evicted job has not exited, so its memory is still held
+    assert set(registry.memory_bytes()) == {"alpha", "beta"}
+
+    assert registry.get("alpha").job is alpha.job
+    assert registry.loaded() == ["alpha"]
+    release.set()
+    wait(alpha)
+
+    # Beta stayed evicted, so it stopped at its first snapshot and a new view loads it afresh
+    beta.job._thread.join(timeout=120)
+    assert beta.job.status()["state"] == "stopped"
+    assert not beta.job.resume()
+    reloaded = registry.get("beta")
+    assert reloaded.job is not beta.job
+    wait(reloaded)
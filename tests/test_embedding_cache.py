@@ -0,0 +1,45 @@
+# tests/test_embedding_cache.py
+import os
+import time
+import numpy as np
+from scipy.sparse import random as sparse_random
+from tsneakpeaks.embedding_cache import EmbeddingCache, cache_key
+
+def test_cache_key_depends_on_labels_and_params():
+    """Keys change with either the label fingerprint or any parameter"""
+    base = cache_key("abc", {"perplexity": 30, "n_iter": 1000})
+    assert base == cache_key("abc", {"n_iter": 1000, "perplexity": 30})
+    assert base != cache_key("abd", {"perplexity": 30, "n_iter": 1000})
+    assert base != cache_key("abc", {"perplexity": 30, "n_iter": 2000})
+
+def test_round_trip_is_memory_mapped(tmp_path):
+    """Coordinates and affinities come back memory-mapped and unchanged"""
+    cache = EmbeddingCache(tmp_path)
+    coords = np.random.rand(50, 3)
+    P = sparse_random(50, 50, density=0.1, format="csr", dtype=np.float32)
+
+    assert cache.get_coords("coords") is None
+    cache.put_coords("coords", coords)
+    cache.put_affinities("affinities", P)
+
+    cached = cache.get_coords("coords")
+    assert isinstance(cached, np.memmap)
+    assert np.array_equal(cached, coords)
+    assert (cache.get_affinities("affinities") != P).nnz == 0
+
+def test_lru_eviction(tmp_path):
+    """Least-recently-used entries are dropped once over budget"""
+    entry_size = 8000 + 128
+    cache = EmbeddingCache(tmp_path, max_bytes=int(2.5 * entry_size))
+    for key in ("a", "b"):
+        cache.put_coords(key, np.zeros(1000))
+
+    # Touch "a" so that "b" becomes the eviction candidate
+    os.utime(tmp_path / "b" / "meta.json", (time.time() - 60,) * 2)
+    assert cache.get_coords("a") is not None
+    cache.put_coords("c", np.zeros(1000))
+
+    assert cache.get_coords("b") is None
+    assert cache.get_coords("a") is not None
+    assert cache.get_coords("c") is not None
+    assert cache.size() <= cache.max_bytes
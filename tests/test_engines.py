@@ -0,0 +1,171 @@
+# tests/test_engines.py
+import numpy as np
+import pytest
+from tsneakpeaks import WhiteLodge
+from tsneakpeaks.affinities import cosine_knn_graph, joint_probabilities, normalize_rows
+from tsneakpeaks.checkpoints import load_checkpoint
+from tsneakpeaks.data_processing import encode_sparse_one_hot
+from tsneakpeaks.engines import (
+    ENGINES,
+    EmbeddingResult,
+    FFTInterpEngine,
+    get_engine,
+    select_engine,
+)
+
+@pytest.fixture
+def affinities():
+    """Joint probabilities for two groups of 40 points with distinct colour families"""
+    rng = np.random.default_rng(3)
+    labels = np.repeat(np.array([[0, 1, 2, 3], [8, 9, 10, 11]]), 40, axis=0)
+    flips = rng.random(labels.shape) < 0.25
+    labels[flips] = rng.integers(0, 16, flips.sum())
+    features = normalize_rows(encode_sparse_one_hot(labels, 16))
+    graph = cosine_knn_graph(features, n_neighbors=30)
+    return joint_probabilities(graph, perplexity=10)
+
+def test_registry_and_selection():
+    """All engines are registered and selection scales with N"""
+    assert {"exact", "barnes_hut", "fft_interp"} <= set(ENGINES)
+    assert select_engine(100) == "exact"
+    assert select_engine(10_000) == "barnes_hut"
+    assert select_engine(1_000_000) == "fft_interp"
+    assert select_engine(10_000, with_counts=True) == "fft_interp"
+    # Barnes-Hut stays cheaper for longer in 3D, where the FFT grid is cubic
+    assert select_engine(30_000) == "barnes_hut"
+    assert select_engine(30_000, n_components=2) == "fft_interp"
+    with pytest.raises(ValueError):
+        get_engine("umap")
+    with pytest.raises(ValueError):
+        WhiteLodge(engine="umap")
+
+def test_joint_probabilities_are_symmetric(affinities):
+    """P is symmetric and sums to one"""
+    assert abs(affinities.sum() - 1.0) < 1e-5
+    assert abs(affinities - affinities.T).max() < 1e-8
+
+@pytest.mark.parametrize("name, options", [
+    ("exact", {}),
+    ("barnes_hut", {}),
+    ("fft_interp", {"max_boxes": 12}),
+])
+def test_engines_share_result_interface(affinities, name, options):
+    """Every engine returns coords, KL divergence and iterations"""
+    engine = get_engine(name, exaggeration_iter=50, **options)
+    result = engine.embed(affinities, n_components=3, n_iter=100, random_state=0)
+
+    assert isinstance(result, EmbeddingResult)
+    assert result.coords.shape == (80, 3)
+    assert result.n_iter == 100
+    assert np.isfinite(result.kl_divergence) and result.kl_divergence >= 0.0
+
+    # The two groups end up apart
+    centres = result.coords[:40].mean(axis=0), result.coords[40:].mean(axis=0)
+    assert np.linalg.norm(centres[0] - centres[1]) > 1.0
+
+def test_fft_repulsion_matches_exact():
+    """Interpolated repulsion and normalisation agree with the O(N^2) sums"""
+    rng = np.random.default_rng(0)
+    Y = rng.standard_normal((300, 3))
+    dof = 2.0
+    dist2 = ((Y[:, None] - Y[None]) ** 2).sum(-1)
+    base = 1.0 / (1.0 + dist2 / dof)
+    W = base ** 1.5
+    np.fill_diagonal(W, 0.0)
+    K = W * base
+    expected_forces = K.sum(axis=1)[:, None] * Y - K @ Y
+
+    forces, Z = FFTInterpEngine().repulsive_forces(Y, dof)
+
+    assert abs(Z - W.sum()) / W.sum() < 1e-3
+    assert np.linalg.norm(forces - expected_forces) / np.linalg.norm(expected_forces) < 1e-2
+
+def test_3d_grid_is_capped_tighter():
+    """Wide 3D embeddings get fewer boxes than 2D ones unless max_boxes is set"""
+    engine = FFTInterpEngine()
+    assert engine.grid(0.0, 60.0, 3, 2.0).n_boxes == 30
+    assert engine.grid(0.0, 60.0, 2, 1.0).n_boxes == 50
+    assert FFTInterpEngine(max_boxes=40).grid(0.0, 60.0, 3, 2.0).n_boxes == 40
+
+def test_callbacks_report_progress(affinities):
+    """Callbacks see every reported iteration and can stop the run"""
+    seen = []
+    def callback(info):
+        seen.append((info.iteration, info.kl_divergence, info.grad_norm, info.elapsed))
+        return info.iteration >= 30
+
+    engine = get_engine("exact", exaggeration_iter=20)
+    result = engine.embed(affinities, n_iter=100, random_state=0, callbacks=[callback], callback_every=10)
+
+    assert [it for it, _, _, _ in seen] == [10, 20, 30]
+    assert all(np.isfinite(kl) and norm > 0 for _, kl, norm, _ in seen)
+    assert result.n_iter == 30
+
+def test_checkpoint_resume_matches_uninterrupted_run(affinities, tmp_path, caplog):
+    """A run stopped halfway and resumed ends exactly where an uninterrupted run does"""
+    checkpoint = tmp_path / "checkpoint.npz"
+    engine = get_engine("barnes_hut", exaggeration_iter=50)
+    full = engine.embed(affinities, n_iter=120, random_state=0)
+
+    engine.embed(affinities, n_iter=120, random_state=0, checkpoint_path=checkpoint,
+                 checkpoint_every=25, callbacks=[lambda info: info.iteration == 70])
+    state = load_checkpoint(checkpoint)
+    assert state.iteration == 70
+
+    # Another seed, other settings or a run that ends before the checkpoint start over
+    reseeded = engine.embed(affinities, n_iter=120, random_state=1, checkpoint_path=checkpoint)
+    np.testing.assert_allclose(reseeded.coords, engine.embed(affinities, n_iter=120, random_state=1).coords)
+    shorter = engine.embed(affinities, n_iter=60, random_state=0, checkpoint_path=checkpoint)
+    assert shorter.n_iter == 60
+    np.testing.assert_allclose(shorter.coords, engine.embed(affinities, n_iter=60, random_state=0).coords)
+    fingerprint = engine.run_fingerprint(affinities, 3, random_state=0)
+    assert get_engine("barnes_hut", exaggeration_iter=50, angle=0.3).run_fingerprint(affinities, 3, 0) != fingerprint
+    assert get_engine("fft_interp", exaggeration_iter=50).run_fingerprint(affinities, 3, 0) != fingerprint
+
+    with caplog.at_level("INFO"):
+        resumed = engine.embed(affinities, n_iter=120, random_state=0, checkpoint_path=checkpoint)
+    assert "Resuming from checkpoint at iteration 70" in caplog.text
+    assert resumed.n_iter == 120
+    np.testing.assert_allclose(resumed.coords, full.coords)
+
+def test_adaptive_schedule_stops_once_kl_flattens(affinities, caplog):
+    """The adaptive run stops once the KL flattens, at nearly the KL of the full run"""
+    fixed = get_engine("exact").embed(affinities, n_iter=3000, random_state=0)
+    with caplog.at_level("INFO"):
+        adaptive = get_engine("exact", schedule="adaptive").embed(affinities, n_iter=3000, random_state=0)
+
+    assert adaptive.n_iter < 1000 and not adaptive.interrupted
+    assert adaptive.kl_divergence < 1.01 * fixed.kl_divergence
+    assert "Early exaggeration flattened" in caplog.text
+    with pytest.raises(ValueError):
+        get_engine("exact", schedule="annealed")
+
+def test_resumed_adaptive_run_stays_past_exaggeration(affinities, tmp_path):
+    """Checkpoints remember where the schedule ended exaggeration"""
+    checkpoint = tmp_path / "checkpoint.npz"
+    engine = get_engine("exact", schedule="adaptive")
+    full = engine.embed(affinities, n_iter=3000, random_state=0)
+    engine.embed(affinities, n_iter=3000, random_state=0, checkpoint_path=checkpoint,
+                 callbacks=[lambda info: info.iteration == 400], callback_every=100)
+    assert engine.exaggeration_iter <= load_checkpoint(checkpoint).exaggeration_end < 400
+
+    resumed = engine.embed(affinities, n_iter=3000, random_state=0, checkpoint_path=checkpoint)
+    # The KL window starts over after a resume, so the run may stop one window later
+    assert full.n_iter <= resumed.n_iter <= full.n_iter + engine.kl_window
+    assert resumed.kl_divergence == pytest.approx(full.kl_divergence, rel=0.01)
+
+@pytest.mark.parametrize("name", ["exact", "fft_interp"])
+def test_counts_weigh_points(affinities, name):
+    """Counts of one change nothing, and uniform counts only rescale the member gradient"""
+    engine = get_engine(name)
+    Y = np.random.default_rng(0).standard_normal((80, 3))
+    kl, grad = engine.objective(affinities, Y, 2.0, True)
+    kl_ones, grad_ones = engine.objective(affinities, Y, 2.0, True, np.ones(80))
+    kl_threes, grad_threes = engine.objective(affinities, Y, 2.0, True, np.full(80, 3.0))
+
+    # The interpolation grid holds float32 charges
+    np.testing.assert_allclose([kl_ones, kl_threes], [kl, kl], rtol=1e-5)
+    np.testing.assert_allclose(grad_ones, grad, atol=1e-7)
+    np.testing.assert_allclose(3.0 * grad_threes, grad, atol=1e-7)
+    with pytest.raises(ValueError):
+        get_engine("barnes_hut").embed(affinities, n_iter=1, counts=np.ones(80))
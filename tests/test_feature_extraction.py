@@ -0,0 +1,69 @@
+# tests/test_feature_extraction.py
+import numpy as np
+from pathlib import Path
+import pytest
+from PIL import Image
+from tsneakpeaks import BlackLodge
+from tsneakpeaks.feature_extraction import (
+    DEFAULT_PALETTE,
+    extract_labels,
+    grid_labels,
+    load_palette,
+    nearest_palette_colours,
+)
+
+@pytest.fixture
+def quadrant_images(tmp_path):
+    """Quadrant images as examples/generate_test.py draws them, without labels.npy"""
+    rng = np.random.default_rng(11)
+    labels = np.array([rng.choice(16, 4, replace=False) for _ in range(24)])
+    for i, colours in enumerate(labels):
+        img = np.zeros((160, 160, 3), dtype=np.uint8)
+        img[:80, :80], img[:80, 80:] = DEFAULT_PALETTE[colours[0]], DEFAULT_PALETTE[colours[1]]
+        img[80:, :80], img[80:, 80:] = DEFAULT_PALETTE[colours[2]], DEFAULT_PALETTE[colours[3]]
+        Image.fromarray(img).save(tmp_path / f"image_{i:04d}.png")
+    return tmp_path, labels
+
+def test_nearest_palette_colours_tolerates_noise():
+    """Slightly off colours snap back to their palette entry"""
+    rng = np.random.default_rng(0)
+    expected = rng.integers(0, 16, 500)
+    pixels = DEFAULT_PALETTE[expected].astype(int) + rng.integers(-20, 21, (500, 3))
+    assert np.array_equal(nearest_palette_colours(np.clip(pixels, 0, 255), DEFAULT_PALETTE), expected)
+
+def test_grid_labels_for_other_grids():
+    """Any N x M grid is labelled in row-major order"""
+    cells = np.arange(6).reshape(2, 3)
+    image = DEFAULT_PALETTE[np.repeat(np.repeat(cells, 10, axis=0), 7, axis=1)]
+    assert grid_labels(image, DEFAULT_PALETTE, grid=(2, 3)).tolist() == [0, 1, 2, 3, 4, 5]
+
+def test_enter_extracts_missing_labels(quadrant_images):
+    """Without labels.npy the Black Lodge derives them from the pixels and saves them"""
+    data_dir, expected = quadrant_images
+    lodge = BlackLodge(data_dir)
+    image_paths, labels = lodge.enter()
+
+    assert len(image_paths) == 24
+    np.testing.assert_array_equal(labels, expected)
+    np.testing.assert_array_equal(np.load(data_dir / "labels.npy"), expected)
+
+    threaded = lodge.extract_features(n_workers=2, chunk_size=5)
+    processes = lodge.extract_features(n_workers=2, chunk_size=5, use_processes=True)
+    np.testing.assert_array_equal(threaded, expected)
+    np.testing.assert_array_equal(processes, expected)
+
+def test_extract_labels_from_palette_images(tmp_path):
+    """Palette-mode and RGBA images are labelled like their RGB pixels"""
+    cells = DEFAULT_PALETTE[np.array([[3, 7], [11, 15]])]
+    image = Image.fromarray(np.repeat(np.repeat(cells, 128, axis=0), 128, axis=1))
+    image.quantize(16).save(tmp_path / "palette.png")
+    image.convert("RGBA").save(tmp_path / "alpha.png")
+    assert Image.open(tmp_path / "palette.png").mode == "P"
+
+    labels = extract_labels([tmp_path / "palette.png", tmp_path / "alpha.png"])
+    assert labels.tolist() == [[3, 7, 11, 15]] * 2
+
+def test_load_palette():
+    """The example palette file loads as RGB rows"""
+    palette = load_palette(Path(__file__).parents[1] / "examples" / "twin_peaks.palette")
+    assert palette.shape == (16, 3) and palette.dtype == np.uint8
@@ -0,0 +1,41 @@
+# tests/test_landmarks.py
+import numpy as np
+import pytest
+from tsneakpeaks import WhiteLodge
+from tsneakpeaks.affinities import normalize_rows
+from tsneakpeaks.landmarks import kmeans_plus_plus, landmark_count, select_landmarks
+
+@pytest.fixture
+def family_labels(make_family_labels):
+    """Three colour families of 100 images each"""
+    return make_family_labels(100, seed=11)
+
+def test_kmeans_plus_plus_covers_every_family():
+    """Seeding reaches a small family that uniform sampling would miss, and stops once rows run out"""
+    features = normalize_rows(np.repeat(np.eye(3), [500, 500, 5], axis=0))
+    landmarks = kmeans_plus_plus(features, 3, pool_size=len(features), random_state=0)
+    assert sorted(np.argmax(features[landmarks], axis=1)) == [0, 1, 2]
+    assert len(kmeans_plus_plus(features, 10, pool_size=len(features), random_state=0)) == 3
+
+    assert len(select_landmarks(features, 50, "random")) == 50
+    with pytest.raises(ValueError):
+        select_landmarks(features, 3, "farthest")
+    assert landmark_count(10**6, 0.01) == 10**4
+    assert landmark_count(2000, 0.01) == 1000
+
+def test_landmark_project_keeps_the_families_apart(family_labels, monkeypatch):
+    """Only the landmarks are embedded, every other point lands with its family"""
+    monkeypatch.setattr("tsneakpeaks.landmarks.MIN_LANDMARKS", 10)
+    wl = WhiteLodge(perplexity=10, n_iter=250, landmarks=0.2)
+    seen = []
+    coords_3d = wl.project(wl.prepare_data(family_labels, 4, 16),
+                           callbacks=[lambda info: seen.append(info.coords.shape)], callback_every=100)
+
+    assert coords_3d.shape == (300, 3)
+    assert len(wl.landmark_rows) == 60
+    assert wl.affinities.shape == (60, 60)
+    assert seen == [(300, 3)] * 2
+    family = np.arange(300) // 100
+    centres = np.array([coords_3d[wl.landmark_rows][family[wl.landmark_rows] == f].mean(axis=0) for f in range(3)])
+    nearest = np.argmin(((coords_3d[:, None] - centres[None]) ** 2).sum(axis=-1), axis=1)
+    assert (nearest == family).mean() > 0.9
@@ -0,0 +1,93 @@
+# tests/test_manifest.py
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from tsneakpeaks import BlackLodge
+from tsneakpeaks.feature_extraction import DEFAULT_PALETTE
+from tsneakpeaks.manifest import Manifest
+
+def draw(path, colours):
+    """Quadrant image in the given palette colours"""
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+    img[:32, :32], img[:32, 32:] = DEFAULT_PALETTE[colours[0]], DEFAULT_PALETTE[colours[1]]
+    img[32:, :32], img[32:, 32:] = DEFAULT_PALETTE[colours[2]], DEFAULT_PALETTE[colours[3]]
+    Image.fromarray(img).save(path)
+
+@pytest.fixture
+def image_dir(tmp_path):
+    """Six quadrant images, image i coloured (i, i+1, i+2, i+3)"""
+    for i in range(6):
+        draw(tmp_path / f"image_{i:04d}.png", [i, i + 1, i + 2, i + 3])
+    return tmp_path
+
+def age(path, seconds=60):
+    """Move a file or directory mtime into the past, beyond the racy window"""
+    mtime = os.stat(path).st_mtime - seconds
+    os.utime(path, (mtime, mtime))
+
+def test_scan_detects_added_changed_and_deleted(image_dir):
+    """Later scans report only the differences and keep every surviving index"""
+    age(image_dir)
+    manifest = Manifest(image_dir)
+    assert len(manifest.scan().added) == 6
+    np.save(image_dir / "labels.npy", np.zeros((6, 4), dtype=np.uint8))
+    manifest.labels_written(image_dir / "labels.npy")
+    manifest.save()
+
+    manifest = Manifest(image_dir)
+    assert manifest.load()
+    assert not manifest.scan()
+
+    (image_dir / "image_0001.png").unlink()
+    draw(image_dir / "image_0003.png", [9, 9, 9, 9])
+    os.utime(image_dir / "image_0003.png", ns=(0, 1))
+    draw(image_dir / "image_0006.png", [6, 7, 8, 9])
+    changes = manifest.scan()
+
+    assert changes.deleted == ["image_0001.png"]
+    assert changes.changed == ["image_0003.png"]
+    assert changes.added == ["image_0006.png"]
+    assert manifest.index.tolist() == [0, 2, 3, 4, 5, 6]
+    assert manifest.path_of(6) == str(image_dir / "image_0006.png")
+    assert manifest.index_of(image_dir / "image_0004.png") == 4
+    assert manifest.needs_extraction.tolist() == [False, False, True, False, False, True]
+
+def test_unchanged_directory_is_not_listed(image_dir):
+    """With the directory mtime unchanged, files are only stat'ed"""
+    age(image_dir)
+    manifest = Manifest(image_dir)
+    manifest.scan()
+    manifest.save()
+
+    # Invisible to a scan that trusts the directory mtime
+    draw(image_dir / "image_0099.png", [0, 0, 0, 0])
+    os.utime(image_dir, ns=(0, manifest.dir_mtime_ns))
+
+    manifest = Manifest(image_dir)
+    manifest.load()
+    assert not manifest.scan().added
+
+def test_enter_reextracts_only_changed_images(image_dir, caplog):
+    """The Black Lodge keeps labels of untouched images and decodes only the rest"""
+    first = BlackLodge(image_dir)
+    _, labels = first.enter()
+    assert labels[:, 0].tolist() == [0, 1, 2, 3, 4, 5]
+
+    (image_dir / "image_0002.png").unlink()
+    draw(image_dir / "image_0004.png", [15, 14, 13, 12])
+    os.utime(image_dir / "image_0004.png", ns=(0, 1))
+    draw(image_dir / "image_0007.png", [7, 8, 9, 10])
+
+    with caplog.at_level("INFO"):
+        paths, labels = BlackLodge(image_dir).enter()
+
+    assert "Re-extracting labels for 2 new or changed images" in caplog.text
+    assert [os.path.basename(p) for p in paths] == [
+        "image_0000.png", "image_0001.png", "image_0003.png",
+        "image_0004.png", "image_0005.png", "image_0007.png",
+    ]
+    assert labels.tolist() == [
+        [0, 1, 2, 3], [1, 2, 3, 4], [3, 4, 5, 6],
+        [15, 14, 13, 12], [5, 6, 7, 8], [7, 8, 9, 10],
+    ]
@@ -0,0 +1,60 @@
+# tests/test_neighbour_index.py
+import numpy as np
+from scipy.sparse import vstack
+from tsneakpeaks.affinities import cosine_knn_graph, cosine_knn_query, knn_from_graph, normalize_rows
+from tsneakpeaks.data_processing import array_fingerprint, encode_sparse_one_hot
+from tsneakpeaks.neighbour_index import NeighbourIndex
+
+def make_features(n_samples=2000, seed=0):
+    """One-hot features drawn around 20 colour patterns"""
+    rng = np.random.default_rng(seed)
+    patterns = rng.integers(0, 16, (20, 4))
+    labels = patterns[rng.integers(0, 20, n_samples)]
+    flips = rng.random(labels.shape) < 0.3
+    labels[flips] = rng.integers(0, 16, flips.sum())
+    return normalize_rows(encode_sparse_one_hot(labels, 16))
+
+def test_index_recall_and_graph_layout():
+    """The index finds (near-)exact neighbours and exposes a cosine_knn_graph-style graph"""
+    features = make_features()
+    index = NeighbourIndex(n_neighbors=15, n_trees=4).build(features)
+
+    assert index.indices_.shape == (2000, 15)
+    assert index.estimate_recall(features, n_queries=200) > 0.95
+
+    _, exact = knn_from_graph(cosine_knn_graph(features, 15))
+    _, approx = knn_from_graph(index.graph())
+    assert approx.shape == exact.shape
+    assert np.mean(approx[:, -1] <= exact[:, -1] + 1e-6) > 0.9
+
+def test_index_round_trip(tmp_path):
+    """Saved indexes load back and are matched by feature fingerprint"""
+    features = make_features(500)
+    index = NeighbourIndex(n_neighbors=10, n_trees=2).build(features)
+    index.save(tmp_path / "index.npz")
+
+    loaded = NeighbourIndex.load(tmp_path / "index.npz")
+    assert np.array_equal(loaded.indices_, index.indices_)
+    assert loaded.matches(array_fingerprint(features), 10)
+    assert not loaded.matches(array_fingerprint(features), 20)
+    assert not loaded.matches(array_fingerprint(make_features(500, seed=1)), 10)
+    # The build settings survive the round trip and must match when asked for
+    assert (loaded.n_trees, loaded.random_state) == (2, 42)
+    assert loaded.matches(array_fingerprint(features), 10, n_trees=2, random_state=42)
+    assert not loaded.matches(array_fingerprint(features), 10, n_trees=8)
+    assert not loaded.matches(array_fingerprint(features), 10, random_state=0)
+
+def test_query_and_extend():
+    """New points find their reference neighbours and can be appended to the index"""
+    features = make_features()
+    queries = make_features(200, seed=0)[:200]
+    index = NeighbourIndex(n_neighbors=15, n_trees=4).build(features)
+
+    indices, distances = index.query(features, queries)
+    _, exact = cosine_knn_query(features, queries, 15)
+    assert indices.shape == (200, 15)
+    assert np.mean(distances[:, -1] <= exact[:, -1] + 1e-6) > 0.9
+
+    index.extend(vstack([features, queries]), indices, distances)
+    assert index.indices_.shape == (2200, 15)
+    assert index.matches(array_fingerprint(vstack([features, queries])), 15)
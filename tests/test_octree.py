@@ -0,0 +1,49 @@
+# tests/test_octree.py
+import numpy as np
+import pytest
+from tsneakpeaks import Visualizer
+from tsneakpeaks.octree import Octree
+
+@pytest.fixture
+def cloud():
+    """A dense blob of 20000 points plus 50 scattered outliers"""
+    rng = np.random.default_rng(3)
+    blob = rng.normal(0, 1, (20000, 3))
+    outliers = rng.uniform(-40, 40, (50, 3))
+    return np.vstack([blob, outliers]).astype(np.float32)
+
+def test_overview_keeps_density_and_outliers(cloud):
+    """The overview is close to the budget, samples the blob evenly and keeps every outlier"""
+    shown = Octree(cloud, leaf_size=256).overview(2000)
+
+    assert 1500 <= len(shown) <= 2500
+    # A plain 10% sample would keep about 5 of the 50 outliers
+    assert np.isin(np.arange(20000, 20050), shown).sum() >= 40
+    blob = shown[shown < 20000]
+    inner = np.linalg.norm(cloud[blob], axis=1) < 1.0
+    expected = np.mean(np.linalg.norm(cloud[:20000], axis=1) < 1.0)
+    assert abs(inner.mean() - expected) < 0.05
+
+def test_query_matches_brute_force(cloud):
+    """A region query returns exactly the points inside the box"""
+    octree = Octree(cloud, leaf_size=256)
+    low, high = np.array([-0.5, -1.0, 0.0]), np.array([1.0, 0.5, 2.0])
+    expected = np.flatnonzero(np.all((cloud >= low) & (cloud <= high), axis=1))
+
+    np.testing.assert_array_equal(octree.query(low, high), expected)
+    assert len(octree.query([100, 100, 100], [101, 101, 101])) == 0
+
+def test_visualizer_draws_level_of_detail(cloud):
+    """Large embeddings are thinned, and markers carry their original indices"""
+    labels = np.zeros((len(cloud), 4))
+    paths = [f"image_{i:05d}.png" for i in range(len(cloud))]
+    visualizer = Visualizer(max_points=1000)
+
+    overview = visualizer.create_figure(cloud, labels, paths)
+    indices = np.asarray(overview.data[0].customdata)
+    assert len(indices) < 2000
+    np.testing.assert_allclose(overview.data[0].x, cloud[indices, 0])
+
+    region = visualizer.create_figure(cloud, labels, paths, region=([-0.2] * 3, [0.2] * 3))
+    inside = np.all(np.abs(cloud) <= 0.2, axis=1).sum()
+    assert len(region.data[0].customdata) == inside
@@ -0,0 +1,47 @@
+# tests/test_owl_cave.py
+import json
+import numpy as np
+from PIL import Image
+from tsneakpeaks import TSneakPeaks
+from tsneakpeaks.owl_cave import Metrics
+
+def test_nested_stages_and_exports(tmp_path):
+    """Stages nest, counters land on the innermost stage, JSON lines and Prometheus text agree"""
+    metrics = Metrics(jsonl_path=tmp_path / "metrics.jsonl", profile_dir=tmp_path / "profiles")
+    for _ in range(2):
+        with metrics.stage("outer", rows=10):
+            with metrics.stage("inner"):
+                block = np.ones(1 << 22)
+                metrics.count(nnz=int(block.sum()))
+            metrics.count(iterations=3)
+
+    lines = [json.loads(line) for line in (tmp_path / "metrics.jsonl").read_text().splitlines()]
+    assert [(line["stage"], line["parent"]) for line in lines] == [("inner", "outer"), ("outer", None)] * 2
+    assert lines[0]["counters"] == {"nnz": 1 << 22}
+    assert lines[1]["counters"] == {"rows": 10, "iterations": 3}
+    assert lines[1]["wall_seconds"] >= lines[0]["wall_seconds"] >= 0
+    if lines[0]["peak_rss_bytes"] is not None:
+        # The inner stage's allocation counts towards the outer one's peak too
+        assert lines[1]["peak_rss_bytes"] >= lines[0]["peak_rss_bytes"]
+
+    text = metrics.to_prometheus()
+    assert 'tsneakpeaks_stage_runs_total{stage="inner"} 2' in text
+    assert f'tsneakpeaks_nnz{{stage="inner"}} {1 << 22}' in text
+    # Only outermost stages are profiled; nested ones show up inside them
+    assert sorted(p.name for p in (tmp_path / "profiles").glob("*.prof")) == ["001_outer.prof", "002_outer.prof"]
+
+def test_pipeline_stages_share_metrics(tmp_path):
+    """Every component reports into the TSneakPeaks metrics, nested under its stage"""
+    for i in range(30):
+        Image.fromarray(np.random.randint(0, 255, (16, 16, 3), dtype=np.uint8)).save(tmp_path / f"image_{i:04d}.png")
+    np.save(tmp_path / "labels.npy", np.random.rand(30, 10))
+    peaks = TSneakPeaks(str(tmp_path), n_iter=250, use_cache=False)
+    peaks.load_data()
+    peaks.visualize()
+
+    parents = {record.name: record.parent for record in peaks.metrics.records}
+    assert parents["enter"] == parents["validate_data"] == parents["preprocess_labels"] == "load_data"
+    assert parents["embed"] == "project" and parents["project"] == "reduce_dimensions"
+    assert parents["create_figure"] == "visualize"
+    assert peaks.metrics.totals["embed"]["counters"]["iterations"] == 250
+    assert peaks.metrics.totals["create_figure"]["counters"] == {"rows": 30, "points": 30}
@@ -0,0 +1,54 @@
+# tests/test_packed_codes.py
+import numpy as np
+import pytest
+from tsneakpeaks import WhiteLodge
+from tsneakpeaks.affinities import cosine_knn_graph, normalize_rows
+from tsneakpeaks.data_processing import encode_sparse_one_hot
+from tsneakpeaks.packed_codes import PackedLabels, match_knn_graph
+
+def test_pack_round_trip():
+    """Four quadrants of 16 colours fit in a uint16 and unpack to the same labels"""
+    labels = np.random.default_rng(0).integers(0, 16, (500, 4)).astype(np.uint8)
+    codes = PackedLabels.from_labels(labels, 16, chunk_rows=64)
+
+    assert codes.codes.dtype == np.uint16
+    assert codes.shape == (500, 64)
+    np.testing.assert_array_equal(codes.unpack(), labels)
+    assert (codes.to_one_hot() != encode_sparse_one_hot(labels, 16)).nnz == 0
+    with pytest.raises(ValueError):
+        PackedLabels.from_labels(np.array([[0, 16, 1, 2]]), 16)
+    with pytest.raises(ValueError):
+        PackedLabels.from_labels(np.random.rand(5, 4), 16)
+
+@pytest.mark.parametrize("num_quadrants, num_colors", [(4, 16), (9, 16), (4, 5)])
+def test_match_knn_matches_one_hot_cosine(num_quadrants, num_colors):
+    """Same distances as cosine on one-hot rows; ties go to the lower index"""
+    labels = np.random.default_rng(1).integers(0, num_colors, (1500, num_quadrants)).astype(np.uint8)
+    codes = PackedLabels.from_labels(labels, num_colors)
+    cosine = cosine_knn_graph(normalize_rows(encode_sparse_one_hot(labels, num_colors)), 20)
+    packed = match_knn_graph(codes, 20, chunk_rows=100)
+
+    expected = np.sort(cosine.data.reshape(1500, 21), axis=1)
+    distances = packed.data.reshape(1500, 21)
+    np.testing.assert_allclose(distances, expected, atol=1e-6)
+
+    # Within a row, neighbours at equal distance are listed by index
+    indices = packed.indices.reshape(1500, 21)
+    order = np.lexsort((indices, distances), axis=1)
+    np.testing.assert_array_equal(order, np.tile(np.arange(21), (1500, 1)))
+
+def test_white_lodge_projects_packed_codes(make_family_labels):
+    """Packed codes go through project, dedup and transform like one-hot rows"""
+    labels = make_family_labels(40, seed=2, flip_rate=0.2)
+    families = make_family_labels(1, seed=2, flip_rate=0.0)
+
+    wl = WhiteLodge(perplexity=10, n_iter=250, dedup=True)
+    codes = wl.prepare_data(labels, 4, 16, packed=True)
+    coords_3d = wl.project(codes)
+    assert coords_3d.shape == (120, 3)
+    assert wl.row_inverse is not None
+
+    new_coords = wl.transform(PackedLabels.from_labels(families, 16))
+    centres = coords_3d.reshape(3, 40, 3).mean(axis=1)
+    nearest = np.argmin(np.linalg.norm(new_coords[:, None] - centres[None], axis=-1), axis=1)
+    np.testing.assert_array_equal(nearest, [0, 1, 2])
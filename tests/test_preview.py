@@ -0,0 +1,66 @@
+# tests/test_preview.py
+import numpy as np
+import pytest
+from PIL import Image
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import normalize
+from tsneakpeaks import TSneakPeaks, WhiteLodge
+from tsneakpeaks.engines import Engine
+from tsneakpeaks.preview import INIT_SCALE, randomized_pca
+
+@pytest.fixture
+def family_labels(make_family_labels):
+    """Three colour families of 50 images each"""
+    return make_family_labels(50, seed=3)
+
+def test_randomized_pca_matches_exact_pca(family_labels):
+    """Blocked randomized PCA converges to the exact components, whatever the input format"""
+    wl = WhiteLodge()
+    one_hot = wl.prepare_data(family_labels, 4, 16)
+    expected = PCA(3).fit_transform(normalize(one_hot.toarray()))
+    coords = randomized_pca(one_hot, n_power_iter=20, chunk_rows=40)
+    np.testing.assert_allclose(np.abs(coords), np.abs(expected), atol=1e-5)
+    packed = wl.prepare_data(family_labels, 4, 16, packed=True)
+    np.testing.assert_allclose(randomized_pca(packed, n_power_iter=20), coords, atol=1e-12)
+    # Fewer features than components leaves the missing ones at zero
+    assert np.all(randomized_pca(np.random.rand(20, 2))[:, 2] == 0)
+
+def test_pca_init_starts_from_the_preview(family_labels, monkeypatch):
+    """With init='pca' the engine starts from the scaled preview, and the cache key says so"""
+    starts = []
+    embed = Engine.embed
+    def recording_embed(self, P, **kwargs):
+        starts.append(kwargs["init"])
+        return embed(self, P, **kwargs)
+    monkeypatch.setattr(Engine, "embed", recording_embed)
+
+    wl = WhiteLodge(perplexity=10, n_iter=250, init="pca")
+    features = wl.prepare_data(family_labels, 4, 16)
+    wl.project(features)
+    WhiteLodge(perplexity=10, n_iter=250).project(features)
+
+    np.testing.assert_allclose(starts[0], wl.preview(features) * INIT_SCALE / wl.preview(features)[:, 0].std())
+    assert starts[1] is None
+
+    assert WhiteLodge(init="pca").embedding_params()["init"] == "pca"
+    assert "init" not in WhiteLodge().embedding_params()
+    with pytest.raises(ValueError):
+        WhiteLodge(init="spectral")
+
+def test_visualize_preview_without_tsne(tmp_path, family_labels):
+    """The preview is drawn straight after loading, and t-SNE never runs"""
+    for i in range(len(family_labels)):
+        Image.fromarray(np.full((8, 8, 3), i, dtype=np.uint8)).save(tmp_path / f"image_{i:04d}.png")
+    np.save(tmp_path / "labels.npy", family_labels)
+    peaks = TSneakPeaks(str(tmp_path), use_cache=False)
+    peaks.load_data()
+    fig = peaks.visualize(preview=True)
+
+    assert len(fig.data[0].x) == len(family_labels)
+    assert peaks.coords_3d is None
+    assert peaks.preview_coords.shape == (len(family_labels), 3)
+    # Principal components of the one-hot rows, not of the raw colour indices
+    one_hot = WhiteLodge().prepare_data(family_labels, 4, 16)
+    expected = randomized_pca(one_hot, random_state=peaks.white_lodge.random_state)
+    np.testing.assert_allclose(peaks.preview_coords, expected, atol=1e-9)
+    assert "embed" not in peaks.metrics.totals
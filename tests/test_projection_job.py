@@ -0,0 +1,49 @@
+# tests/test_projection_job.py
+import numpy as np
+import pytest
+from PIL import Image
+from tsneakpeaks import TSneakPeaks
+from tsneakpeaks.checkpoints import CHECKPOINT_FILE
+from tsneakpeaks.projection_job import ProjectionJob
+
+@pytest.fixture
+def test_data_dir(tmp_path):
+    """Twelve random images with three families of labels"""
+    rng = np.random.default_rng(5)
+    for i in range(12):
+        img = rng.integers(0, 255, (32, 32, 3), dtype=np.uint8)
+        Image.fromarray(img).save(tmp_path / f"image_{i:04d}.png")
+    families = np.repeat(np.array([[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10, 11]]), 4, axis=0)
+    np.save(tmp_path / "labels.npy", families)
+    return tmp_path
+
+def test_job_streams_snapshots_until_ready(test_data_dir):
+    """start() returns at once and the job publishes snapshots, then the final embedding"""
+    peaks = TSneakPeaks(str(test_data_dir), perplexity=3, n_iter=300)
+    job = ProjectionJob(peaks, snapshot_every=25)
+    assert job.status()["state"] == "pending"
+    assert job.figure() is None
+
+    job.start()
+    job._thread.join(timeout=120)
+
+    status = job.status()
+    assert status["state"] == "ready" and status["ready"]
+    assert status["version"] > 2
+    assert status["iteration"] == 300
+    assert len(job.figure().data[0].x) == 12
+    np.testing.assert_array_equal(job.snapshot, peaks.coords_3d)
+
+def test_stopped_job_keeps_checkpoint_not_cache(test_data_dir):
+    """A stopped projection can resume from its checkpoint but is never cached as finished"""
+    peaks = TSneakPeaks(str(test_data_dir), perplexity=3, n_iter=300)
+    job = ProjectionJob(peaks, snapshot_every=25)
+    job.stop()
+    job.start()
+    job._thread.join(timeout=120)
+
+    assert job.status()["state"] == "stopped"
+    assert peaks.white_lodge.result.interrupted
+    assert peaks.white_lodge.result.n_iter == 25
+    assert (test_data_dir / CHECKPOINT_FILE).exists()
+    assert not list(peaks.cache.cache_dir.glob("*/coords.npy"))
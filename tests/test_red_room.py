@@ -0,0 +1,22 @@
+# tests/test_red_room.py
+import numpy as np
+from tsneakpeaks import Visualizer
+
+def test_compact_payload():
+    """Compact figures ship typed arrays and hover by file name"""
+    rng = np.random.default_rng(0)
+    coords = rng.normal(size=(5000, 3))
+    labels = rng.integers(0, 16, (5000, 4))
+    paths = [f"test_data/image_{i:05d}.png" for i in range(5000)]
+
+    visualizer = Visualizer(max_points=None)
+    compact = visualizer.create_figure(coords, labels, paths)
+    verbose = Visualizer(max_points=None, compact=False).create_figure(coords, labels, paths)
+
+    trace = compact.data[0]
+    assert trace.x.dtype == np.float32
+    assert trace.marker.color.dtype == np.uint8
+    assert trace.text[42] == "image_00042.png"
+    assert "%{text}" in trace.hovertemplate
+    assert visualizer.image_name(int(trace.customdata[42])) == "image_00042.png"
+    assert len(compact.to_json()) < 0.7 * len(verbose.to_json())
@@ -0,0 +1,66 @@
+# tests/test_similarity.py
+import numpy as np
+import pytest
+from PIL import Image
+from tsneakpeaks import TSneakPeaks
+from tsneakpeaks.feature_extraction import DEFAULT_PALETTE
+from tsneakpeaks.similarity import SimilarityIndex
+
+def brute_force(labels, index, k, num_colors, metric):
+    """Top-k by scoring every image against one-hot vectors, ties to lower ids"""
+    terms = np.arange(labels.shape[1]) * num_colors + labels
+    one_hot = np.zeros((len(labels), labels.shape[1] * num_colors))
+    np.put_along_axis(one_hot, terms, 1.0, axis=1)
+    if metric == "cosine":
+        df = one_hot.sum(axis=0)
+        one_hot *= np.log((1 + len(labels)) / (1 + df)) + 1.0
+        one_hot /= np.linalg.norm(one_hot, axis=1, keepdims=True)
+    scores = one_hot @ one_hot[index]
+    scores[index] = -np.inf
+    order = np.lexsort((np.arange(len(labels)), -scores))
+    order = order[scores[order] > 0][:k]
+    return order, scores[order]
+
+@pytest.mark.parametrize("metric", ["count", "cosine"])
+def test_matches_brute_force(metric):
+    """Ids and scores agree with scoring every image, including tie order"""
+    labels = np.random.default_rng(0).integers(0, 4, (2000, 4), dtype=np.uint8)
+    index = SimilarityIndex(labels, num_colors=4, chunk_rows=300)
+    for query in (0, 17, 1999):
+        ids, scores = index.similar(query, k=25, metric=metric)
+        expected_ids, expected_scores = brute_force(labels, query, 25, 4, metric)
+        assert ids.tolist() == expected_ids.tolist()
+        np.testing.assert_allclose(scores, expected_scores)
+
+def test_fine_grids_do_not_overflow():
+    """A 5x5 grid of 16 colours needs 100 bits per image and still matches brute force"""
+    rng = np.random.default_rng(1)
+    labels = rng.integers(0, 16, (1000, 25), dtype=np.uint8)
+    labels[500:] = labels[:500]
+    index = SimilarityIndex(labels, num_colors=16, chunk_rows=300)
+    assert len(index.rows) == 500
+    np.testing.assert_array_equal(index.rows[index.image_row], labels)
+    ids, scores = index.similar(0, k=5)
+    expected_ids, expected_scores = brute_force(labels, 0, 5, 16, "count")
+    assert ids.tolist() == expected_ids.tolist() and scores[0] == 25
+    np.testing.assert_allclose(scores, expected_scores)
+
+def test_similar_images_of_a_collection(tmp_path):
+    """Quadrant images sharing more colours rank first; float labels are refused"""
+    colours = [[0, 1, 2, 3], [0, 1, 2, 4], [0, 1, 5, 6], [7, 8, 9, 10], [0, 1, 2, 3]]
+    for i, quadrants in enumerate(colours):
+        img = np.zeros((64, 64, 3), dtype=np.uint8)
+        img[:32, :32], img[:32, 32:] = DEFAULT_PALETTE[quadrants[0]], DEFAULT_PALETTE[quadrants[1]]
+        img[32:, :32], img[32:, 32:] = DEFAULT_PALETTE[quadrants[2]], DEFAULT_PALETTE[quadrants[3]]
+        Image.fromarray(img).save(tmp_path / f"image_{i:04d}.png")
+    peaks = TSneakPeaks(str(tmp_path), grid=(2, 2), use_cache=False)
+    peaks.load_data()
+
+    ids, scores = peaks.similar(0, k=3)
+    assert ids.tolist() == [4, 1, 2]
+    assert scores.tolist() == [4, 3, 2]
+
+    peaks.category_labels = np.random.rand(5, 4)
+    peaks.similarity_index = None
+    with pytest.raises(ValueError):
+        peaks.similar(0)
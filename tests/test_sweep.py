@@ -0,0 +1,37 @@
+# tests/test_sweep.py
+import json
+import numpy as np
+from tsneakpeaks import WhiteLodge
+from tsneakpeaks.data_processing import encode_sparse_one_hot
+from tsneakpeaks.sweep import SWEEP_RESULTS_FILE, parameter_grid, run_sweep
+
+def make_features():
+    """Two colour families of 40 images each"""
+    rng = np.random.default_rng(5)
+    labels = np.repeat(np.array([[0, 1, 2, 3], [8, 9, 10, 11]]), 40, axis=0)
+    flips = rng.random(labels.shape) < 0.25
+    labels[flips] = rng.integers(0, 16, flips.sum())
+    return encode_sparse_one_hot(labels, 16)
+
+def test_parameter_grid():
+    """The grid holds every combination"""
+    configs = parameter_grid([10, 20], seeds=[0, 1], learning_rates=[None, 100.0], exaggerations=[4, 12])
+    assert len(configs) == 16
+    assert len({config.name for config in configs}) == 16
+
+def test_sweep_searches_neighbours_once(tmp_path, monkeypatch):
+    """Every configuration is embedded from one shared neighbour search"""
+    calls = []
+    search = WhiteLodge._neighbour_graph
+    monkeypatch.setattr(WhiteLodge, "_neighbour_graph",
+                        lambda self, *args: calls.append(args[1]) or search(self, *args))
+
+    configs = parameter_grid([5, 10], seeds=[0, 1], exaggerations=[4.0])
+    records = run_sweep(make_features(), configs, tmp_path, engine="barnes_hut", n_iter=100, n_jobs=2)
+
+    assert calls == [31]
+    assert len(records) == 4
+    assert [r["kl_divergence"] for r in records] == sorted(r["kl_divergence"] for r in records)
+    assert json.loads((tmp_path / SWEEP_RESULTS_FILE).read_text()) == records
+    for record in records:
+        assert np.load(tmp_path / record["coords"]).shape == (80, 3)
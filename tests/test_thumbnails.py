@@ -0,0 +1,80 @@
+# tests/test_thumbnails.py
+import json
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from tsneakpeaks.thumbnails import (
+    ATLAS_INDEX_FILE,
+    ThumbnailStore,
+    build_atlases,
+    generate_thumbnails,
+    make_thumbnail,
+    register_thumbnail_route,
+)
+
+@pytest.fixture
+def images(tmp_path):
+    """Five 300x200 images of different colours"""
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"image_{i:04d}.png"
+        Image.fromarray(np.full((200, 300, 3), i * 50, dtype=np.uint8)).save(path)
+        paths.append(path)
+    return paths
+
+def test_thumbnails_and_atlases(images, tmp_path):
+    """Thumbnails keep the aspect ratio, are not rewritten, and are packed into atlases"""
+    thumbnail_dir = tmp_path / "thumbnails"
+    thumbnails = generate_thumbnails(images, thumbnail_dir, size=60)
+    assert [path.name for path in thumbnails] == [path.name for path in images]
+    with Image.open(thumbnails[0]) as thumb:
+        assert thumb.size == (60, 40)
+
+    mtime = thumbnails[0].stat().st_mtime_ns
+    generate_thumbnails(images, thumbnail_dir, size=60)
+    assert thumbnails[0].stat().st_mtime_ns == mtime
+
+    index = build_atlases(thumbnails, thumbnail_dir, tile_size=64, tiles_per_side=2)
+    assert json.loads((thumbnail_dir / ATLAS_INDEX_FILE).read_text()) == index
+    assert sorted({tile["atlas"] for tile in index.values()}) == ["atlas_0000.png", "atlas_0001.png"]
+    tile = index["image_0003.png"]
+    with Image.open(thumbnail_dir / tile["atlas"]) as atlas:
+        assert atlas.getpixel((tile["x"] + 5, tile["y"] + 5)) == (150, 150, 150)
+
+def test_store_evicts_and_rejects_outside_names(images, tmp_path):
+    """The LRU stays under its budget and never reads outside the directory"""
+    thumbnails = generate_thumbnails(images, tmp_path / "thumbnails", size=60)
+    budget = thumbnails[0].stat().st_size * 2
+    store = ThumbnailStore(tmp_path / "thumbnails", max_bytes=budget)
+    for path in thumbnails:
+        assert store.get(path.name) is not None
+    assert store._size <= budget
+    assert store.get("../image_0000.png") is None
+    assert store.get("missing.png") is None
+
+def test_route_answers_conditional_requests(images, tmp_path):
+    """The route asks for revalidation, 304s a matching ETag and serves a regenerated thumbnail at once"""
+    flask = pytest.importorskip("flask")
+    thumbnails = generate_thumbnails(images, tmp_path / "thumbnails", size=60)
+    server = flask.Flask(__name__)
+    register_thumbnail_route(server, ThumbnailStore(tmp_path / "thumbnails"))
+    client = server.test_client()
+
+    response = client.get("/thumbnails/image_0001.png")
+    assert response.status_code == 200
+    assert response.data == thumbnails[1].read_bytes()
+    assert "no-cache" in response.headers["Cache-Control"]
+    assert "immutable" not in response.headers["Cache-Control"]
+
+    etag = response.headers["ETag"]
+    assert client.get("/thumbnails/image_0001.png", headers={"If-None-Match": etag}).status_code == 304
+
+    # The image changes and its thumbnail is rewritten under the same name
+    Image.fromarray(np.full((200, 300, 3), 255, dtype=np.uint8)).save(images[1])
+    os.utime(images[1], ns=(thumbnails[1].stat().st_mtime_ns + 10**9,) * 2)
+    assert make_thumbnail(images[1], thumbnails[1], size=60)
+    response = client.get("/thumbnails/image_0001.png", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.data == thumbnails[1].read_bytes() and response.headers["ETag"] != etag
+    assert client.get("/thumbnails/nope.png").status_code == 404
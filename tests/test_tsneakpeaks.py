@@ -1,8 +1,13 @@
 # tests/test_tsneakpeaks.py
+import logging
 import pytest
 import numpy as np
 from pathlib import Path
+from PIL import Image
+from scipy.sparse import issparse
 from tsneakpeaks import TSneakPeaks, BlackLodge, WhiteLodge, Visualizer
+from tsneakpeaks.packed_codes import PackedLabels
+from tsneakpeaks.waiting_room import WaitingRoom
 
 @pytest.fixture
 def test_data_dir(tmp_path):
@@ -60,3 +65,129 @@ def test_error_handling(tmp_path):
     with pytest.raises(FileNotFoundError):
         peaks = TSneakPeaks(str(tmp_path))
         peaks.load_data()
+
+def test_embedding_cache_reuse(test_data_dir):
+    """A second run loads the embedding from cache, --refresh recomputes it"""
+    peaks = TSneakPeaks(str(test_data_dir))
+    peaks.load_data()
+    peaks.reduce_dimensions()
+    first = np.array(peaks.coords_3d)
+
+    warm = TSneakPeaks(str(test_data_dir))
+    warm.load_data()
+    warm.white_lodge.project = None  # any projection would fail
+    warm.reduce_dimensions()
+    assert np.array_equal(warm.coords_3d, first)
+
+    refreshed = TSneakPeaks(str(test_data_dir), refresh_cache=True)
+    refreshed.load_data()
+    refreshed.reduce_dimensions()
+    assert refreshed.coords_3d.shape == first.shape
+
+def test_append_keeps_existing_coordinates(test_data_dir):
+    """Appending images places them without moving the existing embedding"""
+    peaks = TSneakPeaks(str(test_data_dir), use_cache=False)
+    peaks.load_data()
+    peaks.reduce_dimensions()
+    before = np.array(peaks.coords_3d)
+
+    new_coords = peaks.append(["new_0000.png", "new_0001.png"], np.random.rand(2, 10))
+
+    assert new_coords.shape == (2, 3)
+    assert len(peaks.image_paths) == 7
+    assert peaks.labels.shape == (7, 10)
+    assert np.array_equal(peaks.coords_3d[:5], before)
+
+def test_labels_are_memory_mapped_and_chunked(test_data_dir):
+    """Labels stay on disk and chunked preprocessing matches the one-pass result"""
+    peaks = TSneakPeaks(str(test_data_dir))
+    peaks.load_data()
+
+    assert isinstance(peaks.labels, np.memmap)
+    chunks = list(peaks.black_lodge.iter_label_chunks(chunk_rows=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+    scaled = np.asarray(peaks.labels) * 10
+    whole = WaitingRoom().preprocess_labels(scaled)
+    chunked = WaitingRoom(chunk_rows=2).preprocess_labels(scaled)
+    np.testing.assert_allclose(chunked, whole, rtol=1e-6)
+    assert chunked.min() == 0.0 and chunked.max() == 1.0
+
+def test_colour_labels_stay_compact_integers():
+    """Colour indices are checked against the palette and never scaled or copied"""
+    room = WaitingRoom(num_colors=16)
+    codes = np.random.randint(0, 16, (50, 4)).astype(np.uint8)
+    room.validate_data([f"image_{i}.png" for i in range(50)], codes)
+    assert room.preprocess_labels(codes) is codes
+    assert room.value_range is None
+
+    narrowed = room.preprocess_labels(codes.astype(np.int64))
+    assert narrowed.dtype == np.uint8
+    np.testing.assert_array_equal(narrowed, codes)
+
+    with pytest.raises(ValueError):
+        room.preprocess_labels(np.full((2, 4), 16, dtype=np.uint8))
+    with pytest.raises(ValueError):
+        room.validate_data(["a.png"], np.array([[-1, 0, 0, 0]]))
+
+def test_numeric_labels_are_scanned_once(monkeypatch):
+    """Validation and scaling share one range scan, and float32 labels can be scaled in place"""
+    room = WaitingRoom(chunk_rows=7)
+    scans = []
+    blocks = WaitingRoom._blocks
+    monkeypatch.setattr(WaitingRoom, "_blocks", lambda self, labels: scans.append(1) or blocks(self, labels))
+    labels = (np.random.rand(30, 10) * 10 - 5).astype(np.float32)
+    expected = (labels - labels.min()) / (labels.max() - labels.min())
+
+    room.validate_data([f"image_{i}.png" for i in range(30)], labels)
+    scaled = room.preprocess_labels(labels, copy=False)
+    assert scaled is labels
+    assert len(scans) == 2  # the range scan and the scaling pass
+    np.testing.assert_allclose(scaled, expected, rtol=1e-6)
+
+    with pytest.raises(ValueError):
+        room.validate_data(["a.png"], np.array([[np.nan, 0.5]]))
+
+@pytest.mark.parametrize("num_quadrants", [4, 20])
+def test_colour_labels_are_projected_one_hot(tmp_path, num_quadrants):
+    """reduce_dimensions embeds packed codes (or CSR rows for wide grids), keeping families apart"""
+    rng = np.random.default_rng(7)
+    # Families differ in every quadrant; a quarter of the quadrants are then recoloured
+    families = (4 * np.arange(3)[:, None] + np.arange(num_quadrants)) % 16
+    labels = np.repeat(families, 30, axis=0)
+    flips = rng.random(labels.shape) < 0.25
+    labels[flips] = rng.integers(0, 16, flips.sum())
+    labels = labels.astype(np.uint8)
+    for i in range(len(labels)):
+        Image.fromarray(np.full((8, 8, 3), i, dtype=np.uint8)).save(tmp_path / f"image_{i:04d}.png")
+    np.save(tmp_path / "labels.npy", labels)
+
+    peaks = TSneakPeaks(str(tmp_path), perplexity=10, n_iter=300, use_cache=False)
+    peaks.load_data()
+    peaks.reduce_dimensions()
+
+    if num_quadrants == 4:
+        assert isinstance(peaks.features, PackedLabels)
+    else:
+        assert issparse(peaks.features) and peaks.features.nnz == labels.size
+    assert peaks.labels.dtype == np.uint8
+    assert peaks.white_lodge.features.shape[1] == num_quadrants * 16
+    family = np.arange(len(labels)) // 30
+    centres = np.array([peaks.coords_3d[family == f].mean(axis=0) for f in range(3)])
+    nearest = np.argmin(((peaks.coords_3d[:, None] - centres[None]) ** 2).sum(axis=-1), axis=1)
+    assert (nearest == family).mean() > 0.9
+
+    new_coords = peaks.append(["new_0000.png", "new_0001.png"], np.repeat(families[:1], 2, axis=0).astype(np.uint8))
+    assert peaks.features.shape[0] == len(labels) + 2
+    assert np.argmin(((new_coords[:, None] - centres[None]) ** 2).sum(axis=-1), axis=1).tolist() == [0, 0]
+
+def test_components_take_logger_positionally(tmp_path):
+    """Options added since are keyword-only, so the original positional calls still work"""
+    logger = logging.getLogger("positional")
+    assert BlackLodge(tmp_path, logger).logger is logger
+    assert WaitingRoom(logger).logger is logger
+    assert Visualizer(logger).logger is logger
+    assert WhiteLodge(10, 250, 0, logger).logger is logger
+    assert TSneakPeaks(str(tmp_path), logger, use_cache=False).logger is logger
+    with pytest.raises(TypeError):
+        BlackLodge(tmp_path, logger, None)
@@ -0,0 +1,153 @@
+# tests/test_white_lodge.py
+import numpy as np
+import pytest
+from scipy.sparse import issparse
+from tsneakpeaks import WhiteLodge
+from tsneakpeaks.affinities import cosine_knn_graph, normalize_rows
+
+@pytest.fixture
+def quadrant_labels(make_family_labels):
+    """Small clustered label set: three colour families of 20 images each"""
+    return make_family_labels(20, seed=7)
+
+def test_prepare_data_stays_sparse(quadrant_labels):
+    """prepare_data returns one sparse row per image"""
+    wl = WhiteLodge()
+    features = wl.prepare_data(quadrant_labels, num_quadrants=4, num_colors=16)
+
+    assert issparse(features)
+    assert features.shape == (60, 64)
+    assert features.nnz == 60 * 4
+
+def test_sparse_knn_matches_dense(quadrant_labels):
+    """Sparse and dense features give the same cosine neighbour distances"""
+    wl = WhiteLodge()
+    features = normalize_rows(wl.prepare_data(quadrant_labels, 4, 16))
+
+    sparse_graph = cosine_knn_graph(features, n_neighbors=10)
+    dense_graph = cosine_knn_graph(features.toarray(), n_neighbors=10)
+
+    assert sparse_graph.shape == (60, 60)
+    assert np.diff(sparse_graph.indptr).tolist() == [11] * 60
+    np.testing.assert_allclose(
+        np.sort(sparse_graph.data), np.sort(dense_graph.data), atol=1e-6
+    )
+
+def test_chunked_knn_matches_unchunked(quadrant_labels):
+    """Normalising and querying in small blocks builds the same graph"""
+    wl = WhiteLodge()
+    features = wl.prepare_data(quadrant_labels, 4, 16).toarray()
+
+    whole = cosine_knn_graph(normalize_rows(features), n_neighbors=10)
+    chunked = cosine_knn_graph(normalize_rows(features, chunk_rows=7), n_neighbors=10, chunk_rows=7)
+
+    np.testing.assert_array_equal(chunked.indptr, whole.indptr)
+    np.testing.assert_allclose(chunked.data, whole.data, atol=1e-6)
+
+def test_project_images_sparse(quadrant_labels):
+    """The full sparse pipeline projects every image into 3D"""
+    wl = WhiteLodge(perplexity=10, n_iter=250)
+    coords_3d = wl.project_images(quadrant_labels, num_quadrants=4, num_colors=16)
+
+    assert coords_3d.shape == (60, 3)
+    assert np.all(np.isfinite(coords_3d))
+
+def test_neighbour_index_is_persisted_and_reused(quadrant_labels, tmp_path, caplog):
+    """The approximate index is saved next to the data and reused on the next projection"""
+    index_path = tmp_path / "neighbour_index.npz"
+    wl = WhiteLodge(perplexity=5, n_iter=250, engine="barnes_hut", neighbours="approximate")
+    features = wl.prepare_data(quadrant_labels, 4, 16)
+
+    wl.project(features, index_path=index_path)
+    assert index_path.exists()
+    assert wl.neighbour_index.recall_ > 0.9
+
+    with caplog.at_level("INFO"):
+        wl.project(features, index_path=index_path)
+    assert "Reusing neighbour index" in caplog.text
+
+    # More trees, or another seed, mean another index
+    for options in ({"ann_trees": 4}, {"ann_trees": 4, "random_state": 7}):
+        caplog.clear()
+        other = WhiteLodge(perplexity=5, n_iter=250, engine="barnes_hut", neighbours="approximate", **options)
+        with caplog.at_level("INFO"):
+            other.project(features, index_path=index_path)
+        assert "is stale, rebuilding" in caplog.text
+        assert other.neighbour_index.n_trees == other.ann_trees
+
+def test_transform_places_new_points_near_their_family(quadrant_labels):
+    """Copies of embedded images land in the same family as the originals, which stay put"""
+    wl = WhiteLodge(perplexity=10, n_iter=500)
+    features = wl.prepare_data(quadrant_labels, 4, 16)
+    coords_3d = wl.project(features).copy()
+
+    new_points = wl.prepare_data(quadrant_labels[::10], 4, 16)
+    placed = wl.transform(new_points)
+
+    assert placed.shape == (6, 3)
+    assert np.array_equal(wl.result.coords, coords_3d)
+    assert wl.transform_result.kl_divergence >= 0.0
+    centres = np.array([coords_3d[i * 20:(i + 1) * 20].mean(axis=0) for i in range(3)])
+    nearest = lambda points: np.argmin(((points[:, None] - centres[None]) ** 2).sum(axis=-1), axis=1)
+    np.testing.assert_array_equal(nearest(placed), nearest(coords_3d[::10]))
+
+def test_transform_needs_a_reference():
+    """transform refuses to run before anything was projected"""
+    with pytest.raises(ValueError):
+        WhiteLodge().transform(np.eye(3))
+
+def test_project_removes_finished_checkpoint(quadrant_labels, tmp_path):
+    """Checkpoints only outlive interrupted projections"""
+    checkpoint = tmp_path / "checkpoint.npz"
+    wl = WhiteLodge(perplexity=10, n_iter=100, checkpoint_path=checkpoint, checkpoint_every=20)
+    features = wl.prepare_data(quadrant_labels, 4, 16)
+
+    wl.project(features, callbacks=[lambda info: info.iteration == 40], callback_every=20)
+    assert checkpoint.exists()
+    wl.project(features)
+    assert wl.result.n_iter == 100
+    assert not checkpoint.exists()
+
+def test_dedup_embeds_each_distinct_row_once(quadrant_labels):
+    """Repeated rows are embedded once and every sample lands near its row"""
+    labels = np.repeat(quadrant_labels, np.arange(60) % 5 + 1, axis=0)
+    wl = WhiteLodge(perplexity=10, n_iter=250, dedup=True)
+    seen = []
+    coords_3d = wl.project(labels, callbacks=[lambda info: seen.append(info.coords.shape)], callback_every=100)
+
+    distinct = len(np.unique(quadrant_labels, axis=0))
+    assert wl.result.coords.shape == (distinct, 3)
+    assert wl.row_counts.sum() == len(labels)
+    assert coords_3d.shape == (len(labels), 3)
+    assert seen == [(len(labels), 3)] * 2
+    # Samples scatter around their row, well within the distance to the next row
+    offsets = np.linalg.norm(coords_3d - wl.result.coords[wl.row_inverse], axis=1)
+    assert 0 < offsets.max() < np.ptp(wl.result.coords, axis=0).max() / 4
+    np.testing.assert_array_equal(wl.expand(wl.result.coords), coords_3d)
+
+def test_dedup_is_skipped_when_it_would_not_pay(quadrant_labels, caplog):
+    """Deduplication never trades more work for fewer rows"""
+    wl = WhiteLodge(perplexity=10, n_iter=250, dedup=True)
+    # Few duplicates, or distinct rows that would need FFT instead of Barnes-Hut
+    assert "distinct" in wl.dedup_skip_reason(3000, 2655)
+    assert "fft_interp" in wl.dedup_skip_reason(30_000, 1000)
+    assert wl.dedup_skip_reason(30_000, 400) is None
+    assert wl.dedup_skip_reason(100_000, 20_000) is None
+    assert WhiteLodge(engine="exact", dedup=True).dedup_skip_reason(30_000, 1000) is None
+
+    distinct = np.unique(quadrant_labels, axis=0)
+    with caplog.at_level("INFO"):
+        coords_3d = wl.project(distinct)
+    assert "without deduplication" in caplog.text
+    assert wl.row_inverse is None
+    plain = WhiteLodge(perplexity=10, n_iter=250).project(distinct)
+    np.testing.assert_array_equal(coords_3d, plain)
+
+def test_affinity_params_tell_dense_from_knn_affinities():
+    """Engines that build different P, or approximate indexes built differently, never share a cache key"""
+    exact, barnes_hut, fft = (WhiteLodge(engine=name).affinity_params() for name in ("exact", "barnes_hut", "fft_interp"))
+    assert exact != barnes_hut == fft
+    assert WhiteLodge(ann_trees=4).affinity_params() != WhiteLodge(ann_trees=8).affinity_params()
+    assert WhiteLodge(neighbours="approximate", random_state=1).affinity_params() != \
+        WhiteLodge(neighbours="approximate", random_state=2).affinity_params()
+    assert "ann_trees" not in WhiteLodge(neighbours="exact").affinity_params()
@@ -5,5 +5,6 @@ TSneakPeaks: A Lynchian journey through high-dimensional image spaces
 from .black_lodge import BlackLodge
 from .white_lodge import WhiteLodge
 from .laura import TSneakPeaks
+from .red_room import Visualizer
 
 __version__ = "0.1.0"
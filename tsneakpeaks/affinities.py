@@ -0,0 +1,299 @@
+# tsneakpeaks/affinities.py
+"""
+Affinities: sparse neighbourhoods for the projection pipeline
+Everything here works on CSR input and keeps memory proportional to nnz
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import normalize
+from typing import Tuple, Union
+from .packed_codes import PackedLabels
+
+ArrayLike = Union[np.ndarray, csr_matrix, PackedLabels]
+
+
+def n_neighbors_for_perplexity(perplexity: float, n_samples: int) -> int:
+    """Number of neighbours t-SNE needs for a given perplexity (3u + 1)"""
+    return max(1, min(n_samples - 1, int(3.0 * perplexity + 1)))
+
+
+def normalize_rows(features: ArrayLike, chunk_rows: int = None) -> ArrayLike:
+    """
+    L2-normalise every row so cosine distance becomes 1 - dot product.
+
+    Parameters:
+    - features (csr_matrix or np.ndarray): Feature matrix of shape (n_samples, n_features).
+    - chunk_rows (int, optional): Dense input is converted and normalised this many
+      rows at a time, so memory-mapped features are never copied whole in float64.
+
+    Returns:
+    - csr_matrix or np.ndarray: float32 matrix of the same kind, with unit-norm rows
+      (all-zero rows are left as zeros). Packed labels are returned as they are,
+      their one-hot rows all have the same norm.
+    """
+    if isinstance(features, PackedLabels):
+        return features
+    if issparse(features):
+        features = csr_matrix(features, dtype=np.float32, copy=True)
+        return normalize(features, norm="l2", copy=False)
+
+    normalized = np.empty(features.shape, dtype=np.float32)
+    step = chunk_rows or max(len(features), 1)
+    for start in range(0, len(features), step):
+        normalized[start:start + step] = normalize(
+            np.asarray(features[start:start + step], dtype=np.float32), norm="l2", copy=False
+        )
+    return normalized
+
+
+def cosine_knn_graph(features: ArrayLike,
+                     n_neighbors: int,
+                     n_jobs: int = None,
+                     chunk_rows: int = None) -> csr_matrix:
+    """
+    Exact cosine k-nearest-neighbour graph, computed without densifying the input.
+
+    Follows scikit-learn's ``KNeighborsTransformer`` convention: every row also
+    stores the point itself as an explicit zero, so the graph can be passed to
+    ``TSNE(metric="precomputed")`` directly.
+
+    Parameters:
+    - features (csr_matrix or np.ndarray): Row-normalised features.
+    - n_neighbors (int): Neighbours per point, excluding the point itself.
+    - n_jobs (int, optional): Parallel jobs for the neighbour search.
+    - chunk_rows (int, optional): Points queried per pass; results go straight
+      into the graph arrays, so temporary memory is bounded by one pass.
+
+    Returns:
+    - csr_matrix: (n_samples, n_samples) graph with ``n_neighbors + 1`` cosine distances per row.
+    """
+    n_samples = features.shape[0]
+    width = n_neighbors + 1
+    nn = NearestNeighbors(
+        n_neighbors=width,
+        metric="cosine",
+        algorithm="brute",
+        n_jobs=n_jobs,
+    )
+    nn.fit(features)
+
+    indices = np.empty((n_samples, width), dtype=np.int32 if n_samples < 2**31 else np.int64)
+    distances = np.empty((n_samples, width), dtype=np.float32)
+    step = chunk_rows or max(n_samples, 1)
+    for start in range(0, n_samples, step):
+        stop = min(start + step, n_samples)
+        distances[start:stop], indices[start:stop] = nn.kneighbors(features[start:stop])
+
+    # Rounding in float32 can leave tiny negative distances for identical rows.
+    # Rows stay ordered by distance, which is what TSNE expects.
+    np.maximum(distances, 0.0, out=distances)
+    indptr = np.arange(0, n_samples * width + 1, width, dtype=indices.dtype)
+    return csr_matrix(
+        (distances.ravel(), indices.ravel(), indptr),
+        shape=(n_samples, n_samples),
+    )
+
+
+def cosine_knn_query(reference: ArrayLike,
+                     queries: ArrayLike,
+                     n_neighbors: int,
+                     n_jobs: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact cosine neighbours of new points among a reference set.
+
+    Parameters:
+    - reference (csr_matrix or np.ndarray): Row-normalised reference features.
+    - queries (csr_matrix or np.ndarray): Row-normalised features of the new points.
+    - n_neighbors (int): Neighbours per new point.
+    - n_jobs (int, optional): Parallel jobs for the neighbour search.
+
+    Returns:
+    - Tuple[np.ndarray, np.ndarray]: ``(indices, distances)`` into the reference
+      set, both of shape (n_queries, n_neighbors) and ordered by distance.
+    """
+    nn = NearestNeighbors(
+        n_neighbors=n_neighbors,
+        metric="cosine",
+        algorithm="brute",
+        n_jobs=n_jobs,
+    )
+    nn.fit(reference)
+    distances, indices = nn.kneighbors(queries)
+    return indices, np.maximum(distances, 0.0).astype(np.float32)
+
+
+def truncate_graph(graph: csr_matrix, n_entries: int) -> csr_matrix:
+    """
+    Keep the ``n_entries`` closest entries of every row of a distance-ordered graph.
+
+    Lets one neighbour search serve several perplexities: the graph is built for
+    the largest and cut down for the others.
+    """
+    n_samples = graph.shape[0]
+    row_lengths = np.diff(graph.indptr)
+    width = int(row_lengths[0]) if n_samples else 0
+    if np.any(row_lengths != width):
+        raise ValueError("Every row of the neighbour graph must hold the same number of entries.")
+    if n_entries > width:
+        raise ValueError(f"Graph holds {width} entries per row, {n_entries} requested")
+    if n_entries == width:
+        return graph
+    indptr = np.arange(0, n_samples * n_entries + 1, n_entries, dtype=graph.indptr.dtype)
+    return csr_matrix(
+        (graph.data.reshape(n_samples, width)[:, :n_entries].ravel(),
+         graph.indices.reshape(n_samples, width)[:, :n_entries].ravel(),
+         indptr),
+        shape=graph.shape,
+    )
+
+
+def knn_from_graph(graph: csr_matrix) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split a neighbour graph from ``cosine_knn_graph`` into dense neighbour arrays.
+
+    Parameters:
+    - graph (csr_matrix): Graph with the same number of entries in every row,
+      ordered by distance, that may include each point itself.
+
+    Returns:
+    - Tuple[np.ndarray, np.ndarray]: ``(indices, distances)``, both of shape
+      (n_samples, n_neighbors) with the self entries removed.
+    """
+    n_samples = graph.shape[0]
+    row_lengths = np.diff(graph.indptr)
+    width = int(row_lengths[0]) if n_samples else 0
+    if np.any(row_lengths != width):
+        raise ValueError("Every row of the neighbour graph must hold the same number of entries.")
+
+    indices = graph.indices.reshape(n_samples, width)
+    distances = graph.data.reshape(n_samples, width)
+    is_self = indices == np.arange(n_samples)[:, None]
+    if not is_self.any():
+        return indices, distances
+
+    # Rows where duplicates pushed the point itself out of the list lose their farthest entry
+    is_self[~is_self.any(axis=1), -1] = True
+    keep = ~is_self
+    return (
+        indices[keep].reshape(n_samples, width - 1),
+        distances[keep].reshape(n_samples, width - 1),
+    )
+
+
+def _conditional_probabilities(distances: np.ndarray,
+                               perplexity: float,
+                               n_steps: int = 100,
+                               tol: float = 1e-5) -> np.ndarray:
+    """Vectorised bisection on the per-row precision so each row hits the target perplexity"""
+    n_rows = distances.shape[0]
+    target_entropy = np.log(perplexity)
+    # Shifting by the row minimum leaves the normalised probabilities unchanged
+    shifted = distances - distances.min(axis=1, keepdims=True)
+
+    beta = np.ones(n_rows)
+    beta_min = np.full(n_rows, -np.inf)
+    beta_max = np.full(n_rows, np.inf)
+    for _ in range(n_steps):
+        probabilities = np.exp(-shifted * beta[:, None])
+        sum_p = probabilities.sum(axis=1)
+        entropy = np.log(sum_p) + beta * (shifted * probabilities).sum(axis=1) / sum_p
+        error = entropy - target_entropy
+        if np.all(np.abs(error) <= tol):
+            break
+
+        too_flat = error > 0
+        beta_min = np.where(too_flat, beta, beta_min)
+        beta_max = np.where(too_flat, beta_max, beta)
+        beta = np.where(
+            too_flat,
+            np.where(np.isinf(beta_max), beta * 2.0, (beta + beta_max) / 2.0),
+            np.where(np.isinf(beta_min), beta / 2.0, (beta + beta_min) / 2.0),
+        )
+
+    probabilities = np.exp(-shifted * beta[:, None])
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+    return probabilities
+
+
+def joint_probabilities(graph: csr_matrix,
+                        perplexity: float,
+                        chunk_size: int = 65536,
+                        counts: np.ndarray = None) -> csr_matrix:
+    """
+    Perplexity-calibrated, symmetric t-SNE affinity matrix from a neighbour graph.
+
+    Parameters:
+    - graph (csr_matrix): Neighbour distance graph, e.g. from ``cosine_knn_graph``.
+    - perplexity (float): Target perplexity of every conditional distribution.
+    - chunk_size (int): Rows calibrated per pass, bounding temporary memory.
+    - counts (np.ndarray, optional): Number of identical points every row stands
+      for. Every row's conditional distribution is weighted by its count before
+      symmetrising, so entry (i, j) is the total affinity between the points of
+      row i and those of row j. The perplexity still counts distinct rows, as
+      neighbours many times over would otherwise crowd out all others.
+
+    Returns:
+    - csr_matrix: float32 matrix P with (P + P.T) symmetry, summing to one.
+    """
+    indices, distances = knn_from_graph(graph)
+    n_samples, n_neighbors = indices.shape
+
+    conditional = np.empty((n_samples, n_neighbors), dtype=np.float32)
+    for start in range(0, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        conditional[start:stop] = _conditional_probabilities(
+            distances[start:stop].astype(np.float64), perplexity
+        )
+        if counts is not None:
+            conditional[start:stop] *= counts[start:stop, None]
+
+    indptr = np.arange(0, n_samples * n_neighbors + 1, n_neighbors, dtype=np.int64)
+    P = csr_matrix(
+        (conditional.ravel(), indices.ravel(), indptr),
+        shape=(n_samples, n_samples),
+    )
+    P = P + P.T
+    P.sum_duplicates()
+    P.sort_indices()
+    P.data /= max(P.data.sum(), np.finfo(np.float32).eps)
+    return P
+
+
+def conditional_affinities(indices: np.ndarray,
+                           distances: np.ndarray,
+                           perplexity: float,
+                           n_reference: int,
+                           chunk_size: int = 65536) -> csr_matrix:
+    """
+    Perplexity-calibrated affinities of new points to a reference set.
+
+    Unlike ``joint_probabilities`` nothing is symmetrised: every row is the
+    conditional distribution of one new point over its reference neighbours.
+
+    Parameters:
+    - indices (np.ndarray): Reference neighbours of every new point, (n_queries, n_neighbors).
+    - distances (np.ndarray): Matching distances.
+    - perplexity (float): Target perplexity of every row.
+    - n_reference (int): Size of the reference set.
+    - chunk_size (int): Rows calibrated per pass, bounding temporary memory.
+
+    Returns:
+    - csr_matrix: float32 matrix of shape (n_queries, n_reference) with rows summing to one.
+    """
+    n_queries, n_neighbors = indices.shape
+    conditional = np.empty((n_queries, n_neighbors), dtype=np.float32)
+    for start in range(0, n_queries, chunk_size):
+        stop = min(start + chunk_size, n_queries)
+        conditional[start:stop] = _conditional_probabilities(
+            distances[start:stop].astype(np.float64), perplexity
+        )
+
+    indptr = np.arange(0, n_queries * n_neighbors + 1, n_neighbors, dtype=np.int64)
+    P = csr_matrix(
+        (conditional.ravel(), indices.ravel(), indptr),
+        shape=(n_queries, n_reference),
+    )
+    P.sum_duplicates()
+    return P
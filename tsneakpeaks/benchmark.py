@@ -0,0 +1,374 @@
+# tsneakpeaks/benchmark.py
+"""
+Benchmark: time and peak memory of every pipeline stage, from a thousand images to millions
+Scaling curves show where the pipeline stops keeping up, a stored baseline shows when it slipped
+"""
+
+import json
+import math
+import os
+import platform
+import shutil
+import time
+import tracemalloc
+import numpy as np
+from datetime import datetime, timezone
+from pathlib import Path
+from PIL import Image
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+import logging
+from .black_lodge import BlackLodge
+from .data_processing import unique_rows
+from .feature_extraction import DEFAULT_PALETTE
+from .manifest import MANIFEST_FILE
+from .owl_cave import get_config, proc_memory, reset_peak_rss
+from .packed_codes import bits_per_quadrant
+from .red_room import Visualizer
+from .waiting_room import WaitingRoom
+from .white_lodge import WhiteLodge
+
+# Collection sizes measured by default
+BENCHMARK_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+# Measured stages, in pipeline order
+STAGES = ("enter", "validate_data", "preprocess_labels", "prepare_data", "project", "create_figure")
+
+# Written into every synthetic collection, so it is only generated once
+DATASET_FILE = "benchmark_dataset.json"
+
+# Slowdown or memory growth beyond this fraction of the baseline is a regression
+REGRESSION_TOLERANCE = 0.25
+
+# Stages faster or smaller than this in both runs are noise, not regressions
+MIN_SECONDS = 0.05
+MIN_BYTES = 1 << 20
+
+
+class StageResult(NamedTuple):
+    """One stage at one collection size"""
+    n_images: int
+    stage: str
+    seconds: float
+    peak_bytes: Optional[int]
+
+
+class Regression(NamedTuple):
+    """A stage that got slower or bigger than in the baseline"""
+    n_images: int
+    stage: str
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else math.inf
+
+
+def synthesize_labels(n_images: int,
+                      num_colors: int = 16,
+                      num_quadrants: int = 4,
+                      n_clusters: int = 5,
+                      monochromatic: float = 0.1,
+                      random_state: int = 0,
+                      chunk_rows: int = 1 << 18) -> np.ndarray:
+    """
+    Quadrant colours drawn like ``examples/generate_clusters.py``, vectorised.
+
+    Every image picks one of ``n_clusters`` colour distributions, perturbs it
+    and draws its quadrant colours from it. A ``monochromatic`` share of the
+    images instead paints all quadrants one colour, as
+    ``examples/generate_monochromatic_clusters.py`` does.
+
+    Returns:
+    - np.ndarray: uint8 labels of shape (n_images, num_quadrants).
+    """
+    rng = np.random.default_rng(random_state)
+    centers = rng.random((n_clusters, num_colors)) * 0.6 + 0.2
+    spreads = rng.random((n_clusters, num_colors)) * 0.1 + 0.05
+    cluster_colors = rng.integers(0, num_colors, n_clusters)
+    labels = np.empty((n_images, num_quadrants), dtype=np.uint8)
+    for start in range(0, n_images, chunk_rows):
+        size = min(chunk_rows, n_images - start)
+        cluster = rng.integers(0, n_clusters, size)
+        probs = np.clip(rng.normal(centers[cluster], spreads[cluster]), 0, 1) + 1e-12
+        cdf = np.cumsum(probs, axis=1)
+        cdf /= cdf[:, -1:]
+        draws = rng.random((size, num_quadrants))
+        colors = (draws[:, :, None] > cdf[:, None, :]).sum(axis=2)
+        mono = rng.random(size) < monochromatic
+        colors[mono] = cluster_colors[cluster[mono], None]
+        labels[start:start + size] = np.minimum(colors, num_colors - 1)
+    return labels
+
+
+def synthesize_dataset(data_dir: Path,
+                       n_images: int,
+                       image_size: int = 8,
+                       random_state: int = 0,
+                       logger: Optional[logging.Logger] = None) -> Path:
+    """
+    A collection of 2×2 quadrant images and their labels.npy, as the examples write.
+
+    Images with the same labels are hard links to one image file, so a million
+    images cost directory entries rather than a million files' worth of disk.
+    A collection already generated with the same parameters is reused.
+
+    Returns:
+    - Path: ``data_dir``.
+    """
+    logger = logger or logging.getLogger(__name__)
+    data_dir = Path(data_dir)
+    params = {"n_images": n_images, "image_size": image_size, "random_state": random_state}
+    marker = data_dir / DATASET_FILE
+    if marker.exists() and json.loads(marker.read_text()) == params:
+        return data_dir
+    if data_dir.exists():
+        shutil.rmtree(data_dir)
+    templates_dir = data_dir / "templates"
+    templates_dir.mkdir(parents=True)
+
+    started = time.perf_counter()
+    labels = synthesize_labels(n_images, num_colors=len(DEFAULT_PALETTE), random_state=random_state)
+    index, inverse, _ = unique_rows(labels)
+    half = image_size // 2
+    for row, quadrants in enumerate(labels[index]):
+        img = np.empty((image_size, image_size, 3), dtype=np.uint8)
+        img[:half, :half], img[:half, half:] = DEFAULT_PALETTE[quadrants[0]], DEFAULT_PALETTE[quadrants[1]]
+        img[half:, :half], img[half:, half:] = DEFAULT_PALETTE[quadrants[2]], DEFAULT_PALETTE[quadrants[3]]
+        Image.fromarray(img).save(templates_dir / f"row_{row:05d}.png")
+    width = max(4, len(str(n_images - 1)))
+    for i, row in enumerate(inverse.tolist()):
+        template = templates_dir / f"row_{row:05d}.png"
+        target = data_dir / f"image_{i:0{width}d}.png"
+        try:
+            os.link(template, target)
+        except OSError:
+            shutil.copyfile(template, target)
+    np.save(data_dir / "labels.npy", labels)
+    marker.write_text(json.dumps(params))
+    logger.info(
+        f"Synthesised {n_images} images ({len(index)} distinct label rows) in "
+        f"{data_dir} in {time.perf_counter() - started:.1f}s"
+    )
+    return data_dir
+
+
+def measure(fn: Callable, *args, memory: bool = True, **kwargs) -> Tuple[object, float, Optional[int]]:
+    """
+    Run ``fn`` once, timing it and tracking its peak memory.
+
+    Peak memory is how far the resident set grew above its size at the start,
+    from the high-water mark Linux keeps, so compiled extensions count and
+    nothing slows down. Elsewhere it falls back to the allocations
+    ``tracemalloc`` sees, which misses compiled extensions and slows
+    allocation-heavy Python code; compare runs made on the same platform.
+
+    Returns:
+    - tuple: The result, seconds taken and peak bytes (None without ``memory``).
+    """
+    if not memory:
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        return result, time.perf_counter() - started, None
+    if reset_peak_rss():
+        before = proc_memory("VmRSS")
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        seconds = time.perf_counter() - started
+        return result, seconds, max(proc_memory("VmHWM") - before, 0)
+    stop = not tracemalloc.is_tracing()
+    if stop:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        if stop:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run_stages(data_dir: Path,
+               white_lodge: WhiteLodge,
+               stages: Sequence[str] = STAGES,
+               memory: bool = True,
+               logger: Optional[logging.Logger] = None) -> List[StageResult]:
+    """
+    Load, scale, encode, project and draw one collection, measuring each stage.
+
+    The manifest is removed first, so ``enter`` always measures a first load.
+    Stages left out of ``stages`` still run when later ones need their output,
+    except ``project``: without it the figure is drawn from random coordinates.
+
+    Returns:
+    - List[StageResult]: One result per measured stage, in pipeline order.
+    """
+    logger = logger or logging.getLogger(__name__)
+    config = get_config()
+    data_dir = Path(data_dir)
+    (data_dir / MANIFEST_FILE).unlink(missing_ok=True)
+    black_lodge = BlackLodge(data_dir, chunk_rows=config['chunk_rows'],
+                             stat_workers=config['stat_workers'], logger=logger)
+    waiting_room = WaitingRoom(chunk_rows=config['chunk_rows'], num_colors=len(black_lodge.palette), logger=logger)
+    visualizer = Visualizer(max_points=config['max_plot_points'],
+                            compact=config['compact_figures'], logger=logger)
+    results = []
+
+    def stage(name, fn, *args, **kwargs):
+        result, seconds, peak = measure(fn, *args, memory=memory, **kwargs)
+        if name in stages:
+            results.append(StageResult(n_images, name, seconds, peak))
+            logger.info(f"{name}: {seconds:.3f}s" + (f", peak {peak / 2**20:.1f} MiB" if peak is not None else ""))
+        return result
+
+    n_images = len(np.load(data_dir / "labels.npy", mmap_mode="r"))
+    image_paths, labels = stage("enter", black_lodge.enter)
+    if "validate_data" in stages:
+        stage("validate_data", waiting_room.validate_data, image_paths, labels)
+    scaled = stage("preprocess_labels", waiting_room.preprocess_labels, labels)
+
+    num_quadrants = labels.shape[1]
+    num_colors = len(black_lodge.palette)
+    if "project" in stages or "prepare_data" in stages:
+        # The encoding project_images picks for these labels
+        packed = bits_per_quadrant(num_colors) * num_quadrants <= 64
+        dataset = stage("prepare_data", white_lodge.prepare_data, labels, num_quadrants, num_colors, packed=packed)
+    if "project" in stages:
+        coords_3d = stage("project", white_lodge.project, dataset)
+    else:
+        coords_3d = np.random.default_rng(white_lodge.random_state).normal(size=(len(image_paths), 3))
+    if "create_figure" in stages:
+        stage("create_figure", visualizer.create_figure, coords_3d, scaled, image_paths)
+    return results
+
+
+def run_benchmark(work_dir: Path,
+                  sizes: Sequence[int] = BENCHMARK_SIZES,
+                  stages: Sequence[str] = STAGES,
+                  memory: bool = True,
+                  random_state: int = 0,
+                  logger: Optional[logging.Logger] = None,
+                  **white_lodge_params) -> dict:
+    """
+    Measure every stage at every collection size.
+
+    Parameters:
+    - work_dir (Path): Synthetic collections are written to (and reused from)
+      ``work_dir/images_<n>``.
+    - sizes (Sequence[int]): Collection sizes.
+    - stages (Sequence[str]): Stages to measure, from ``STAGES``.
+    - memory (bool): Track peak memory with ``tracemalloc``.
+    - random_state (int): Seed of the synthetic labels.
+    - **white_lodge_params: Passed to ``WhiteLodge``, e.g. ``n_iter`` or ``engine``.
+
+    Returns:
+    - dict: Report with the environment, the parameters and one entry per
+      stage and size, ready for ``save_report``.
+    """
+    logger = logger or logging.getLogger(__name__)
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}, expected some of {STAGES}")
+    results = []
+    for n_images in sizes:
+        data_dir = synthesize_dataset(Path(work_dir) / f"images_{n_images}", n_images,
+                                      random_state=random_state, logger=logger)
+        logger.info(f"Benchmarking {n_images} images")
+        white_lodge = WhiteLodge(logger=logger, **white_lodge_params)
+        results.extend(run_stages(data_dir, white_lodge, stages, memory=memory, logger=logger))
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "params": {"memory": memory, "random_state": random_state, **white_lodge_params},
+        "results": [result._asdict() for result in results],
+    }
+
+
+def save_report(report: dict, path: Path) -> None:
+    """Write a report as JSON"""
+    Path(path).write_text(json.dumps(report, indent=2))
+
+
+def load_report(path: Path) -> dict:
+    """Read a report written by ``save_report``"""
+    return json.loads(Path(path).read_text())
+
+
+def _results(report: dict) -> Dict[Tuple[int, str], StageResult]:
+    return {(r["n_images"], r["stage"]): StageResult(**r) for r in report["results"]}
+
+
+def scaling_exponents(report: dict) -> Dict[Tuple[int, str], float]:
+    """
+    Growth of every stage's time between consecutive sizes.
+
+    The exponent ``k`` of ``time ~ n ** k`` between a size and the next smaller
+    one measured: about 1 for a linear stage, 2 for a quadratic one. Stages
+    faster than ``MIN_SECONDS`` at either size are too noisy to say.
+
+    Returns:
+    - dict: Exponent keyed by (n_images, stage) of the larger size.
+    """
+    by_stage: Dict[str, List[StageResult]] = {}
+    for result in _results(report).values():
+        by_stage.setdefault(result.stage, []).append(result)
+    exponents = {}
+    for stage, results in by_stage.items():
+        results.sort(key=lambda r: r.n_images)
+        for smaller, larger in zip(results, results[1:]):
+            if min(smaller.seconds, larger.seconds) >= MIN_SECONDS and larger.n_images > smaller.n_images:
+                exponents[larger.n_images, stage] = (
+                    math.log(larger.seconds / smaller.seconds) / math.log(larger.n_images / smaller.n_images)
+                )
+    return exponents
+
+
+def format_report(report: dict) -> str:
+    """Table of time, peak memory and scaling exponent per size and stage"""
+    exponents = scaling_exponents(report)
+    lines = [f"{'images':>10}  {'stage':<18}{'seconds':>10}{'peak MiB':>10}{'exponent':>10}"]
+    for result in sorted(_results(report).values(), key=lambda r: (r.n_images, STAGES.index(r.stage))):
+        peak = "" if result.peak_bytes is None else f"{result.peak_bytes / 2**20:.1f}"
+        exponent = exponents.get((result.n_images, result.stage))
+        lines.append(
+            f"{result.n_images:>10}  {result.stage:<18}{result.seconds:>10.3f}{peak:>10}"
+            f"{'' if exponent is None else f'{exponent:.2f}':>10}"
+        )
+    return "\n".join(lines)
+
+
+def compare_reports(baseline: dict,
+                    current: dict,
+                    tolerance: float = REGRESSION_TOLERANCE,
+                    min_seconds: float = MIN_SECONDS,
+                    min_bytes: int = MIN_BYTES) -> List[Regression]:
+    """
+    Stages of ``current`` that got slower or bigger than in ``baseline``.
+
+    Only sizes and stages measured in both reports are compared. A stage
+    regresses when it takes more than ``1 + tolerance`` times its baseline time
+    or peak memory, unless it stays below ``min_seconds`` or ``min_bytes``.
+
+    Returns:
+    - List[Regression]: Regressions, in size and pipeline order.
+    """
+    old, new = _results(baseline), _results(current)
+    regressions = []
+    for key in sorted(old.keys() & new.keys(), key=lambda k: (k[0], STAGES.index(k[1]))):
+        before, after = old[key], new[key]
+        if after.seconds > before.seconds * (1 + tolerance) and after.seconds >= min_seconds:
+            regressions.append(Regression(*key, "seconds", before.seconds, after.seconds))
+        if (before.peak_bytes is not None and after.peak_bytes is not None
+                and after.peak_bytes > before.peak_bytes * (1 + tolerance) and after.peak_bytes >= min_bytes):
+            regressions.append(Regression(*key, "peak_bytes", before.peak_bytes, after.peak_bytes))
+    return regressions
@@ -4,39 +4,209 @@ The Black Lodge: High-dimensional data handling
 Like the mysterious Black Lodge, this is where our raw high-dimensional data resides
 """
 
+import os
+import time
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Iterator, List, Tuple, Optional
 import logging
 from PIL import Image
+from .feature_extraction import DEFAULT_PALETTE, extract_labels, label_dtype
+from .data_processing import iter_row_chunks
+from .manifest import Manifest
+from .owl_cave import Metrics, instrumented
 
 class BlackLodge:
     """Handles loading and processing of high-dimensional data"""
     
-    def __init__(self, data_dir: Path, logger: Optional[logging.Logger] = None):
+    def __init__(self,
+                 data_dir: Path,
+                 logger: Optional[logging.Logger] = None,
+                 *,
+                 palette: Optional[np.ndarray] = None,
+                 grid: Tuple[int, int] = (2, 2),
+                 chunk_rows: int = 1 << 20,
+                 stat_workers: Optional[int] = None,
+                 metrics: Optional[Metrics] = None):
         self.data_dir = Path(data_dir)
+        self.chunk_rows = chunk_rows
+        self.stat_workers = stat_workers
+        self.palette = DEFAULT_PALETTE if palette is None else np.asarray(palette, dtype=np.uint8)
+        self.grid = tuple(grid)
         self.logger = logger or logging.getLogger(__name__)
+        self.metrics = metrics or Metrics(logger=self.logger)
         self.labels = None
         self.image_paths = []
+        self.manifest = None
         
+    @instrumented("enter")
     def enter(self) -> Tuple[List[str], np.ndarray]:
         """Enter the Black Lodge to retrieve our data"""
         self.logger.info("Entering the Black Lodge...")
         
-        # Load labels if they exist
-        labels_path = self.data_dir / 'labels.npy'
-        if labels_path.exists():
-            self.labels = np.load(labels_path)
-            self.logger.debug(f"Labels shape: {self.labels.shape}")
-        
-        # Get image paths
-        self.image_paths = sorted(
-            str(p) for p in self.data_dir.glob('image_*.png')
-        )
+        # The manifest replaces a full directory listing on every start
+        self.manifest = Manifest(self.data_dir, n_workers=self.stat_workers, logger=self.logger)
+        self.manifest.load()
+        self.manifest.scan()
+        self.image_paths = self.manifest.paths()
         
         if len(self.image_paths) == 0:
             raise FileNotFoundError(f"No images found in {self.data_dir}")
             
         self.logger.info(f"Found {len(self.image_paths)} images")
         
+        # Map labels if they exist; rows are only read when a stage touches them
+        labels_path = self.data_dir / 'labels.npy'
+        if labels_path.exists():
+            self.labels = np.load(labels_path, mmap_mode='r')
+            self.logger.debug(f"Labels shape: {self.labels.shape}")
+            if os.stat(labels_path).st_mtime_ns != self.manifest.labels_mtime_ns:
+                self.manifest.adopt_labels(labels_path, len(self.labels))
+            if not self.manifest.labels_in_order():
+                self.labels = self.update_labels()
+        else:
+            # Without a labels file the colour codes come from the pixels
+            self.labels = self.extract_features()
+        
+        if self.manifest.modified:
+            self.manifest.save()
+        
+        self.metrics.count(rows=len(self.image_paths), columns=self.labels.shape[1])
         return self.image_paths, self.labels
+    
+    def iter_label_chunks(self, chunk_rows: Optional[int] = None) -> Iterator[np.ndarray]:
+        """
+        Walk the labels in blocks of ``chunk_rows`` rows (``self.chunk_rows`` by default).
+
+        Blocks are views of the memory-mapped file, so peak memory is bounded by
+        the block size rather than the collection size.
+        """
+        if self.labels is None:
+            raise ValueError("No labels loaded. Call enter() first.")
+        return iter_row_chunks(self.labels, chunk_rows or self.chunk_rows)
+    
+    def update_labels(self) -> np.ndarray:
+        """
+        Rewrite labels.npy to match the manifest.
+
+        Rows of deleted images are dropped, the remaining rows are copied into
+        index order block by block, and only new or changed images are decoded.
+
+        Returns:
+        - np.ndarray: Labels of shape (n_images, n_columns), backed by labels.npy.
+        """
+        manifest = self.manifest
+        stale = manifest.needs_extraction | (manifest.label_row < 0)
+        n_cells = self.grid[0] * self.grid[1]
+        if stale.any() and (self.labels.dtype.kind not in 'ui' or self.labels.shape[1] != n_cells):
+            raise ValueError(
+                f"labels.npy has no current rows for {stale.sum()} new or changed images "
+                f"and does not hold grid colour labels; delete it to extract labels from the pixels"
+            )
+        
+        labels_path = self.data_dir / 'labels.npy'
+        partial_path = self.data_dir / 'labels.partial.npy'
+        labels = np.lib.format.open_memmap(
+            partial_path, mode='w+', dtype=self.labels.dtype, shape=(len(manifest),) + self.labels.shape[1:]
+        )
+        kept = np.flatnonzero(~stale)
+        for rows in iter_row_chunks(kept, self.chunk_rows):
+            labels[rows] = self.labels[manifest.label_row[rows]]
+        if stale.any():
+            self.logger.info(f"Re-extracting labels for {stale.sum()} new or changed images")
+            stale_rows = np.flatnonzero(stale)
+            self._label_images([self.image_paths[row] for row in stale_rows], labels, stale_rows)
+        
+        labels.flush()
+        del labels
+        self.labels = None
+        os.replace(partial_path, labels_path)
+        manifest.labels_written(labels_path)
+        self.labels = np.load(labels_path, mmap_mode='r')
+        return self.labels
+    
+    @instrumented("extract_features")
+    def extract_features(self,
+                         image_paths: Optional[List[str]] = None,
+                         n_workers: Optional[int] = None,
+                         chunk_size: int = 256,
+                         use_processes: bool = False,
+                         max_size: int = 64) -> np.ndarray:
+        """
+        Derive grid colour labels from the pixels and write them to labels.npy.
+
+        Images are decoded at reduced resolution in a worker pool, one chunk of
+        paths per task. Labels are written into a memory-mapped file as chunks
+        complete, and moved to labels.npy once every image is done.
+
+        Parameters:
+        - image_paths (list, optional): Images to label, the collection found by ``enter`` by default.
+        - n_workers (int, optional): Pool size, one worker per core by default.
+        - chunk_size (int): Images per task.
+        - use_processes (bool): Use a process pool instead of threads; Pillow releases
+          the GIL while decoding, so threads usually scale as well.
+        - max_size (int): Approximate decoded size per side.
+
+        Returns:
+        - np.ndarray: Labels of shape (n_images, rows * cols), backed by labels.npy.
+        """
+        image_paths = self.image_paths if image_paths is None else image_paths
+        n_images = len(image_paths)
+        n_cells = self.grid[0] * self.grid[1]
+        n_workers = n_workers or os.cpu_count() or 1
+        labels_path = self.data_dir / 'labels.npy'
+        partial_path = self.data_dir / 'labels.partial.npy'
+        
+        self.logger.info(
+            f"Extracting {self.grid[0]}x{self.grid[1]} colour labels from {n_images} images "
+            f"in a {'process' if use_processes else 'thread'} pool of {n_workers}"
+        )
+        labels = np.lib.format.open_memmap(
+            partial_path, mode='w+', dtype=label_dtype(len(self.palette)), shape=(n_images, n_cells)
+        )
+        elapsed = self._label_images(
+            image_paths, labels, np.arange(n_images), n_workers, chunk_size, use_processes, max_size
+        )
+        
+        labels.flush()
+        del labels
+        os.replace(partial_path, labels_path)
+        self.logger.info(
+            f"Extracted labels for {n_images} images in {elapsed:.1f}s "
+            f"({n_images / max(elapsed, 1e-9):.0f} images/sec)"
+        )
+        self.metrics.count(rows=n_images)
+        if self.manifest is not None and image_paths is self.image_paths:
+            self.manifest.labels_written(labels_path)
+        self.labels = np.load(labels_path, mmap_mode='r')
+        return self.labels
+    
+    def _label_images(self,
+                      image_paths: List[str],
+                      labels: np.ndarray,
+                      rows: np.ndarray,
+                      n_workers: Optional[int] = None,
+                      chunk_size: int = 256,
+                      use_processes: bool = False,
+                      max_size: int = 64) -> float:
+        """Decode ``image_paths`` in a worker pool into ``labels[rows]``, returning the seconds taken"""
+        n_images = len(image_paths)
+        n_workers = n_workers or os.cpu_count() or 1
+        started = time.perf_counter()
+        done = 0
+        pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with pool_class(max_workers=n_workers) as pool:
+            futures = {
+                pool.submit(extract_labels, image_paths[start:start + chunk_size],
+                            self.palette, self.grid, max_size): start
+                for start in range(0, n_images, chunk_size)
+            }
+            for future in as_completed(futures):
+                chunk = future.result()
+                start = futures[future]
+                labels[rows[start:start + len(chunk)]] = chunk
+                done += len(chunk)
+                rate = done / max(time.perf_counter() - started, 1e-9)
+                self.logger.debug(f"Labelled {done}/{n_images} images ({rate:.0f} images/sec)")
+        return time.perf_counter() - started
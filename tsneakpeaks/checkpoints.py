@@ -0,0 +1,94 @@
+# tsneakpeaks/checkpoints.py
+"""
+Checkpoints: optimiser state written to disk while an embedding runs
+A pre-empted job restarts from its last checkpoint instead of from scratch
+"""
+
+import os
+import numpy as np
+from pathlib import Path
+from typing import NamedTuple, Optional
+import logging
+
+# File written next to labels.npy in the data directory
+CHECKPOINT_FILE = "embedding_checkpoint.npz"
+
+
+class IterationInfo(NamedTuple):
+    """What engines report to their callbacks; ``coords`` is live, copy it to keep a snapshot"""
+    iteration: int
+    kl_divergence: float
+    grad_norm: float
+    elapsed: float
+    coords: np.ndarray
+
+
+class OptimizerState(NamedTuple):
+    """Everything the optimisation loop needs to continue exactly where it stopped"""
+    coords: np.ndarray
+    gains: np.ndarray
+    update: np.ndarray
+    iteration: int
+    elapsed: float
+    # Iteration the adaptive schedule ended early exaggeration at, None before then
+    exaggeration_end: Optional[int] = None
+
+
+def save_checkpoint(path: Path, state: OptimizerState, fingerprint: str) -> None:
+    """
+    Write optimiser state atomically.
+
+    Parameters:
+    - path (Path): Checkpoint file, replaced in one step so a kill never leaves it half written.
+    - state (OptimizerState): State after ``state.iteration`` iterations.
+    - fingerprint (str): Identifies the run the state belongs to, see ``Engine.run_fingerprint``.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    staging = path.with_name(f".{path.stem}.tmp.npz")
+    np.savez(
+        staging,
+        coords=state.coords,
+        gains=state.gains,
+        update=state.update,
+        iteration=np.array(state.iteration),
+        elapsed=np.array(state.elapsed),
+        exaggeration_end=np.array(-1 if state.exaggeration_end is None else state.exaggeration_end),
+        fingerprint=np.array(fingerprint),
+    )
+    os.replace(staging, path)
+
+
+def load_checkpoint(path: Path,
+                    fingerprint: Optional[str] = None,
+                    logger: Optional[logging.Logger] = None) -> Optional[OptimizerState]:
+    """
+    Read a checkpoint written by ``save_checkpoint``.
+
+    Returns:
+    - OptimizerState or None: None when the file is missing, unreadable, or was
+      written for another run than ``fingerprint``.
+    """
+    logger = logger or logging.getLogger(__name__)
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        with np.load(path) as archive:
+            if fingerprint is not None and str(archive["fingerprint"]) != fingerprint:
+                logger.info(f"Checkpoint at {path} belongs to another run, ignoring it")
+                return None
+            return OptimizerState(
+                coords=archive["coords"],
+                gains=archive["gains"],
+                update=archive["update"],
+                iteration=int(archive["iteration"]),
+                elapsed=float(archive["elapsed"]),
+                exaggeration_end=(
+                    int(archive["exaggeration_end"])
+                    if "exaggeration_end" in archive.files and int(archive["exaggeration_end"]) >= 0 else None
+                ),
+            )
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+        return None
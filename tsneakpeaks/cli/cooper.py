@@ -8,29 +8,116 @@ import argparse
 import sys
 from pathlib import Path
 from ..laura import TSneakPeaks
-from ..owl_cave import setup_logging
+from ..engines import ENGINES
+from ..sweep import parameter_grid
+from ..owl_cave import Metrics, setup_logging
 
 def main():
     parser = argparse.ArgumentParser(
         description="TSneakPeaks: A dimensional journey through image collections"
     )
     parser.add_argument("data_dir", type=str, help="Path to image directory")
-    parser.add_argument("--perplexity", type=int, default=30,
-                       help="t-SNE perplexity parameter")
+    parser.add_argument("--perplexity", type=float, nargs="+", default=None,
+                       help="t-SNE perplexity parameter (several values with --sweep)")
+    parser.add_argument("--n-iter", type=int, default=None,
+                       help="t-SNE iterations")
+    parser.add_argument("--engine", type=str, default="auto",
+                       choices=["auto"] + sorted(ENGINES),
+                       help="t-SNE engine, 'auto' picks one by dataset size")
+    parser.add_argument("--init", type=str, default=None, choices=["random", "pca"],
+                       help="Start t-SNE from a random cloud or from the PCA preview (default: random)")
+    parser.add_argument("--schedule", type=str, default=None, choices=["fixed", "adaptive"],
+                       help="'adaptive' stops early once the KL divergence flattens, --n-iter then caps it (default: fixed)")
+    parser.add_argument("--preview", action="store_true",
+                       help="Show a PCA preview of the images before t-SNE finishes")
+    parser.add_argument("--palette", type=str, default=None,
+                       help="Palette file for extracting labels from the pixels")
+    parser.add_argument("--grid", type=int, nargs=2, default=None, metavar=("ROWS", "COLS"),
+                       help="Grid of cells to label per image (default: 2 2)")
+    parser.add_argument("--dedup", action="store_true",
+                       help="Embed identical label rows once, weighted by how many images share them")
+    parser.add_argument("--landmarks", type=float, default=None, metavar="FRACTION",
+                       help="Embed only this fraction of the images in full and place the rest among them")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Neither read nor write the embedding cache")
+    parser.add_argument("--refresh", action="store_true",
+                       help="Recompute the embedding and overwrite the cached one")
+    parser.add_argument("--progress", type=int, default=0, metavar="N",
+                       help="Report KL divergence and gradient norm every N iterations")
+    parser.add_argument("--sweep", type=str, default=None, metavar="RESULTS_DIR",
+                       help="Run a parameter sweep into RESULTS_DIR instead of visualizing")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[42],
+                       help="Random seeds to sweep")
+    parser.add_argument("--learning-rates", type=float, nargs="+", default=None,
+                       help="Learning rates to sweep (default: automatic)")
+    parser.add_argument("--exaggerations", type=float, nargs="+", default=[12.0],
+                       help="Early exaggeration factors to sweep")
+    parser.add_argument("--jobs", type=int, default=None,
+                       help="Worker processes for the sweep (default: all cores)")
+    parser.add_argument("--metrics", type=str, default=None, metavar="PATH",
+                       help="Append stage metrics to PATH as JSON lines, or write Prometheus text if it ends in .prom")
+    parser.add_argument("--profile", type=str, default=None, metavar="DIR",
+                       help="Save a cProfile report and the metrics of every stage into DIR")
     parser.add_argument("--debug", action="store_true",
                        help="Enable debug logging")
     
     args = parser.parse_args()
     logger = setup_logging(debug=args.debug)
+    prometheus = args.metrics is not None and args.metrics.endswith(".prom")
+    jsonl_path = args.metrics if args.metrics and not prometheus else None
+    if args.profile:
+        Path(args.profile).mkdir(parents=True, exist_ok=True)
+        jsonl_path = jsonl_path or Path(args.profile) / "metrics.jsonl"
+    metrics = Metrics(jsonl_path=jsonl_path, profile_dir=args.profile, logger=logger)
+    if args.perplexity and len(args.perplexity) > 1 and not args.sweep:
+        parser.error("Several perplexities need --sweep")
     
     try:
-        peaks = TSneakPeaks(args.data_dir, logger=logger)
+        peaks = TSneakPeaks(
+            args.data_dir,
+            engine=args.engine,
+            init=args.init,
+            schedule=args.schedule,
+            perplexity=args.perplexity[0] if args.perplexity else None,
+            n_iter=args.n_iter,
+            palette_file=args.palette,
+            grid=tuple(args.grid) if args.grid else None,
+            dedup=args.dedup or None,
+            landmarks=args.landmarks,
+            use_cache=not args.no_cache,
+            refresh_cache=args.refresh,
+            metrics=metrics,
+            logger=logger
+        )
         peaks.load_data()
+        if args.sweep:
+            configs = parameter_grid(
+                args.perplexity or [peaks.white_lodge.perplexity],
+                seeds=args.seeds,
+                learning_rates=args.learning_rates or [None],
+                exaggerations=args.exaggerations
+            )
+            peaks.sweep(args.sweep, configs, n_jobs=args.jobs)
+            return
+        if args.preview:
+            peaks.visualize(title="TSneakPeaks: A Glimpse", preview=True).show()
+        if args.progress > 0:
+            def report(info):
+                logger.info(
+                    f"Iteration {info.iteration}: KL divergence = {info.kl_divergence:.4f}, "
+                    f"gradient norm = {info.grad_norm:.2e}, {info.elapsed:.0f}s elapsed"
+                )
+            peaks.reduce_dimensions(callbacks=[report], callback_every=args.progress)
         fig = peaks.visualize()
         fig.show()
     except Exception as e:
         logger.error(f"Error: {e}")
         sys.exit(1)
+    finally:
+        if prometheus:
+            metrics.write_prometheus(args.metrics)
+        for name, total in metrics.totals.items():
+            logger.debug(f"{name}: {total['wall_seconds']:.2f}s wall, {total['cpu_seconds']:.2f}s CPU over {total['runs']} runs")
 
 if __name__ == "__main__":
     main()
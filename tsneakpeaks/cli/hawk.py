@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark command line for TSneakPeaks
+Named after Deputy Hawk, who reads the tracks and notices when they change
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from ..benchmark import (
+    BENCHMARK_SIZES,
+    MIN_SECONDS,
+    REGRESSION_TOLERANCE,
+    STAGES,
+    compare_reports,
+    format_report,
+    load_report,
+    run_benchmark,
+    save_report,
+)
+from ..engines import ENGINES
+from ..owl_cave import setup_logging
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time every pipeline stage on synthetic collections and track regressions"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Measure every stage at every size")
+    run.add_argument("--sizes", type=int, nargs="+", default=list(BENCHMARK_SIZES),
+                     help="Collection sizes to synthesise and measure")
+    run.add_argument("--stages", type=str, nargs="+", default=list(STAGES), choices=STAGES,
+                     help="Stages to measure (without 'project' the figure uses random coordinates)")
+    run.add_argument("--work-dir", type=str, default="benchmark_data",
+                     help="Directory holding the synthetic collections, reused across runs")
+    run.add_argument("--output", type=str, default="benchmark.json",
+                     help="JSON report to write")
+    run.add_argument("--n-iter", type=int, default=None,
+                     help="t-SNE iterations (default: the White Lodge default)")
+    run.add_argument("--engine", type=str, default="auto",
+                     choices=["auto"] + sorted(ENGINES),
+                     help="t-SNE engine, 'auto' picks one by dataset size")
+    run.add_argument("--dedup", action="store_true",
+                     help="Embed identical label rows once")
+    run.add_argument("--schedule", type=str, default="fixed", choices=["fixed", "adaptive"],
+                     help="t-SNE iteration schedule")
+    run.add_argument("--landmarks", type=float, default=None, metavar="FRACTION",
+                     help="Embed only this fraction of the points in full")
+    run.add_argument("--no-memory", action="store_true",
+                     help="Do not sample peak memory")
+    run.add_argument("--seed", type=int, default=0,
+                     help="Seed of the synthetic labels")
+
+    compare = commands.add_parser("compare", help="Flag stages slower or bigger than a baseline")
+    compare.add_argument("baseline", type=str, help="Baseline JSON report")
+    compare.add_argument("current", type=str, help="JSON report to check")
+    compare.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                         help="Allowed growth as a fraction of the baseline")
+    compare.add_argument("--min-seconds", type=float, default=MIN_SECONDS,
+                         help="Stages faster than this are never flagged")
+
+    parser.add_argument("--debug", action="store_true",
+                        help="Enable debug logging")
+
+    args = parser.parse_args()
+    logger = setup_logging(debug=args.debug)
+
+    if args.command == "run":
+        params = {"engine": args.engine, "dedup": args.dedup}
+        if args.schedule != "fixed":
+            params["schedule"] = args.schedule
+        if args.landmarks is not None:
+            params["landmarks"] = args.landmarks
+        if args.n_iter is not None:
+            params["n_iter"] = args.n_iter
+        report = run_benchmark(
+            Path(args.work_dir),
+            sizes=args.sizes,
+            stages=args.stages,
+            memory=not args.no_memory,
+            random_state=args.seed,
+            logger=logger,
+            **params
+        )
+        save_report(report, Path(args.output))
+        print(format_report(report))
+        return
+
+    baseline, current = load_report(Path(args.baseline)), load_report(Path(args.current))
+    if baseline["params"] != current["params"]:
+        logger.warning(f"Reports ran with different parameters: {baseline['params']} and {current['params']}")
+    print(format_report(current))
+    regressions = compare_reports(baseline, current, tolerance=args.tolerance, min_seconds=args.min_seconds)
+    for regression in regressions:
+        unit = "s" if regression.metric == "seconds" else " bytes"
+        print(
+            f"REGRESSION {regression.stage} at {regression.n_images} images: {regression.metric} "
+            f"{regression.baseline:g}{unit} -> {regression.current:g}{unit} ({regression.ratio:.2f}x)"
+        )
+    if regressions:
+        sys.exit(1)
+    print("No regressions")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 # File: src/data_processing.py
 
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, issparse
 import numpy as np
+import hashlib
 
 def convert_to_sparse_one_hot(image_data, num_quadrants, num_colors):
     """
@@ -29,3 +30,206 @@ def convert_to_sparse_one_hot(image_data, num_quadrants, num_colors):
     
     return sparse_matrix
 
+
+def _one_hot_index_dtype(num_rows, num_quadrants, num_colors):
+    """Smallest index dtype scipy accepts for the batched one-hot CSR."""
+    if num_rows * num_quadrants < 2**31 and num_quadrants * num_colors < 2**31:
+        return np.int32
+    return np.int64
+
+def _fill_one_hot_indices(out, label_chunk, num_colors):
+    """Write flattened column indices for one chunk of labels into ``out``."""
+    num_quadrants = label_chunk.shape[1]
+    if label_chunk.size:
+        low, high = label_chunk.min(), label_chunk.max()
+        if low < 0 or high >= num_colors:
+            raise ValueError(
+                f"Colour indices must lie in [0, {num_colors - 1}], "
+                f"found values in [{low}, {high}]."
+            )
+    offsets = np.arange(num_quadrants, dtype=out.dtype) * num_colors
+    np.add(label_chunk, offsets, out=out.reshape(-1, num_quadrants), casting="unsafe")
+
+def encode_sparse_one_hot(quadrant_labels, num_colors, num_quadrants=None, chunk_size=None):
+    """
+    Converts a whole dataset of quadrant labels into one sparse one-hot matrix.
+
+    Row ``i`` holds image ``i``; quadrant ``q`` with colour ``c`` sets column
+    ``q * num_colors + c``. Every row has exactly ``num_quadrants`` nonzeros and
+    its column indices are already sorted, so the CSR arrays are written
+    directly without going through COO.
+
+    Parameters:
+    - quadrant_labels (np.ndarray): Array of shape (n_images, num_quadrants) holding
+      colour indices. Compact integer dtypes (uint8/int8) and memory-mapped arrays
+      are used as-is.
+    - num_colors (int): Total number of colors in the palette.
+    - num_quadrants (int, optional): Expected number of quadrants, validated if given.
+    - chunk_size (int, optional): Number of rows converted per pass. Bounds the
+      temporary memory used while reading memory-mapped labels.
+
+    Returns:
+    - csr_matrix: float32 matrix with shape (n_images, num_quadrants * num_colors).
+    """
+    labels = np.asarray(quadrant_labels)
+    if labels.ndim != 2:
+        raise ValueError("quadrant_labels must be a 2D array of shape (n_images, num_quadrants).")
+    num_rows, found_quadrants = labels.shape
+    if num_quadrants is not None and found_quadrants != num_quadrants:
+        raise ValueError(
+            f"Expected {num_quadrants} quadrants per image, got {found_quadrants}."
+        )
+
+    index_dtype = _one_hot_index_dtype(num_rows, found_quadrants, num_colors)
+    indices = np.empty(num_rows * found_quadrants, dtype=index_dtype)
+    step = chunk_size or max(num_rows, 1)
+    for start in range(0, num_rows, step):
+        stop = min(start + step, num_rows)
+        _fill_one_hot_indices(
+            indices[start * found_quadrants:stop * found_quadrants],
+            labels[start:stop],
+            num_colors,
+        )
+
+    indptr = np.arange(0, num_rows * found_quadrants + 1, found_quadrants, dtype=index_dtype)
+    data = np.ones(num_rows * found_quadrants, dtype=np.float32)
+    sparse_matrix = csr_matrix(
+        (data, indices, indptr),
+        shape=(num_rows, found_quadrants * num_colors),
+        copy=False,
+    )
+    sparse_matrix.has_sorted_indices = True
+    return sparse_matrix
+
+def iter_sparse_one_hot(label_chunks, num_colors, num_quadrants=None, chunk_size=65536):
+    """
+    Streaming variant of ``encode_sparse_one_hot``.
+
+    Parameters:
+    - label_chunks (np.ndarray or iterable of np.ndarray): Either a (possibly
+      memory-mapped) label array, which is sliced into ``chunk_size`` rows, or
+      an iterable yielding (rows, num_quadrants) label blocks.
+    - num_colors (int): Total number of colors in the palette.
+    - num_quadrants (int, optional): Expected number of quadrants, validated if given.
+    - chunk_size (int): Rows per block when slicing an array.
+
+    Yields:
+    - csr_matrix: One float32 block of shape (rows, num_quadrants * num_colors) per chunk.
+    """
+    if isinstance(label_chunks, np.ndarray):
+        labels = label_chunks
+        label_chunks = (
+            labels[start:start + chunk_size]
+            for start in range(0, len(labels), chunk_size)
+        )
+    for chunk in label_chunks:
+        yield encode_sparse_one_hot(chunk, num_colors, num_quadrants=num_quadrants)
+
+def iter_row_chunks(array, chunk_rows=None):
+    """
+    Consecutive row blocks of an array, for stages that must not load it whole.
+
+    Parameters:
+    - array (np.ndarray): Array to slice; memory-mapped arrays are only paged in
+      one block at a time.
+    - chunk_rows (int, optional): Rows per block, all rows at once if omitted.
+
+    Yields:
+    - np.ndarray: Views of at most ``chunk_rows`` rows, in order.
+    """
+    num_rows = len(array)
+    step = chunk_rows or max(num_rows, 1)
+    for start in range(0, num_rows, step):
+        yield array[start:start + step]
+
+# 64-bit FNV-1a, used to hash label rows
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+def _row_bytes(block):
+    """Raw bytes of every row of a dense block, or of the indices and values of a CSR block."""
+    if not issparse(block):
+        block = np.ascontiguousarray(block)
+        return block.view(np.uint8).reshape(len(block), -1)
+    block = csr_matrix(block, copy=True)
+    block.sort_indices()
+    row_nnz = np.diff(block.indptr)
+    nnz = int(row_nnz[0]) if len(row_nnz) else 0
+    if np.any(row_nnz != nnz):
+        raise ValueError("Sparse rows can only be deduplicated when they hold equally many nonzeros.")
+    indices = np.ascontiguousarray(block.indices).view(np.uint8).reshape(block.shape[0], -1)
+    data = np.ascontiguousarray(block.data).view(np.uint8).reshape(block.shape[0], -1)
+    return np.hstack([indices, data])
+
+def unique_rows(array, chunk_rows=None):
+    """
+    Groups identical rows, like ``np.unique(array, axis=0)`` but in a few passes.
+
+    Every row is hashed to 64 bits one block at a time, the hashes are sorted
+    once and every row is then compared with its group's representative, so a
+    hash collision can never merge different rows (it falls back to an exact
+    byte sort instead).
+
+    Parameters:
+    - array (np.ndarray or csr_matrix): Rows to group. Sparse rows must all hold
+      the same number of nonzeros, as one-hot encodings do.
+    - chunk_rows (int, optional): Rows hashed and checked per pass.
+
+    Returns:
+    - tuple: ``(index, inverse, counts)``. ``array[index]`` holds one row per
+      group, row ``i`` belongs to group ``inverse[i]`` and ``counts`` holds the
+      group sizes.
+    """
+    num_rows = array.shape[0]
+    step = chunk_rows or max(num_rows, 1)
+    hashes = np.empty(num_rows, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for start in range(0, num_rows, step):
+            row_bytes = _row_bytes(array[start:start + step])
+            h = np.full(len(row_bytes), FNV_OFFSET)
+            for column in row_bytes.T:
+                h ^= column
+                h *= FNV_PRIME
+            hashes[start:start + step] = h
+
+    keys = np.sort(hashes)
+    keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])] if num_rows else keys
+    inverse = np.empty(num_rows, dtype=np.int32 if len(keys) < 2**31 else np.int64)
+    for start in range(0, num_rows, step):
+        inverse[start:start + step] = np.searchsorted(keys, hashes[start:start + step])
+    index = np.empty(len(keys), dtype=np.int64)
+    index[inverse] = np.arange(num_rows)
+
+    for start in range(0, num_rows, step):
+        block = _row_bytes(array[start:start + step])
+        if not np.array_equal(block, _row_bytes(array[index[inverse[start:start + step]]])):
+            row_bytes = _row_bytes(array)
+            _, index, inverse, counts = np.unique(
+                row_bytes.view(np.dtype((np.void, row_bytes.shape[1]))).ravel(),
+                return_index=True, return_inverse=True, return_counts=True,
+            )
+            return index, inverse.ravel(), counts
+    return index, inverse, np.bincount(inverse, minlength=len(keys))
+
+def array_fingerprint(array):
+    """
+    Content hash of a dense or sparse array, including its shape and dtype.
+
+    Parameters:
+    - array (np.ndarray or sparse matrix): Array to hash. Memory-mapped arrays are
+      read sequentially without being copied.
+
+    Returns:
+    - str: Hex digest that changes whenever the array's contents do.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{array.shape}{array.dtype}".encode())
+    if issparse(array):
+        array = csr_matrix(array)
+        parts = (array.indptr, array.indices, array.data)
+    else:
+        parts = (np.asarray(array),)
+    for part in parts:
+        part = np.ascontiguousarray(part)
+        digest.update(memoryview(part.reshape(-1)).cast("B"))
+    return digest.hexdigest()
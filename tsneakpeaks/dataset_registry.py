@@ -0,0 +1,225 @@
+# tsneakpeaks/dataset_registry.py
+"""
+Dataset Registry: many collections served by one app
+Datasets load on first view and the least recently viewed make room for new ones
+"""
+
+import threading
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+from scipy.sparse import issparse
+from typing import Dict, List, NamedTuple, Optional, Union
+import logging
+from .laura import TSneakPeaks
+from .manifest import IMAGE_PATTERN
+from .packed_codes import PackedLabels
+from .projection_job import ProjectionJob
+from .thumbnails import THUMBNAIL_DIR, ThumbnailStore, build_atlases, generate_thumbnails
+
+
+def array_bytes(array) -> int:
+    """
+    Resident size of a dense or sparse array.
+
+    Memory-mapped arrays count as zero: their pages belong to the OS page
+    cache, which drops them under pressure without our help.
+    """
+    if array is None or isinstance(array, np.memmap):
+        return 0
+    if isinstance(array, PackedLabels):
+        return array.nbytes
+    if issparse(array):
+        return array.data.nbytes + array.indices.nbytes + array.indptr.nbytes
+    return np.asarray(array).nbytes
+
+
+def dataset_bytes(job: ProjectionJob, thumbnails: Optional[ThumbnailStore] = None) -> int:
+    """Approximate memory held by a loaded dataset: labels, coordinates, affinities, figures and indexes"""
+    peaks = job.peaks
+    total = array_bytes(peaks.labels) + array_bytes(peaks.coords_3d)
+    if peaks.category_labels is not peaks.labels:
+        total += array_bytes(peaks.category_labels)
+    if peaks.features is not peaks.labels and peaks.features is not peaks.white_lodge.features:
+        total += array_bytes(peaks.features)
+    if peaks.similarity_index is not None:
+        total += peaks.similarity_index.nbytes
+    total += array_bytes(peaks.white_lodge.affinities) + array_bytes(peaks.white_lodge.features)
+    total += array_bytes(peaks.white_lodge.row_inverse)
+    if job.snapshot is not peaks.coords_3d:
+        total += array_bytes(job.snapshot)
+    octree = peaks.visualizer.octree
+    if octree is not None:
+        total += sum(array_bytes(a) for a in (octree.coords, octree.codes, octree.order, octree.priority))
+    total += job.figure_bytes()
+    if thumbnails is not None:
+        total += thumbnails.nbytes
+    return total
+
+
+class LoadedDataset(NamedTuple):
+    """A dataset held by the registry"""
+    name: str
+    job: ProjectionJob
+    thumbnails: ThumbnailStore
+
+
+class DatasetRegistry:
+    """
+    Named data directories, loaded lazily and kept in a memory-budgeted LRU.
+
+    ``get`` starts a dataset's ``ProjectionJob`` on its first view; the registry
+    lock makes concurrent requests for the same cold dataset share that one
+    job. After every view, least-recently-viewed datasets are dropped until the
+    loaded ones fit in ``max_bytes``. The dataset just viewed is never dropped.
+
+    A dropped dataset's job is asked to stop but drains until its thread exits,
+    and its memory counts against the budget until then. Viewing it again
+    meanwhile takes the job back if it has not stopped yet, or waits for it to
+    exit, so two jobs never write to one data directory.
+    ``peek`` and ``thumbnails`` serve status and images without loading a
+    dataset or counting as a view, so that traffic never decides what is evicted.
+    """
+
+    def __init__(self,
+                 max_bytes: int = 2 << 30,
+                 snapshot_every: int = 50,
+                 thumbnail_bytes: int = 16 << 20,
+                 logger: Optional[logging.Logger] = None,
+                 **peaks_kwargs):
+        self.max_bytes = max_bytes
+        self.snapshot_every = snapshot_every
+        self.thumbnail_bytes = thumbnail_bytes
+        self.logger = logger or logging.getLogger(__name__)
+        # Passed to every TSneakPeaks, e.g. engine or perplexity
+        self.peaks_kwargs = peaks_kwargs
+        self.data_dirs: Dict[str, Path] = {}
+        self._loaded: "OrderedDict[str, LoadedDataset]" = OrderedDict()
+        # Evicted datasets whose job thread has not exited yet
+        self._draining: Dict[str, LoadedDataset] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, data_dir: Union[str, Path]) -> None:
+        """Make ``data_dir`` available as ``name``"""
+        with self._lock:
+            self.data_dirs[name] = Path(data_dir)
+
+    def register_root(self, root: Union[str, Path]) -> List[str]:
+        """Register every subdirectory of ``root`` holding images, under its directory name"""
+        names = []
+        for data_dir in sorted(Path(root).iterdir()):
+            if data_dir.is_dir() and next(data_dir.glob(IMAGE_PATTERN), None) is not None:
+                self.register(data_dir.name, data_dir)
+                names.append(data_dir.name)
+        return names
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return sorted(self.data_dirs)
+
+    def loaded(self) -> List[str]:
+        """Loaded dataset names, least recently viewed first"""
+        with self._lock:
+            return list(self._loaded)
+
+    def get(self, name: str) -> LoadedDataset:
+        """
+        The dataset registered as ``name``, loading it in the background if needed.
+
+        Raises:
+        - KeyError: If no dataset is registered under ``name``.
+        """
+        with self._lock:
+            if name not in self.data_dirs:
+                raise KeyError(f"No dataset registered as {name}")
+            dataset = self._loaded.get(name)
+            if dataset is None:
+                dataset = self._reclaim(name) or self._load(name)
+                self._loaded[name] = dataset
+            self._loaded.move_to_end(name)
+            # Under the lock, so a view racing this one cannot take the job back first
+            for stale in self._over_budget():
+                stale.job.stop(timeout=0)
+        return dataset
+
+    def peek(self, name: str) -> Optional[LoadedDataset]:
+        """
+        The dataset registered as ``name`` if it is loaded, None otherwise; never loads it.
+
+        Raises:
+        - KeyError: If no dataset is registered under ``name``.
+        """
+        with self._lock:
+            if name not in self.data_dirs:
+                raise KeyError(f"No dataset registered as {name}")
+            return self._loaded.get(name)
+
+    def thumbnails(self, name: str) -> ThumbnailStore:
+        """
+        Thumbnails of ``name`` without loading it or counting as a view.
+
+        Loaded datasets answer from their in-memory store, others straight from
+        the thumbnail directory written when they were last loaded.
+
+        Raises:
+        - KeyError: If no dataset is registered under ``name``.
+        """
+        dataset = self.peek(name)
+        if dataset is not None:
+            return dataset.thumbnails
+        return ThumbnailStore(self.data_dirs[name] / THUMBNAIL_DIR, max_bytes=0, logger=self.logger)
+
+    def _reclaim(self, name: str) -> Optional[LoadedDataset]:
+        """The evicted dataset ``name`` if its job can carry on; call with the lock held"""
+        dataset = self._draining.pop(name, None)
+        if dataset is None:
+            return None
+        if dataset.job.resume():
+            self.logger.info(f"Taking back evicted dataset {name}")
+            return dataset
+        if dataset.job.running:
+            self.logger.info(f"Waiting for the evicted job of {name} to stop")
+            dataset.job.stop()
+        return None
+
+    def _load(self, name: str) -> LoadedDataset:
+        data_dir = self.data_dirs[name]
+        self.logger.info(f"Loading dataset {name} from {data_dir}")
+        thumbnail_dir = data_dir / THUMBNAIL_DIR
+
+        def prepare_thumbnails(peaks: TSneakPeaks) -> None:
+            paths = generate_thumbnails(peaks.image_paths, thumbnail_dir, logger=peaks.logger)
+            build_atlases(paths, thumbnail_dir)
+
+        peaks = TSneakPeaks(str(data_dir), logger=self.logger, **self.peaks_kwargs)
+        job = ProjectionJob(peaks, self.snapshot_every, on_loaded=prepare_thumbnails, logger=self.logger)
+        thumbnails = ThumbnailStore(thumbnail_dir, max_bytes=self.thumbnail_bytes, logger=self.logger)
+        job.start()
+        return LoadedDataset(name, job, thumbnails)
+
+    def _over_budget(self) -> List[LoadedDataset]:
+        """
+        Drop least-recently-viewed datasets until the rest fit; call with the lock held.
+
+        Datasets evicted by earlier views count in full until their thread
+        exits, so a new load cannot overrun the budget while they drain.
+        """
+        for name in [name for name, d in self._draining.items() if not d.job.running]:
+            del self._draining[name]
+        sizes = {name: dataset_bytes(d.job, d.thumbnails) for name, d in self._loaded.items()}
+        total = sum(sizes.values())
+        total += sum(dataset_bytes(d.job, d.thumbnails) for d in self._draining.values())
+        evicted = []
+        while total > self.max_bytes and len(self._loaded) > 1:
+            name, dataset = self._loaded.popitem(last=False)
+            self._draining[name] = dataset
+            total -= sizes[name]
+            evicted.append(dataset)
+            self.logger.info(f"Evicted dataset {name} ({sizes[name] / 2**20:.1f} MB)")
+        return evicted
+
+    def memory_bytes(self) -> Dict[str, int]:
+        """Approximate memory held by each loaded or still draining dataset"""
+        with self._lock:
+            held = {**self._draining, **self._loaded}
+            return {name: dataset_bytes(d.job, d.thumbnails) for name, d in held.items()}
@@ -0,0 +1,149 @@
+# tsneakpeaks/embedding_cache.py
+"""
+Embedding Cache: finished projections kept on disk between runs
+Entries are addressed by the label bytes and the projection parameters
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+from scipy.sparse import csr_matrix
+from typing import Dict, Optional
+import logging
+
+
+def cache_key(label_fingerprint: str, params: dict) -> str:
+    """Combine a label fingerprint and projection parameters into an entry key"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(label_fingerprint.encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed store of coordinates and affinity matrices.
+
+    Every entry is a directory of ``.npy`` files plus a ``meta.json``, so arrays
+    come back memory-mapped instead of being read into memory. Reading an entry
+    marks it as recently used; writing one evicts least-recently-used entries
+    until the cache fits in ``max_bytes``.
+    """
+
+    def __init__(self,
+                 cache_dir: Path,
+                 max_bytes: int = 1 << 30,
+                 logger: Optional[logging.Logger] = None):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.logger = logger or logging.getLogger(__name__)
+
+    def _entry(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def get_arrays(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """Memory-mapped arrays of an entry, or None on a miss"""
+        entry = self._entry(key)
+        meta_path = entry / "meta.json"
+        if not meta_path.exists():
+            return None
+        try:
+            meta = json.loads(meta_path.read_text())
+            arrays = {
+                name: np.load(entry / f"{name}.npy", mmap_mode="r")
+                for name in meta["arrays"]
+            }
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.warning(f"Ignoring unreadable cache entry {key}: {e}")
+            return None
+
+        # Reads refresh the entry's position in the LRU order
+        os.utime(meta_path)
+        return arrays
+
+    def put_arrays(self, key: str, arrays: Dict[str, np.ndarray], meta: Optional[dict] = None) -> None:
+        """Write an entry atomically, then evict old entries if over budget"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f".{key}-", dir=self.cache_dir))
+        try:
+            for name, array in arrays.items():
+                np.save(staging / f"{name}.npy", np.asarray(array))
+            (staging / "meta.json").write_text(json.dumps({
+                **(meta or {}),
+                "arrays": sorted(arrays),
+                "created": time.time(),
+            }))
+            entry = self._entry(key)
+            if entry.exists():
+                shutil.rmtree(entry)
+            os.replace(staging, entry)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self.logger.debug(f"Cached entry {key}")
+        self.evict()
+
+    def get_coords(self, key: str) -> Optional[np.ndarray]:
+        """Cached embedding coordinates"""
+        arrays = self.get_arrays(key)
+        return None if arrays is None else arrays["coords"]
+
+    def put_coords(self, key: str, coords: np.ndarray, meta: Optional[dict] = None) -> None:
+        self.put_arrays(key, {"coords": coords}, meta)
+
+    def get_affinities(self, key: str) -> Optional[csr_matrix]:
+        """Cached sparse affinity matrix, backed by memory-mapped arrays"""
+        arrays = self.get_arrays(key)
+        if arrays is None:
+            return None
+        n_samples = len(arrays["indptr"]) - 1
+        return csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=(n_samples, n_samples),
+            copy=False,
+        )
+
+    def put_affinities(self, key: str, affinities: csr_matrix, meta: Optional[dict] = None) -> None:
+        self.put_arrays(key, {
+            "data": affinities.data,
+            "indices": affinities.indices,
+            "indptr": affinities.indptr,
+        }, meta)
+
+    def _entries(self):
+        """(last used, size in bytes, path) of every complete entry"""
+        entries = []
+        if not self.cache_dir.exists():
+            return entries
+        for entry in self.cache_dir.iterdir():
+            meta_path = entry / "meta.json"
+            if entry.name.startswith(".") or not meta_path.exists():
+                continue
+            size = sum(f.stat().st_size for f in entry.iterdir())
+            entries.append((meta_path.stat().st_mtime, size, entry))
+        return entries
+
+    def size(self) -> int:
+        """Total bytes held by the cache"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self) -> None:
+        """Remove least-recently-used entries until the cache fits in ``max_bytes``"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            self.logger.debug(f"Evicted cache entry {entry.name}")
+
+    def clear(self) -> None:
+        """Drop every entry"""
+        for _, _, entry in self._entries():
+            shutil.rmtree(entry, ignore_errors=True)
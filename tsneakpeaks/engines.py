@@ -0,0 +1,700 @@
+# tsneakpeaks/engines.py
+"""
+Engines: interchangeable t-SNE optimisers behind the White Lodge
+Every engine takes the same sparse affinity matrix and returns the same result
+"""
+
+import hashlib
+import json
+import time
+import numpy as np
+from pathlib import Path
+from scipy import fft
+from scipy.sparse import csr_matrix
+from sklearn.utils import check_random_state
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Type
+import logging
+from .checkpoints import IterationInfo, OptimizerState, load_checkpoint, save_checkpoint
+from .data_processing import array_fingerprint
+
+# Engine chosen by ``select_engine`` for datasets up to these sizes. Barnes-Hut
+# is chosen up to the size where the FFT engine overtakes it, by embedding dimension
+EXACT_MAX_SAMPLES = 500
+BARNES_HUT_MAX_SAMPLES = {2: 20000, 3: 40000}
+
+# Box cap of the FFT engine's interpolation grid; the FFT runs over (2 * boxes * n_interp) ** d nodes
+MAX_BOXES = 50
+MAX_BOXES_3D = 30
+
+MACHINE_EPSILON = np.finfo(np.double).eps
+
+SCHEDULES = ("fixed", "adaptive")
+
+# The adaptive schedule ends a phase once its KL changes by less than this share over a window
+KL_TOLERANCE = 1e-4
+KL_WINDOW = 50
+
+# Adaptive early exaggeration runs on while its KL still falls, up to this many times as long
+MAX_EXAGGERATION_FACTOR = 4
+
+
+class EmbeddingResult(NamedTuple):
+    """What every engine returns"""
+    coords: np.ndarray
+    kl_divergence: float
+    n_iter: int
+    # True when a callback stopped the run before it finished or converged
+    interrupted: bool = False
+
+
+ENGINES: Dict[str, Type["Engine"]] = {}
+
+
+def register_engine(cls: Type["Engine"]) -> Type["Engine"]:
+    """Class decorator adding an engine to the registry under its ``name``"""
+    ENGINES[cls.name] = cls
+    return cls
+
+
+def select_engine(n_samples: int, with_counts: bool = False, n_components: int = 3) -> str:
+    """
+    Pick the cheapest engine that is still accurate for ``n_samples`` points
+
+    With ``with_counts`` only engines that can weigh points by their counts qualify.
+    """
+    if n_samples <= EXACT_MAX_SAMPLES:
+        return "exact"
+    barnes_hut_max = BARNES_HUT_MAX_SAMPLES.get(n_components, BARNES_HUT_MAX_SAMPLES[2])
+    if n_samples <= barnes_hut_max and not with_counts:
+        return "barnes_hut"
+    return "fft_interp"
+
+
+def get_engine(name: str, logger: Optional[logging.Logger] = None, **kwargs) -> "Engine":
+    """Instantiate a registered engine by name"""
+    if name not in ENGINES:
+        raise ValueError(
+            f"Unknown engine '{name}', expected one of {sorted(ENGINES)}"
+        )
+    return ENGINES[name](logger=logger, **kwargs)
+
+
+class Engine:
+    """
+    Shared t-SNE optimisation loop.
+
+    Subclasses only provide ``objective``, the KL divergence and its gradient for
+    a given affinity matrix and embedding. The loop follows scikit-learn: an early
+    exaggeration phase with momentum 0.5, then momentum 0.8, with per-parameter
+    gains and the "auto" learning rate of max(N / early_exaggeration / 4, 50).
+    The loop reports progress to callbacks and can checkpoint and resume itself.
+
+    The ``adaptive`` schedule follows opt-SNE instead: the learning rate is
+    max(N / early_exaggeration, 50), and each phase ends once its KL changes by
+    less than ``kl_tolerance`` over ``kl_window`` iterations. Early
+    exaggeration still runs for at least ``exaggeration_iter`` iterations,
+    since ending it sooner left clusters less separated, but goes on while it
+    keeps lowering the KL on large datasets. ``n_iter`` then only caps the run.
+    """
+
+    name: str = None
+    # Engines that want affinities over all pairs instead of the kNN graph
+    dense_affinities: bool = False
+    # Engines that can embed points standing for several identical points
+    supports_counts: bool = True
+
+    def __init__(self,
+                 early_exaggeration: float = 12.0,
+                 exaggeration_iter: int = 250,
+                 learning_rate: Optional[float] = None,
+                 min_grad_norm: float = 1e-7,
+                 degrees_of_freedom: Optional[float] = None,
+                 schedule: str = "fixed",
+                 kl_tolerance: float = KL_TOLERANCE,
+                 kl_window: int = KL_WINDOW,
+                 logger: Optional[logging.Logger] = None):
+        if schedule not in SCHEDULES:
+            raise ValueError(f"Unknown schedule '{schedule}', expected one of {SCHEDULES}")
+        self.early_exaggeration = early_exaggeration
+        self.exaggeration_iter = exaggeration_iter
+        self.learning_rate = learning_rate
+        self.min_grad_norm = min_grad_norm
+        self.degrees_of_freedom = degrees_of_freedom
+        self.schedule = schedule
+        self.kl_tolerance = kl_tolerance
+        self.kl_window = kl_window
+        self.logger = logger or logging.getLogger(__name__)
+
+    def params(self) -> dict:
+        """Settings that shape the optimisation, so checkpoints of other runs are never resumed"""
+        params = {
+            'engine': self.name,
+            'schedule': self.schedule,
+            'early_exaggeration': self.early_exaggeration,
+            'exaggeration_iter': self.exaggeration_iter,
+            'learning_rate': self.learning_rate,
+            'min_grad_norm': self.min_grad_norm,
+            'degrees_of_freedom': self.degrees_of_freedom,
+        }
+        if self.schedule == "adaptive":
+            params.update(kl_tolerance=self.kl_tolerance, kl_window=self.kl_window)
+        return params
+
+    def run_fingerprint(self,
+                        P: csr_matrix,
+                        n_components: int,
+                        random_state=None,
+                        init: Optional[np.ndarray] = None,
+                        counts: Optional[np.ndarray] = None) -> str:
+        """Identifies a run by its affinities, engine settings, seed, start and counts"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(array_fingerprint(P).encode())
+        settings = {**self.params(), 'n_components': n_components, 'random_state': random_state}
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        for array in (init, counts):
+            digest.update(b"-" if array is None else array_fingerprint(np.asarray(array)).encode())
+        return digest.hexdigest()
+
+    def objective(self,
+                  P: csr_matrix,
+                  Y: np.ndarray,
+                  dof: float,
+                  compute_error: bool,
+                  counts: Optional[np.ndarray] = None) -> Tuple[float, np.ndarray]:
+        """
+        Return ``(kl_divergence, gradient)``; the KL may be NaN if not requested
+
+        With ``counts``, point i stands for ``counts[i]`` identical points, P holds
+        the total affinity between their groups and Q the total similarity, with
+        pairs inside a group left out like the pairs (i, i). The gradient is the
+        one of a single member, so steps match those of the full dataset.
+        """
+        raise NotImplementedError
+
+    def embed(self,
+              P: csr_matrix,
+              n_components: int = 3,
+              n_iter: int = 1000,
+              random_state=None,
+              init: Optional[np.ndarray] = None,
+              callbacks: Optional[List[Callable[[IterationInfo], Optional[bool]]]] = None,
+              callback_every: int = 1,
+              checkpoint_path: Optional[Path] = None,
+              checkpoint_every: int = 250,
+              counts: Optional[np.ndarray] = None) -> EmbeddingResult:
+        """
+        Optimise an embedding for the joint probabilities ``P``.
+
+        Parameters:
+        - P (csr_matrix): Symmetric affinity matrix summing to one.
+        - n_components (int): Dimension of the embedding.
+        - n_iter (int): Total iterations, early exaggeration included.
+        - random_state (int, optional): Seed for the random initialisation.
+        - init (np.ndarray, optional): Initial coordinates of shape (n_samples, n_components).
+        - callbacks (list, optional): Called with an ``IterationInfo`` every
+          ``callback_every`` iterations; returning True stops the optimisation.
+        - callback_every (int): Iterations between callback calls.
+        - checkpoint_path (Path, optional): Optimiser state is saved there every
+          ``checkpoint_every`` iterations, and a checkpoint already there for the
+          same run (``P``, engine settings, seed, ``init`` and ``counts``) and
+          short of ``n_iter`` is resumed instead of starting over.
+        - checkpoint_every (int): Iterations between checkpoints.
+        - counts (np.ndarray, optional): Number of identical points each point
+          stands for; P then holds total affinities between their groups, e.g.
+          from ``joint_probabilities(..., counts=counts)``.
+
+        Returns:
+        - EmbeddingResult: Final coordinates, KL divergence and iterations run.
+        """
+        n_samples = P.shape[0]
+        if counts is not None and not self.supports_counts:
+            raise ValueError(f"The {self.name} engine cannot embed points with counts")
+        if counts is not None:
+            counts = np.asarray(counts, dtype=np.float64)
+        dof = self.degrees_of_freedom or max(n_components - 1, 1)
+        # The learning rate follows the number of points represented, not embedded
+        n_points = n_samples if counts is None else counts.sum()
+        adaptive = self.schedule == "adaptive"
+        learning_rate = self.learning_rate or max(n_points / self.early_exaggeration / (1 if adaptive else 4), 50)
+        P = csr_matrix(P)
+        P_exaggerated = P * self.early_exaggeration
+        callbacks = callbacks or []
+
+        fingerprint = None
+        state = None
+        if checkpoint_path is not None:
+            fingerprint = self.run_fingerprint(P, n_components, random_state, init, counts)
+            state = load_checkpoint(checkpoint_path, fingerprint, self.logger)
+        if state is not None and state.iteration >= n_iter:
+            self.logger.info(f"Checkpoint at iteration {state.iteration} is not short of {n_iter}, starting over")
+            state = None
+        if state is not None and state.coords.shape == (n_samples, n_components):
+            Y, update, gains = state.coords.copy(), state.update.copy(), state.gains.copy()
+            start, elapsed = state.iteration, state.elapsed
+            exaggeration_end = state.exaggeration_end
+            self.logger.info(f"Resuming from checkpoint at iteration {start}")
+        else:
+            if init is not None:
+                Y = np.array(init, dtype=np.float64)
+            else:
+                Y = 1e-4 * check_random_state(random_state).standard_normal((n_samples, n_components))
+            update = np.zeros_like(Y)
+            gains = np.ones_like(Y)
+            start, elapsed = 0, 0.0
+            exaggeration_end = None
+        # KL at the previous window of the adaptive schedule, within the current phase
+        window_kl = None
+
+        self.logger.info(f"Running {self.name} engine on {n_samples} points for {n_iter} iterations")
+        started = time.perf_counter() - elapsed
+        it = start - 1
+        interrupted = False
+        for it in range(start, n_iter):
+            if adaptive:
+                exploring = exaggeration_end is None or it < exaggeration_end
+            else:
+                exploring = it < self.exaggeration_iter
+            momentum = 0.5 if exploring else 0.8
+            check = (it + 1) % 50 == 0
+            watch = adaptive and (it + 1) % self.kl_window == 0
+            report = bool(callbacks) and (it + 1) % callback_every == 0
+            kl, grad = self.objective(P_exaggerated if exploring else P, Y, dof, check or watch or report, counts)
+
+            increasing = update * grad < 0.0
+            gains[increasing] += 0.2
+            gains[~increasing] *= 0.8
+            np.clip(gains, 0.01, np.inf, out=gains)
+            update = momentum * update - learning_rate * gains * grad
+            Y += update
+
+            stop = interrupted = False
+            if check or report:
+                grad_norm = np.linalg.norm(grad)
+                if report:
+                    info = IterationInfo(it + 1, float(kl), float(grad_norm), time.perf_counter() - started, Y)
+                    stop = interrupted = any([bool(callback(info)) for callback in callbacks])
+                if check:
+                    self.logger.debug(f"Iteration {it + 1}: KL divergence = {kl:.4f}, gradient norm = {grad_norm:.7f}")
+                    if not exploring and grad_norm < self.min_grad_norm:
+                        self.logger.info(f"Converged after {it + 1} iterations")
+                        stop = True
+            if watch:
+                change = np.inf if window_kl is None else (window_kl - kl) / kl
+                window_kl = kl
+                # Exaggeration goes on only while it lowers the KL; the run while the KL moves at all
+                if exploring and it + 1 >= self.exaggeration_iter and (
+                        change < self.kl_tolerance or it + 1 >= MAX_EXAGGERATION_FACTOR * self.exaggeration_iter):
+                    exaggeration_end = it + 1
+                    # The exaggerated KL is no baseline for the plain one
+                    window_kl = None
+                    self.logger.info(f"Early exaggeration flattened after {exaggeration_end} iterations")
+                elif not exploring and abs(change) < self.kl_tolerance:
+                    self.logger.info(
+                        f"KL divergence changed by less than {self.kl_tolerance:g} over {self.kl_window} "
+                        f"iterations, stopping after {it + 1} of {n_iter}"
+                    )
+                    stop = True
+
+            if checkpoint_path is not None and ((it + 1) % checkpoint_every == 0 or stop):
+                save_checkpoint(
+                    checkpoint_path,
+                    OptimizerState(Y, gains, update, it + 1, time.perf_counter() - started, exaggeration_end),
+                    fingerprint,
+                )
+                self.logger.debug(f"Checkpoint written at iteration {it + 1}")
+            if stop:
+                break
+
+        kl, _ = self.objective(P, Y, dof, True, counts)
+        self.logger.info(f"KL divergence after {it + 1} iterations: {kl:.4f}")
+        return EmbeddingResult(Y, float(kl), it + 1, interrupted=interrupted and it + 1 < n_iter)
+
+
+def _attractive_forces(P: csr_matrix,
+                       Y: np.ndarray,
+                       dof: float,
+                       targets: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum of p_ij (1 + d_ij^2 / dof)^-1 (y_i - y_j) over the stored entries of P.
+
+    Columns of P index ``targets`` when given (a frozen embedding), else ``Y`` itself.
+    """
+    targets = Y if targets is None else targets
+    rows = np.repeat(np.arange(P.shape[0]), np.diff(P.indptr))
+    diff = Y[rows] - targets[P.indices]
+    dist2 = np.einsum("ij,ij->i", diff, diff)
+    weights = P.data / (1.0 + dist2 / dof)
+    forces = np.empty_like(Y)
+    for dim in range(Y.shape[1]):
+        forces[:, dim] = np.bincount(rows, weights=weights * diff[:, dim], minlength=Y.shape[0])
+    return forces, dist2
+
+
+def _kl_from_entries(P: csr_matrix,
+                     dist2: np.ndarray,
+                     dof: float,
+                     Z: float,
+                     counts: Optional[np.ndarray] = None) -> float:
+    """KL(P || Q) using only the stored entries of P and the normalisation Z"""
+    p = P.data.astype(np.float64)
+    log_w = -(dof + 1.0) / 2.0 * np.log1p(dist2 / dof)
+    if counts is not None:
+        # Q between two groups is the similarity of their members times both counts
+        rows = np.repeat(np.arange(P.shape[0]), np.diff(P.indptr))
+        log_w = log_w + np.log(counts[rows]) + np.log(counts[P.indices])
+    return float(np.dot(p, np.log(np.maximum(p, MACHINE_EPSILON)) - log_w) + p.sum() * np.log(Z))
+
+
+@register_engine
+class ExactEngine(Engine):
+    """O(N^2) gradient over all pairs, for small datasets"""
+
+    name = "exact"
+    dense_affinities = True
+
+    def objective(self, P, Y, dof, compute_error, counts=None):
+        P_dense = P.toarray().astype(np.float64)
+        sq_norms = np.einsum("ij,ij->i", Y, Y)
+        dist2 = np.maximum(sq_norms[:, None] + sq_norms[None, :] - 2.0 * Y @ Y.T, 0.0)
+        kernel = 1.0 / (1.0 + dist2 / dof)
+        W = kernel ** ((dof + 1.0) / 2.0)
+        np.fill_diagonal(W, 0.0)
+        if counts is not None:
+            W *= counts[:, None] * counts[None, :]
+        Q = np.maximum(W / max(W.sum(), MACHINE_EPSILON), MACHINE_EPSILON)
+
+        kl = np.nan
+        if compute_error:
+            kl = float(np.sum(P_dense * np.log(np.maximum(P_dense, MACHINE_EPSILON) / Q)))
+
+        PQ = (P_dense - Q) * kernel
+        np.fill_diagonal(PQ, 0.0)
+        grad = PQ.sum(axis=1)[:, None] * Y - PQ @ Y
+        grad *= 2.0 * (dof + 1.0) / dof
+        if counts is not None:
+            grad /= counts[:, None]
+        return kl, grad
+
+
+@register_engine
+class BarnesHutEngine(Engine):
+    """O(N log N) Barnes-Hut gradient from scikit-learn's compiled tree code"""
+
+    name = "barnes_hut"
+    # scikit-learn's tree code weighs every point the same
+    supports_counts = False
+
+    def __init__(self, angle: float = 0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.angle = angle
+        try:
+            from sklearn.manifold._t_sne import _kl_divergence_bh
+        except ImportError as e:
+            raise ImportError(
+                "The barnes_hut engine needs scikit-learn's Barnes-Hut t-SNE internals"
+            ) from e
+        try:
+            from sklearn.utils._openmp_helpers import _openmp_effective_n_threads
+            self.num_threads = _openmp_effective_n_threads()
+        except ImportError:
+            self.num_threads = 1
+        self._kl_divergence_bh = _kl_divergence_bh
+
+    def params(self) -> dict:
+        return {**super().params(), 'angle': self.angle}
+
+    def objective(self, P, Y, dof, compute_error, counts=None):
+        n_samples, n_components = Y.shape
+        kl, grad = self._kl_divergence_bh(
+            Y.ravel(), P, dof, n_samples, n_components,
+            angle=self.angle,
+            compute_error=compute_error,
+            num_threads=self.num_threads,
+        )
+        return kl, grad.reshape(n_samples, n_components).astype(np.float64)
+
+
+def _lagrange_weights(u: np.ndarray, n_interp: int) -> np.ndarray:
+    """Lagrange basis weights at relative in-box positions ``u`` for equispaced nodes"""
+    nodes = (np.arange(n_interp) + 0.5) / n_interp
+    weights = np.ones((len(u), n_interp))
+    for j in range(n_interp):
+        for m in range(n_interp):
+            if m != j:
+                weights[:, j] *= (u - nodes[m]) / (nodes[j] - nodes[m])
+    return weights
+
+
+class _InterpolationGrid:
+    """Cube of ``n_boxes ** d`` boxes with ``n_interp`` Lagrange nodes per box and dimension"""
+
+    def __init__(self, low: float, span: float, n_dims: int, n_boxes: int, n_interp: int, dof: float):
+        self.low = low
+        self.n_dims = n_dims
+        self.n_boxes = n_boxes
+        self.n_interp = n_interp
+        self.box_width = span / n_boxes
+        self.n_nodes = n_boxes * n_interp
+        self.dof = dof
+
+    def weights(self, Y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Flat node indices and interpolation weights, both (n_samples, n_interp ** d)"""
+        n_samples = Y.shape[0]
+        p = self.n_interp
+        scaled = (Y - self.low) / self.box_width
+        boxes = np.clip(scaled.astype(np.int64), 0, self.n_boxes - 1)
+        flat = np.zeros((n_samples, 1), dtype=np.int64)
+        weights = np.ones((n_samples, 1))
+        for dim in range(self.n_dims):
+            node_index = boxes[:, dim, None] * p + np.arange(p)
+            dim_weights = _lagrange_weights(scaled[:, dim] - boxes[:, dim], p)
+            flat = (flat[:, :, None] * self.n_nodes + node_index[:, None, :]).reshape(n_samples, -1)
+            weights = (weights[:, :, None] * dim_weights[:, None, :]).reshape(n_samples, -1)
+        return flat, weights
+
+    def potentials(self, flat: np.ndarray, weights: np.ndarray, charges: np.ndarray) -> np.ndarray:
+        """
+        Potentials on the nodes for charges ``(1, y)`` spread from the points.
+
+        Row 0 convolves the unit charge with w_ij (for Z); the remaining rows
+        convolve every charge with w_ij (1 + d_ij^2 / dof)^-1 (for the forces).
+        """
+        n_dims, n_nodes = self.n_dims, self.n_nodes
+
+        # Kernels on the circulant grid of node offsets
+        fft_len = fft.next_fast_len(2 * n_nodes - 1)
+        offsets = np.arange(fft_len)
+        offsets = np.where(offsets < n_nodes, offsets, offsets - fft_len) * (self.box_width / self.n_interp)
+        grid_shape = (fft_len,) * n_dims
+        dist2 = np.zeros(grid_shape)
+        for dim in range(n_dims):
+            shape = [1] * n_dims
+            shape[dim] = fft_len
+            dist2 = dist2 + (offsets ** 2).reshape(shape)
+        base = (1.0 / (1.0 + dist2 / self.dof)).astype(np.float32)
+        kernel_z = base ** ((self.dof + 1.0) / 2.0)
+        kernels = np.stack([kernel_z, kernel_z * base])
+        axes = tuple(range(1, n_dims + 1))
+        kernels_hat = fft.rfftn(kernels, axes=axes, workers=-1)
+
+        grid = np.empty((charges.shape[1], n_nodes ** n_dims), dtype=np.float32)
+        for c in range(charges.shape[1]):
+            grid[c] = np.bincount(
+                flat.ravel(),
+                weights=(weights * charges[:, c, None]).ravel(),
+                minlength=n_nodes ** n_dims,
+            )
+        grid = grid.reshape((charges.shape[1],) + (n_nodes,) * n_dims)
+        grid_hat = fft.rfftn(grid, s=grid_shape, axes=axes, workers=-1)
+        grid_hat = np.concatenate([grid_hat[:1] * kernels_hat[0], grid_hat * kernels_hat[1]])
+        potentials = fft.irfftn(grid_hat, s=grid_shape, axes=axes, workers=-1)
+        potentials = potentials[(slice(None),) + (slice(0, n_nodes),) * n_dims]
+        return potentials.reshape(len(potentials), -1)
+
+    @staticmethod
+    def interpolate(potentials: np.ndarray, flat: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """Potentials at the points, (n_samples, n_potentials)"""
+        return np.einsum("pk,cpk->pc", weights, potentials[:, flat].astype(np.float64))
+
+
+@register_engine
+class FFTInterpEngine(Engine):
+    """
+    FIt-SNE style engine: repulsive forces by grid interpolation and FFT convolution.
+
+    Points are assigned to boxes of a regular grid with ``n_interp`` equispaced
+    Lagrange nodes per box and dimension. Charges are spread onto the nodes, the
+    t-SNE kernels are applied on the node grid as a circulant convolution via FFT,
+    and the potentials are interpolated back, so each iteration costs
+    O(N * n_interp^d + G log G) for G grid nodes instead of O(N^2).
+    """
+
+    name = "fft_interp"
+
+    def __init__(self,
+                 n_interp: int = 3,
+                 intervals_per_integer: float = 1.0,
+                 min_boxes: int = 10,
+                 max_boxes: Optional[int] = None,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.n_interp = n_interp
+        self.intervals_per_integer = intervals_per_integer
+        self.min_boxes = min_boxes
+        self.max_boxes = max_boxes
+        self._warned_capped = False
+
+    def params(self) -> dict:
+        return {**super().params(), 'n_interp': self.n_interp, 'intervals_per_integer': self.intervals_per_integer,
+                'min_boxes': self.min_boxes, 'max_boxes': self.max_boxes}
+
+    def grid(self, low: float, span: float, n_dims: int, dof: float) -> _InterpolationGrid:
+        """
+        Interpolation grid covering ``[low, low + span]`` in every dimension
+
+        Without an explicit ``max_boxes`` 3D grids stop at ``MAX_BOXES_3D``
+        boxes, since their FFT grows with the cube of the box count.
+        """
+        span = max(span, 1e-12)
+        max_boxes = self.max_boxes or (MAX_BOXES_3D if n_dims >= 3 else MAX_BOXES)
+        n_boxes = int(np.clip(np.ceil(span * self.intervals_per_integer), self.min_boxes, max_boxes))
+        if n_boxes < span * self.intervals_per_integer and not self._warned_capped:
+            self.logger.warning(
+                f"Embedding span {span:.1f} exceeds the {max_boxes}-box grid, "
+                f"repulsive forces will be less accurate; raise max_boxes to compensate"
+            )
+            self._warned_capped = True
+        return _InterpolationGrid(low, span, n_dims, n_boxes, self.n_interp, dof)
+
+    def repulsive_forces(self,
+                         Y: np.ndarray,
+                         dof: float,
+                         counts: Optional[np.ndarray] = None) -> Tuple[np.ndarray, float]:
+        """
+        Approximate repulsion and normalisation for every point.
+
+        Returns:
+        - Tuple[np.ndarray, float]: Sum over j of w_ij (1 + d_ij^2 / dof)^-1 (y_i - y_j)
+          per point, and Z = sum over i != j of w_ij. With ``counts`` every point
+          j is a charge of ``counts[j]`` and Z runs over all represented points.
+        """
+        n_samples, n_dims = Y.shape
+        low = Y.min()
+        grid = self.grid(low, Y.max() - low, n_dims, dof)
+        flat, weights = grid.weights(Y)
+        charges = np.ones(n_samples) if counts is None else counts
+        potentials = grid.potentials(flat, weights, np.column_stack([charges, charges[:, None] * Y]))
+
+        phi = grid.interpolate(potentials, flat, weights)
+        # Drop the self terms w_ii = 1
+        Z = max(np.dot(charges, phi[:, 0] - charges), MACHINE_EPSILON)
+        forces = Y * phi[:, 1, None] - phi[:, 2:]
+        return forces, Z
+
+    def objective(self, P, Y, dof, compute_error, counts=None):
+        attractive, dist2 = _attractive_forces(P, Y, dof)
+        if counts is not None:
+            attractive /= counts[:, None]
+        repulsive, Z = self.repulsive_forces(Y, dof, counts)
+        grad = 2.0 * (dof + 1.0) / dof * (attractive - repulsive / Z)
+        kl = _kl_from_entries(P, dist2, dof, Z, counts) if compute_error else np.nan
+        return kl, grad
+
+
+class RepulsionField:
+    """
+    Repulsion exerted by a frozen reference embedding, evaluated at arbitrary points.
+
+    Small references are summed exactly. Larger ones have their charges spread
+    and convolved on an interpolation grid once, so evaluating the field for new
+    points only costs an interpolation per point. New points feel the reference
+    but not each other, which is what out-of-sample placement needs.
+    """
+
+    def __init__(self,
+                 reference: np.ndarray,
+                 dof: float,
+                 engine: Optional[FFTInterpEngine] = None,
+                 margin: float = 0.1):
+        self.reference = np.asarray(reference, dtype=np.float64)
+        self.dof = dof
+        self.grid = None
+        if len(reference) <= EXACT_MAX_SAMPLES:
+            return
+
+        engine = engine or FFTInterpEngine()
+        n_dims = reference.shape[1]
+        pad = margin * (reference.max() - reference.min()) + 1.0
+        self.low = reference.min() - pad
+        self.high = reference.max() + pad
+        self.grid = engine.grid(self.low, self.high - self.low, n_dims, dof)
+        flat, weights = self.grid.weights(self.reference)
+        self.potentials = self.grid.potentials(
+            flat, weights, np.column_stack([np.ones(len(reference)), self.reference])
+        )
+
+    def __call__(self, Y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Repulsion on every point from the reference set.
+
+        Returns:
+        - Tuple[np.ndarray, np.ndarray]: Sum over reference points j of
+          w_ij (1 + d_ij^2 / dof)^-1 (y_i - y_j), and the per-point normalisation
+          Z_i = sum over j of w_ij. Points outside the grid are evaluated at its edge.
+        """
+        if self.grid is None:
+            diff = Y[:, None, :] - self.reference[None, :, :]
+            base = 1.0 / (1.0 + np.einsum("ijk,ijk->ij", diff, diff) / self.dof)
+            W = base ** ((self.dof + 1.0) / 2.0)
+            forces = np.einsum("ij,ijk->ik", W * base, diff)
+            return forces, np.maximum(W.sum(axis=1), MACHINE_EPSILON)
+
+        Y = np.clip(Y, self.low, self.high)
+        flat, weights = self.grid.weights(Y)
+        phi = self.grid.interpolate(self.potentials, flat, weights)
+        Z = np.maximum(phi[:, 0], MACHINE_EPSILON)
+        return Y * phi[:, 1, None] - phi[:, 2:], Z
+
+
+def place_points(P: csr_matrix,
+                 reference: np.ndarray,
+                 init: np.ndarray,
+                 n_iter: int = 100,
+                 learning_rate: float = 1.0,
+                 max_grad_norm: float = 1.0,
+                 degrees_of_freedom: Optional[float] = None,
+                 min_grad_norm: float = 1e-7,
+                 logger: Optional[logging.Logger] = None) -> EmbeddingResult:
+    """
+    Optimise new points against a frozen reference embedding.
+
+    Each new point minimises its own KL divergence between its conditional
+    affinities to the reference set and the t-SNE similarities to the reference
+    coordinates, which never move.
+
+    Parameters:
+    - P (csr_matrix): Conditional affinities of shape (n_new, n_reference), rows summing to one.
+    - reference (np.ndarray): Frozen reference coordinates of shape (n_reference, n_components).
+    - init (np.ndarray): Starting coordinates of the new points, shape (n_new, n_components).
+    - n_iter (int): Optimisation iterations.
+    - learning_rate (float): Step size of the gradient descent. Plain clipped
+      steps are used instead of gains and momentum, which overshoot here because
+      every point starts close to its optimum.
+    - max_grad_norm (float): Per-point gradients are clipped to this norm, which
+      keeps points with few close neighbours from overshooting.
+    - degrees_of_freedom (float, optional): Student-t degrees of freedom, n_components - 1 by default.
+
+    Returns:
+    - EmbeddingResult: Coordinates of the new points, their mean KL divergence and iterations run.
+    """
+    logger = logger or logging.getLogger(__name__)
+    reference = np.asarray(reference, dtype=np.float64)
+    n_components = reference.shape[1]
+    dof = degrees_of_freedom or max(n_components - 1, 1)
+    P = csr_matrix(P)
+    field = RepulsionField(reference, dof)
+
+    Y = np.array(init, dtype=np.float64)
+    coefficient = (dof + 1.0) / dof
+
+    logger.info(f"Placing {Y.shape[0]} points against {reference.shape[0]} frozen points for {n_iter} iterations")
+    it = 0
+    for it in range(n_iter):
+        attractive, _ = _attractive_forces(P, Y, dof, reference)
+        repulsive, Z = field(Y)
+        grad = coefficient * (attractive - repulsive / Z[:, None])
+        norms = np.linalg.norm(grad, axis=1, keepdims=True)
+        grad *= np.minimum(1.0, max_grad_norm / np.maximum(norms, MACHINE_EPSILON))
+        Y -= learning_rate * grad
+
+        if (it + 1) % 50 == 0 and np.linalg.norm(grad) < min_grad_norm:
+            logger.info(f"Placement converged after {it + 1} iterations")
+            break
+
+    _, dist2 = _attractive_forces(P, Y, dof, reference)
+    _, Z = field(Y)
+    rows = np.repeat(np.arange(P.shape[0]), np.diff(P.indptr))
+    p = P.data.astype(np.float64)
+    log_w = -(dof + 1.0) / 2.0 * np.log1p(dist2 / dof)
+    kl = np.dot(p, np.log(np.maximum(p, MACHINE_EPSILON)) - log_w) + np.dot(p, np.log(Z[rows]))
+    return EmbeddingResult(Y, float(kl / max(P.shape[0], 1)), it + 1)
@@ -0,0 +1,132 @@
+# tsneakpeaks/landmarks.py
+"""
+Landmarks: a few points embedded in full, standing in for all the others
+The overview is drawn from the landmarks, every other point is placed among them
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+from typing import Optional
+from .packed_codes import PackedLabels
+
+LANDMARK_METHODS = ("random", "kmeans++")
+
+# Fewer landmarks than this do not make a useful t-SNE, whatever the fraction
+MIN_LANDMARKS = 1000
+
+# k-means++ seeding draws from this many candidates per landmark, not from every point
+POOL_FACTOR = 8
+
+
+def landmark_count(n_samples: int, fraction: float) -> int:
+    """Landmarks for ``fraction`` of ``n_samples``, at least ``MIN_LANDMARKS`` and at most every point"""
+    return min(n_samples, max(MIN_LANDMARKS, int(np.ceil(fraction * n_samples))))
+
+
+def cosine_distances_to(features, row: int) -> np.ndarray:
+    """Cosine distance of every row of L2-normalised ``features`` to row ``row``, as float64"""
+    if isinstance(features, PackedLabels):
+        return features.distances(features[[row]])[0].astype(np.float64)
+    if issparse(features):
+        similarity = (features @ features[row].T).toarray().ravel()
+    else:
+        similarity = features @ features[row]
+    return np.maximum(1.0 - similarity.astype(np.float64), 0.0)
+
+
+def cell_medoids(candidates, owner: np.ndarray, weights: np.ndarray, n_cells: int) -> np.ndarray:
+    """
+    For every cell the candidate closest to the weighted mean of its members.
+
+    Parameters:
+    - candidates (csr_matrix, np.ndarray or PackedLabels): Rows of equal norm.
+    - owner (np.ndarray): Cell of every candidate, each cell holding at least one.
+    - weights (np.ndarray): Weight of every candidate in its cell's mean.
+    - n_cells (int): Number of cells.
+
+    Returns:
+    - np.ndarray: Position of each cell's medoid among the candidates.
+    """
+    if isinstance(candidates, PackedLabels):
+        candidates = candidates.to_one_hot()
+    membership = csr_matrix((weights, (owner, np.arange(len(owner)))), shape=(n_cells, len(owner)))
+    sums = membership @ candidates
+    if issparse(candidates):
+        score = np.asarray(candidates.multiply(sums[owner]).sum(axis=1)).ravel()
+    else:
+        score = np.einsum("ij,ij->i", candidates, sums[owner])
+    # Best score first within every cell, cells in order
+    order = np.lexsort((-score, owner))
+    return order[np.searchsorted(owner[order], np.arange(n_cells))]
+
+
+def kmeans_plus_plus(features,
+                     n_landmarks: int,
+                     counts: Optional[np.ndarray] = None,
+                     pool_size: Optional[int] = None,
+                     random_state: int = 0) -> np.ndarray:
+    """
+    Spread-out rows picked by k-means++ seeding on cosine distance.
+
+    Each landmark is drawn with probability proportional to its squared
+    distance from the closest landmark so far (times its count), so sparse
+    regions and small clusters get landmarks, which uniform sampling misses.
+    Squared distances favour outliers, so every landmark is then moved to the
+    medoid of the candidates closest to it (one Lloyd step), which keeps the
+    coverage but embeds typical rows. Seeding runs over a uniform pool of
+    ``pool_size`` candidates (``POOL_FACTOR`` per landmark by default), so its
+    cost does not grow with the collection. Rows identical to a landmark are
+    never picked, so fewer landmarks come back when the pool has fewer
+    distinct rows.
+
+    Parameters:
+    - features (csr_matrix, np.ndarray or PackedLabels): L2-normalised rows.
+    - n_landmarks (int): Landmarks wanted.
+    - counts (np.ndarray, optional): Samples each row stands for, one by default.
+    - pool_size (int, optional): Candidates to seed from.
+    - random_state (int): Seed of the pool and of every draw.
+
+    Returns:
+    - np.ndarray: Sorted row indices of the landmarks.
+    """
+    rng = np.random.default_rng(random_state)
+    n_samples = features.shape[0]
+    pool_size = min(n_samples, pool_size or POOL_FACTOR * n_landmarks)
+    pool = np.sort(rng.choice(n_samples, pool_size, replace=False)) if pool_size < n_samples else np.arange(n_samples)
+    candidates = features[pool]
+    weights = np.ones(pool_size) if counts is None else np.asarray(counts, dtype=np.float64)[pool]
+
+    chosen = [int(np.searchsorted(np.cumsum(weights), rng.random() * weights.sum(), side="right"))]
+    closest = cosine_distances_to(candidates, chosen[0]) ** 2
+    owner = np.zeros(pool_size, dtype=np.int64)
+    while len(chosen) < n_landmarks:
+        cumulative = np.cumsum(weights * closest)
+        if cumulative[-1] <= 0:
+            break
+        chosen.append(int(np.searchsorted(cumulative, rng.random() * cumulative[-1], side="right")))
+        distances = cosine_distances_to(candidates, chosen[-1]) ** 2
+        closer = distances < closest
+        closest[closer] = distances[closer]
+        owner[closer] = len(chosen) - 1
+    return np.sort(pool[cell_medoids(candidates, owner, weights, len(chosen))])
+
+
+def select_landmarks(features,
+                     n_landmarks: int,
+                     method: str = "random",
+                     counts: Optional[np.ndarray] = None,
+                     random_state: int = 0) -> np.ndarray:
+    """
+    Row indices of ``n_landmarks`` landmarks, sorted.
+
+    ``random`` draws them uniformly (in proportion to ``counts``), so the
+    overview keeps the density of the data; ``kmeans++`` spreads them over it,
+    see ``kmeans_plus_plus``, so rare families get landmarks too.
+    """
+    if method not in LANDMARK_METHODS:
+        raise ValueError(f"Unknown landmark method '{method}', expected one of {LANDMARK_METHODS}")
+    if method == "kmeans++":
+        return kmeans_plus_plus(features, n_landmarks, counts, random_state=random_state)
+    p = None if counts is None else np.asarray(counts, dtype=np.float64) / np.sum(counts)
+    rng = np.random.default_rng(random_state)
+    return np.sort(rng.choice(features.shape[0], n_landmarks, replace=False, p=p))
@@ -6,39 +6,114 @@ Like Laura Palmer, this ties everything together
 
 import numpy as np
 from pathlib import Path
-from typing import Optional
+from scipy.sparse import issparse, vstack
+from typing import Callable, List, Optional, Tuple
 import logging
 
 from .black_lodge import BlackLodge
 from .white_lodge import WhiteLodge
 from .waiting_room import WaitingRoom
 from .red_room import Visualizer
-from .owl_cave import setup_logging, get_config
+from .similarity import SimilarityIndex
+from .neighbour_index import NEIGHBOUR_INDEX_FILE
+from .checkpoints import CHECKPOINT_FILE, IterationInfo
+from .embedding_cache import EmbeddingCache, cache_key
+from .data_processing import array_fingerprint
+from .packed_codes import PackedLabels
+from .sweep import SweepConfig, run_sweep
+from .feature_extraction import load_palette
+from .owl_cave import Metrics, get_config, instrumented, setup_logging
 
 class TSneakPeaks:
     """Main class for the TSneakPeaks visualization system"""
     
     def __init__(self, 
                  data_dir: str,
-                 logger: Optional[logging.Logger] = None):
+                 logger: Optional[logging.Logger] = None,
+                 *,
+                 engine: str = "auto",
+                 init: Optional[str] = None,
+                 schedule: Optional[str] = None,
+                 perplexity: Optional[float] = None,
+                 n_iter: Optional[int] = None,
+                 palette_file: Optional[str] = None,
+                 grid: Optional[Tuple[int, int]] = None,
+                 dedup: Optional[bool] = None,
+                 landmarks: Optional[float] = None,
+                 use_cache: bool = True,
+                 refresh_cache: bool = False,
+                 metrics: Optional[Metrics] = None):
         """Initialize TSneakPeaks"""
         self.data_dir = Path(data_dir)
         self.logger = logger or setup_logging()
+        # Stage timings, memory and counters of every component end up here
+        self.metrics = metrics or Metrics(logger=self.logger)
+        
+        # Load configuration
+        self.config = get_config()
         
         # Initialize components
-        self.black_lodge = BlackLodge(self.data_dir, self.logger)
-        self.white_lodge = WhiteLodge(logger=self.logger)
-        self.waiting_room = WaitingRoom(logger=self.logger)
-        self.visualizer = Visualizer(logger=self.logger)
+        palette_file = palette_file or self.config['palette_file']
+        self.black_lodge = BlackLodge(
+            self.data_dir,
+            palette=load_palette(palette_file) if palette_file else None,
+            grid=grid or self.config['grid'],
+            chunk_rows=self.config['chunk_rows'],
+            stat_workers=self.config['stat_workers'],
+            metrics=self.metrics,
+            logger=self.logger
+        )
+        # Unset parameters keep the White Lodge defaults
+        projection = {'perplexity': perplexity, 'n_iter': n_iter}
+        self.white_lodge = WhiteLodge(
+            engine=engine,
+            init=init or self.config['init'],
+            schedule=schedule or self.config['schedule'],
+            **{name: value for name, value in projection.items() if value is not None},
+            checkpoint_path=self.data_dir / CHECKPOINT_FILE,
+            checkpoint_every=self.config['checkpoint_every'],
+            chunk_rows=self.config['chunk_rows'],
+            dedup=self.config['dedup'] if dedup is None else dedup,
+            landmarks=self.config['landmarks'] if landmarks is None else landmarks,
+            metrics=self.metrics,
+            logger=self.logger
+        )
+        self.waiting_room = WaitingRoom(
+            chunk_rows=self.config['chunk_rows'],
+            num_colors=len(self.black_lodge.palette),
+            metrics=self.metrics,
+            logger=self.logger
+        )
+        self.visualizer = Visualizer(
+            max_points=self.config['max_plot_points'],
+            compact=self.config['compact_figures'],
+            metrics=self.metrics,
+            logger=self.logger
+        )
         
         # Data storage
         self.image_paths = []
         self.labels = None
+        # What t-SNE sees: one-hot rows (or their packed codes) of colour labels, other labels as they are
+        self.features = None
         self.coords_3d = None
+        # Linear preview of the loaded data, drawn while t-SNE has not finished
+        self.preview_coords = None
+        # Colour labels as extracted, before scaling, and their index for similar()
+        self.category_labels = None
+        self.similarity_index = None
         
-        # Load configuration
-        self.config = get_config()
+        # Finished projections are reused across runs unless disabled
+        self.refresh_cache = refresh_cache
+        self.cache = None
+        if use_cache:
+            self.cache = EmbeddingCache(
+                self.config['cache_dir'] or self.data_dir / '.tsneakpeaks_cache',
+                max_bytes=self.config['cache_max_bytes'],
+                logger=self.logger
+            )
         
+    @instrumented("load_data")
     def load_data(self) -> None:
         """Load and prepare data"""
         # Enter the Black Lodge to retrieve our data
@@ -50,23 +125,220 @@ class TSneakPeaks:
             
         # Validate in the Waiting Room
         self.waiting_room.validate_data(self.image_paths, self.labels)
+        self.category_labels = self.labels
+        self.similarity_index = None
         self.labels = self.waiting_room.preprocess_labels(self.labels)
+        self.features = self._encode(self.labels)
+        self.preview_coords = None
+        self.metrics.count(rows=len(self.image_paths))
+        
+    def _encode(self, labels: np.ndarray):
+        """
+        Features of preprocessed labels for the White Lodge
+
+        Colour indices mean nothing as coordinates, so integer labels become
+        one-hot rows over the palette (packed codes when they fit); other
+        labels are used as they are.
+        """
+        if labels.dtype.kind not in 'ui':
+            return labels
+        return self.white_lodge.encode_labels(labels, len(self.black_lodge.palette))
+
+    def _fingerprint(self) -> str:
+        """Content hash of the features, packed codes together with their palette size"""
+        if isinstance(self.features, PackedLabels):
+            return f"{array_fingerprint(self.features.codes)}-packed{self.features.num_colors}"
+        return array_fingerprint(self.features)
+
+    def preview(self) -> np.ndarray:
+        """
+        Linear 3D preview of the loaded data, computed once per load
+
+        Takes seconds where t-SNE takes minutes; see ``WhiteLodge.preview``.
+        """
+        if self.features is None:
+            raise ValueError("No data loaded. Call load_data() first.")
+        if self.preview_coords is None:
+            # The same one-hot rows t-SNE sees, so init='pca' starts from their layout
+            self.preview_coords = self.white_lodge.preview(self.features)
+        return self.preview_coords
         
-    def reduce_dimensions(self) -> None:
-        """Project through the White Lodge"""
+    @instrumented("reduce_dimensions")
+    def reduce_dimensions(self,
+                          callbacks: Optional[List[Callable[[IterationInfo], Optional[bool]]]] = None,
+                          callback_every: int = 1) -> None:
+        """
+        Project through the White Lodge, reusing cached results where possible
+
+        ``callbacks`` receive the optimiser's progress every ``callback_every``
+        iterations. A projection interrupted earlier resumes from its checkpoint.
+        """
         if self.labels is None:
             raise ValueError("No data loaded. Call load_data() first.")
-            
-        self.coords_3d = self.white_lodge.project(self.labels)
         
-    def visualize(self, title: str = "TSneakPeaks: A Vision") -> 'plotly.graph_objects.Figure':
-        """Create visualization in the Red Room"""
+        index_path = self.data_dir / NEIGHBOUR_INDEX_FILE
+        if self.cache is None:
+            self.coords_3d = self.white_lodge.project(
+                self.features,
+                index_path=index_path,
+                callbacks=callbacks,
+                callback_every=callback_every
+            )
+            return
+        
+        # Affinities depend on fewer parameters than coordinates, so they are cached separately
+        fingerprint = self._fingerprint()
+        affinity_params = self.white_lodge.affinity_params()
+        affinity_key = cache_key(fingerprint, affinity_params)
+        embedding_key = cache_key(fingerprint, {**affinity_params, **self.white_lodge.embedding_params()})
+        
+        affinities = None
+        if not self.refresh_cache:
+            coords = self.cache.get_coords(embedding_key)
+            if coords is not None:
+                self.logger.info("Loaded embedding from cache")
+                self.metrics.count(cached=1)
+                self.coords_3d = coords
+                return
+            affinities = self.cache.get_affinities(affinity_key)
+            if affinities is not None:
+                self.logger.info("Loaded affinities from cache")
+        
+        self.coords_3d = self.white_lodge.project(
+            self.features,
+            index_path=index_path,
+            affinities=affinities,
+            callbacks=callbacks,
+            callback_every=callback_every
+        )
+        if affinities is None:
+            self.cache.put_affinities(affinity_key, self.white_lodge.affinities, affinity_params)
+        if self.white_lodge.result.interrupted:
+            # Stopped by a callback; the checkpoint resumes it, the cache only holds finished runs
+            return
+        self.cache.put_coords(embedding_key, self.coords_3d, {
+            'kl_divergence': self.white_lodge.result.kl_divergence,
+            'n_iter': self.white_lodge.result.n_iter,
+        })
+        
+    def sweep(self, results_dir: str, configs: List[SweepConfig], n_jobs: Optional[int] = None) -> List[dict]:
+        """
+        Embed the loaded labels once per configuration into ``results_dir``.
+
+        The neighbour search runs once for the whole sweep; see ``sweep.run_sweep``.
+        """
+        if self.labels is None:
+            raise ValueError("No data loaded. Call load_data() first.")
+        
+        return run_sweep(
+            self.features,
+            configs,
+            Path(results_dir),
+            engine=self.white_lodge.engine,
+            n_iter=self.white_lodge.n_iter,
+            neighbours=self.white_lodge.neighbours,
+            index_path=self.data_dir / NEIGHBOUR_INDEX_FILE,
+            n_jobs=n_jobs,
+            logger=self.logger
+        )
+        
+    @instrumented("append")
+    def append(self, image_paths: List[str], labels: np.ndarray) -> np.ndarray:
+        """
+        Place a batch of new images into the current embedding.
+
+        Existing coordinates stay put; the new points are positioned against them
+        by the White Lodge and appended to the image paths, labels and coordinates.
+        The neighbour index is extended so later batches see these images too.
+        """
         if self.coords_3d is None:
-            self.reduce_dimensions()
+            raise ValueError("No embedding to append to. Call reduce_dimensions() first.")
+        
+        self.waiting_room.validate_data(image_paths, labels)
+        category_labels = labels
+        labels = self.waiting_room.preprocess_labels(labels, self.waiting_room.value_range)
+        features = self._encode(labels)
+        new_coords = self.white_lodge.transform(
+            features,
+            reference_data=self.features,
+            reference_coords=self.coords_3d,
+            index_path=self.data_dir / NEIGHBOUR_INDEX_FILE,
+            extend_index=True
+        )
+        
+        self.image_paths = list(self.image_paths) + list(image_paths)
+        self.labels = np.concatenate([self.labels, labels])
+        if isinstance(features, PackedLabels):
+            self.features = PackedLabels(np.concatenate([self.features.codes, features.codes]),
+                                         features.num_quadrants, features.num_colors)
+        elif issparse(features):
+            self.features = vstack([self.features, features], format="csr")
+        else:
+            self.features = self.labels
+        self.coords_3d = np.vstack([self.coords_3d, new_coords])
+        self.category_labels = np.concatenate([self.category_labels, category_labels])
+        self.similarity_index = None
+        self.preview_coords = None
+        self.logger.info(f"Appended {len(image_paths)} images, {len(self.image_paths)} in total")
+        return new_coords
+        
+    def similar(self,
+                index: int,
+                k: int = 10,
+                metric: str = "count") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Images whose quadrant colours best match those of image ``index``.
+
+        The inverted index is built on the first call and reused until the
+        data changes. Unlike distances in the embedding, scores come straight
+        from the labels.
+
+        Parameters:
+        - index (int): Image to match.
+        - k (int): Number of images to return.
+        - metric (str): 'count' (matching quadrants) or 'cosine' (idf-weighted).
+
+        Returns:
+        - tuple: Image ids and their scores, best first, without ``index`` itself.
+
+        Raises:
+        - ValueError: If no data is loaded or the labels are not integer colours.
+        """
+        if self.category_labels is None:
+            raise ValueError("No data loaded. Call load_data() first.")
+        if self.similarity_index is None:
+            labels = self.category_labels
+            if np.asarray(labels[:1]).dtype.kind not in 'ui':
+                raise ValueError("Similar images need integer colour labels")
+            num_colors = max(len(self.black_lodge.palette), int(labels.max()) + 1)
+            self.similarity_index = SimilarityIndex(
+                labels, num_colors, chunk_rows=self.config['chunk_rows'], logger=self.logger
+            )
+        return self.similarity_index.similar(index, k, metric)
+        
+    @instrumented("visualize")
+    def visualize(self,
+                  title: str = "TSneakPeaks: A Vision",
+                  region: Optional[Tuple[List[float], List[float]]] = None,
+                  preview: bool = False) -> 'plotly.graph_objects.Figure':
+        """
+        Create visualization in the Red Room
+
+        ``region`` is a (low, high) box shown at full resolution; large
+        embeddings are otherwise drawn as a level-of-detail overview. With
+        ``preview`` the linear preview is drawn instead, without waiting for t-SNE.
+        """
+        if preview:
+            coords_3d = self.preview()
+        else:
+            if self.coords_3d is None:
+                self.reduce_dimensions()
+            coords_3d = self.coords_3d
             
         return self.visualizer.create_figure(
-            self.coords_3d,
+            coords_3d,
             self.labels,
             self.image_paths,
-            title
+            title,
+            region=region
         )
@@ -0,0 +1,265 @@
+# tsneakpeaks/manifest.py
+"""
+Manifest: what the Black Lodge knew about the data directory last time
+Startup only lists the directory when it changed, and only re-reads changed images
+"""
+
+import fnmatch
+import os
+import time
+import zipfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+import logging
+
+# File written next to labels.npy in the data directory
+MANIFEST_FILE = "manifest.npz"
+
+# Images the Black Lodge picks up
+IMAGE_PATTERN = "image_*.png"
+
+# Files stat'ed per task by the parallel stat
+STAT_BLOCK_SIZE = 4096
+
+# A directory modified this recently may still change within the same timestamp
+# tick (coarse on network filesystems), so its mtime is not trusted next time
+RACY_WINDOW_NS = 2_000_000_000
+
+
+class ManifestChanges(NamedTuple):
+    """File names found by one scan, relative to the data directory"""
+    added: List[str]
+    changed: List[str]
+    deleted: List[str]
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.deleted)
+
+
+def stat_files(paths: Sequence[str], n_workers: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Size and modification time of many files, stat'ed in a thread pool.
+
+    Returns:
+    - tuple: int64 arrays of sizes and mtimes in nanoseconds, -1 for missing files.
+    """
+    def stat_block(block):
+        stats = np.full((len(block), 2), -1, dtype=np.int64)
+        for i, path in enumerate(block):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stats[i] = st.st_size, st.st_mtime_ns
+        return stats
+
+    blocks = [paths[start:start + STAT_BLOCK_SIZE] for start in range(0, len(paths), STAT_BLOCK_SIZE)]
+    if not blocks:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        stats = np.concatenate(list(pool.map(stat_block, blocks)))
+    return stats[:, 0], stats[:, 1]
+
+
+class Manifest:
+    """
+    Persisted record of the images in a data directory.
+
+    Every image gets an index the first time it is seen and keeps it for as
+    long as it exists, so indices map to the same file across runs; new images
+    get indices after all earlier ones. Alongside its size and mtime, each entry
+    records its row in labels.npy (-1 if it has none) and whether its labels
+    must be extracted again because the file is new or changed.
+    """
+
+    def __init__(self,
+                 data_dir: Path,
+                 pattern: str = IMAGE_PATTERN,
+                 n_workers: Optional[int] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.data_dir = Path(data_dir)
+        self.pattern = pattern
+        self.n_workers = n_workers
+        self.logger = logger or logging.getLogger(__name__)
+        self.path = self.data_dir / MANIFEST_FILE
+        self.names = np.empty(0, dtype=str)
+        self.index = np.empty(0, dtype=np.int64)
+        self.size = np.empty(0, dtype=np.int64)
+        self.mtime_ns = np.empty(0, dtype=np.int64)
+        self.label_row = np.empty(0, dtype=np.int64)
+        self.needs_extraction = np.empty(0, dtype=bool)
+        self.next_index = 0
+        self.dir_mtime_ns = -1
+        self.labels_mtime_ns = -1
+        self.loaded = False
+        # Set when the in-memory state differs from the file
+        self.modified = False
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def load(self) -> bool:
+        """Read the manifest file, returning False if there is no usable one"""
+        if not self.path.exists():
+            return False
+        try:
+            with np.load(self.path) as archive:
+                if str(archive["pattern"]) != self.pattern:
+                    self.logger.info(f"Manifest at {self.path} was built for other files, rescanning")
+                    return False
+                self.names = archive["names"]
+                self.index = archive["index"]
+                self.size = archive["size"]
+                self.mtime_ns = archive["mtime_ns"]
+                self.label_row = archive["label_row"]
+                self.needs_extraction = archive["needs_extraction"]
+                self.next_index = int(archive["next_index"])
+                self.dir_mtime_ns = int(archive["dir_mtime_ns"])
+                self.labels_mtime_ns = int(archive["labels_mtime_ns"])
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as e:
+            self.logger.warning(f"Ignoring unreadable manifest {self.path}: {e}")
+            return False
+        self.loaded = True
+        return True
+
+    def save(self) -> None:
+        """
+        Write the manifest file.
+
+        An existing file is rewritten in place rather than replaced, because
+        replacing it would change the directory mtime the next scan relies on.
+        A write cut short leaves an unreadable file, which only costs a full scan.
+        """
+        mode = "r+b" if self.path.exists() else "wb"
+        with open(self.path, mode) as f:
+            f.truncate(0)
+            np.savez(
+                f,
+                names=self.names,
+                index=self.index,
+                size=self.size,
+                mtime_ns=self.mtime_ns,
+                label_row=self.label_row,
+                needs_extraction=self.needs_extraction,
+                next_index=np.array(self.next_index),
+                dir_mtime_ns=np.array(self.dir_mtime_ns),
+                labels_mtime_ns=np.array(self.labels_mtime_ns),
+                pattern=np.array(self.pattern),
+            )
+        self.modified = False
+
+    def scan(self) -> ManifestChanges:
+        """
+        Bring the manifest up to date with the directory.
+
+        The directory is only listed when its mtime moved since the last scan;
+        known files are stat'ed in parallel to find changed and deleted ones.
+        Without a loaded manifest every image counts as added.
+
+        Returns:
+        - ManifestChanges: Names added, changed and deleted since the last scan.
+        """
+        started = time.time_ns()
+        dir_mtime_ns = os.stat(self.data_dir).st_mtime_ns
+
+        listed = None
+        if dir_mtime_ns != self.dir_mtime_ns:
+            with os.scandir(self.data_dir) as entries:
+                listed = sorted(fnmatch.filter((entry.name for entry in entries), self.pattern))
+            self.logger.debug(f"Listed {len(listed)} images in {self.data_dir}")
+
+        sizes, mtimes = stat_files([str(self.data_dir / name) for name in self.names], self.n_workers)
+        present = sizes >= 0
+        if listed is not None:
+            present &= np.isin(self.names, listed)
+        changed = present & ((sizes != self.size) | (mtimes != self.mtime_ns))
+
+        deleted = self.names[~present].tolist()
+        changes = ManifestChanges(added=[], changed=self.names[changed].tolist(), deleted=deleted)
+        self.size = np.where(present, sizes, self.size)
+        self.mtime_ns = np.where(present, mtimes, self.mtime_ns)
+        self.needs_extraction = self.needs_extraction | changed
+        self._keep(present)
+
+        if listed is not None:
+            known = set(self.names.tolist())
+            added = [name for name in listed if name not in known]
+            self._append(added)
+            changes.added.extend(added)
+
+        trusted_mtime_ns = dir_mtime_ns if started - dir_mtime_ns > RACY_WINDOW_NS else -1
+        self.modified |= bool(changes) or not self.loaded or trusted_mtime_ns != self.dir_mtime_ns
+        self.dir_mtime_ns = trusted_mtime_ns
+        if changes:
+            self.logger.info(
+                f"Manifest: {len(changes.added)} added, {len(changes.changed)} changed, "
+                f"{len(changes.deleted)} deleted"
+            )
+        return changes
+
+    def _keep(self, mask: np.ndarray) -> None:
+        self.names = self.names[mask]
+        self.index = self.index[mask]
+        self.size = self.size[mask]
+        self.mtime_ns = self.mtime_ns[mask]
+        self.label_row = self.label_row[mask]
+        self.needs_extraction = self.needs_extraction[mask]
+
+    def _append(self, names: List[str]) -> None:
+        n_new = len(names)
+        if n_new == 0:
+            return
+        sizes, mtimes = stat_files([str(self.data_dir / name) for name in names], self.n_workers)
+        self.names = np.concatenate([self.names, np.array(names, dtype=str)])
+        self.index = np.concatenate([self.index, self.next_index + np.arange(n_new, dtype=np.int64)])
+        self.size = np.concatenate([self.size, sizes])
+        self.mtime_ns = np.concatenate([self.mtime_ns, mtimes])
+        self.label_row = np.concatenate([self.label_row, np.full(n_new, -1, dtype=np.int64)])
+        self.needs_extraction = np.concatenate([self.needs_extraction, np.ones(n_new, dtype=bool)])
+        self.next_index += n_new
+
+    def paths(self) -> List[str]:
+        """Image paths in index order"""
+        return [str(self.data_dir / name) for name in self.names]
+
+    def path_of(self, index: int) -> str:
+        """Path of the image with a given index"""
+        position = np.searchsorted(self.index, index)
+        if position == len(self.index) or self.index[position] != index:
+            raise KeyError(f"No image with index {index}")
+        return str(self.data_dir / self.names[position])
+
+    def index_of(self, path: str) -> int:
+        """Index of the image at ``path``"""
+        matches = np.flatnonzero(self.names == Path(path).name)
+        if len(matches) == 0:
+            raise KeyError(f"{path} is not in the manifest")
+        return int(self.index[matches[0]])
+
+    def adopt_labels(self, labels_path: Path, n_rows: int) -> None:
+        """
+        Take labels written outside the Black Lodge as one row per image in index order.
+
+        Images beyond the last row keep needing extraction.
+        """
+        self.labels_mtime_ns = os.stat(labels_path).st_mtime_ns
+        positions = np.arange(len(self), dtype=np.int64)
+        covered = positions < n_rows
+        self.label_row = np.where(covered, positions, -1)
+        self.needs_extraction = ~covered
+        self.modified = True
+
+    def labels_in_order(self) -> bool:
+        """True when labels.npy holds exactly one current row per image, in index order"""
+        return not self.needs_extraction.any() and np.array_equal(
+            self.label_row, np.arange(len(self), dtype=np.int64)
+        )
+
+    def labels_written(self, labels_path: Path) -> None:
+        """Record that labels.npy now holds one current row per image, in index order"""
+        self.label_row = np.arange(len(self), dtype=np.int64)
+        self.needs_extraction = np.zeros(len(self), dtype=bool)
+        self.labels_mtime_ns = os.stat(labels_path).st_mtime_ns
+        self.modified = True
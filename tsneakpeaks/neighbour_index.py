@@ -0,0 +1,459 @@
+# tsneakpeaks/neighbour_index.py
+"""
+Neighbour Index: approximate cosine neighbours that survive between runs
+A random-projection forest proposes candidates, NN-descent refines them
+"""
+
+import numpy as np
+from pathlib import Path
+from scipy.sparse import csr_matrix, issparse
+from sklearn.utils import check_random_state
+from typing import Optional, Tuple, Union
+import logging
+from .data_processing import array_fingerprint
+
+ArrayLike = Union[np.ndarray, csr_matrix]
+
+# File written next to labels.npy in the data directory
+NEIGHBOUR_INDEX_FILE = "neighbour_index.npz"
+
+# Pairs evaluated per block when computing candidate distances
+PAIR_BLOCK_SIZE = 1 << 20
+
+
+def pair_distances(features: ArrayLike,
+                   left: np.ndarray,
+                   right: np.ndarray,
+                   left_features: Optional[ArrayLike] = None) -> np.ndarray:
+    """
+    Cosine distances between rows ``left[i]`` and ``right[i]`` of row-normalised features.
+
+    ``left`` indexes ``left_features`` instead when given, e.g. new points queried
+    against the indexed set. Evaluated in blocks so temporary memory stays bounded
+    for any number of pairs.
+    """
+    if left_features is None:
+        left_features = features
+    distances = np.empty(len(left), dtype=np.float32)
+    for start in range(0, len(left), PAIR_BLOCK_SIZE):
+        stop = min(start + PAIR_BLOCK_SIZE, len(left))
+        a, b = left_features[left[start:stop]], features[right[start:stop]]
+        if issparse(features):
+            similarity = np.asarray(a.multiply(b).sum(axis=1)).ravel()
+        else:
+            similarity = np.einsum("ij,ij->i", a, b)
+        distances[start:stop] = 1.0 - similarity
+    np.maximum(distances, 0.0, out=distances)
+    return distances
+
+
+def _project_rows(features: ArrayLike, hyperplanes: np.ndarray, node: np.ndarray) -> np.ndarray:
+    """Dot product of every row with the hyperplane of the node it currently sits in"""
+    if issparse(features):
+        rows = np.repeat(np.arange(features.shape[0]), np.diff(features.indptr))
+        weights = features.data * hyperplanes[node[rows], features.indices]
+        return np.bincount(rows, weights=weights, minlength=features.shape[0])
+    return np.einsum("ij,ij->i", features, hyperplanes[node])
+
+
+def _merge_candidates(indices: np.ndarray,
+                      distances: np.ndarray,
+                      candidates: np.ndarray,
+                      candidate_distances: np.ndarray,
+                      n_neighbors: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Keep the ``n_neighbors`` closest distinct entries per row of current plus candidate lists"""
+    merged = np.hstack([indices, candidates])
+    merged_distances = np.hstack([distances, candidate_distances])
+
+    order = np.argsort(merged, axis=1, kind="stable")
+    merged = np.take_along_axis(merged, order, axis=1)
+    merged_distances = np.take_along_axis(merged_distances, order, axis=1)
+    duplicate = merged[:, 1:] == merged[:, :-1]
+    merged_distances[:, 1:][duplicate] = np.inf
+    merged_distances[merged < 0] = np.inf
+
+    best = np.argpartition(merged_distances, n_neighbors - 1, axis=1)[:, :n_neighbors]
+    best_distances = np.take_along_axis(merged_distances, best, axis=1)
+    order = np.argsort(best_distances, axis=1, kind="stable")
+    best = np.take_along_axis(best, order, axis=1)
+    return (
+        np.take_along_axis(merged, best, axis=1),
+        np.take_along_axis(best_distances, order, axis=1),
+    )
+
+
+class NeighbourIndex:
+    """
+    Approximate k-nearest-neighbour index over row-normalised features.
+
+    ``n_trees`` is the recall/speed knob: every random-projection tree adds one
+    batch of leaf-mates as candidates, and NN-descent then refines the lists by
+    checking neighbours of neighbours until fewer than ``delta * n * k`` entries
+    change. More trees mean higher recall for more build time.
+    """
+
+    def __init__(self,
+                 n_neighbors: int,
+                 n_trees: int = 8,
+                 leaf_size: Optional[int] = None,
+                 n_iters: int = 10,
+                 sample_size: int = 8,
+                 delta: float = 0.001,
+                 random_state: Optional[int] = 42,
+                 logger: Optional[logging.Logger] = None):
+        self.n_neighbors = n_neighbors
+        self.n_trees = n_trees
+        self.leaf_size = leaf_size or max(2 * n_neighbors, 32)
+        self.n_iters = n_iters
+        self.sample_size = sample_size
+        self.delta = delta
+        self.random_state = random_state
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.indices_: Optional[np.ndarray] = None
+        self.distances_: Optional[np.ndarray] = None
+        self.fingerprint_: Optional[str] = None
+        self.recall_: Optional[float] = None
+
+    def _tree_leaves(self, features: ArrayLike, rng: np.random.RandomState) -> np.ndarray:
+        """Leaf id of every point in one random-projection tree with median splits"""
+        n_samples, n_features = features.shape
+        node = np.zeros(n_samples, dtype=np.int64)
+        while True:
+            counts = np.bincount(node)
+            splitting = counts[node] > self.leaf_size
+            if not splitting.any():
+                return node
+
+            hyperplanes = rng.standard_normal((len(counts), n_features))
+            projection = _project_rows(features, hyperplanes, node)
+
+            # Rank every point inside its node; the lower half goes left
+            order = np.lexsort((projection, node))
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            rank = np.empty(n_samples, dtype=np.int64)
+            rank[order] = np.arange(n_samples) - starts[node[order]]
+            side = (splitting & (rank >= counts[node] // 2)).astype(np.int64)
+            node = np.unique(node * 2 + side, return_inverse=True)[1].ravel()
+
+    def _leaf_candidates(self, leaves: np.ndarray) -> np.ndarray:
+        """(n_samples, leaf_size) matrix of leaf-mates for every point, padded with -1"""
+        n_samples = len(leaves)
+        order = np.argsort(leaves, kind="stable")
+        counts = np.bincount(leaves)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        position = np.arange(n_samples) - starts[leaves[order]]
+
+        members = np.full((len(counts), counts.max()), -1, dtype=np.int64)
+        members[leaves[order], position] = order
+        return members[leaves]
+
+    def _evaluate(self,
+                  features: ArrayLike,
+                  candidates: np.ndarray,
+                  rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Distances from each query row to its candidates, inf for padding and self"""
+        if rows is None:
+            rows = np.arange(candidates.shape[0])
+        query = np.repeat(rows, candidates.shape[1])
+        flat = candidates.ravel()
+        valid = (flat >= 0) & (flat != query)
+        distances = np.full(flat.shape, np.inf, dtype=np.float32)
+        distances[valid] = pair_distances(features, query[valid], flat[valid])
+        return distances.reshape(candidates.shape)
+
+    def _fill_missing(self, features: ArrayLike, rng: np.random.RandomState) -> None:
+        """Top up rows that found fewer than k candidates with random points"""
+        n_samples = features.shape[0]
+        while True:
+            missing = np.isinf(self.distances_).any(axis=1)
+            if not missing.any():
+                return
+            rows = np.flatnonzero(missing)
+            candidates = rng.randint(0, n_samples, size=(len(rows), self.n_neighbors))
+            self.indices_[rows], self.distances_[rows] = _merge_candidates(
+                self.indices_[rows], self.distances_[rows],
+                candidates, self._evaluate(features, candidates, rows),
+                self.n_neighbors,
+            )
+
+    def build(self, features: ArrayLike) -> "NeighbourIndex":
+        """
+        Build the index over row-normalised features.
+
+        Parameters:
+        - features (csr_matrix or np.ndarray): Row-normalised features of shape (n_samples, n_features).
+
+        Returns:
+        - NeighbourIndex: ``self``, with ``indices_`` and ``distances_`` of shape (n_samples, n_neighbors).
+        """
+        n_samples = features.shape[0]
+        if self.n_neighbors >= n_samples:
+            raise ValueError(
+                f"n_neighbors ({self.n_neighbors}) must be smaller than the number of samples ({n_samples})"
+            )
+        rng = check_random_state(self.random_state)
+        k = self.n_neighbors
+        self.indices_ = np.full((n_samples, k), -1, dtype=np.int64)
+        self.distances_ = np.full((n_samples, k), np.inf, dtype=np.float32)
+
+        self.logger.info(f"Building neighbour index: {self.n_trees} trees over {n_samples} points")
+        for _ in range(self.n_trees):
+            candidates = self._leaf_candidates(self._tree_leaves(features, rng))
+            self.indices_, self.distances_ = _merge_candidates(
+                self.indices_, self.distances_,
+                candidates, self._evaluate(features, candidates), k,
+            )
+        self._fill_missing(features, rng)
+
+        sample = min(self.sample_size, k)
+        for it in range(self.n_iters):
+            # Local join: neighbours of sampled forward and reverse neighbours
+            columns = rng.rand(n_samples, k).argsort(axis=1)[:, :sample]
+            forward = np.take_along_axis(self.indices_, columns, axis=1)
+            reverse = self._reverse_sample(forward, sample)
+            joined = np.hstack([forward, reverse])
+            candidates = np.where(
+                joined[:, :, None] >= 0,
+                self.indices_[np.maximum(joined, 0)][:, :, :sample],
+                -1,
+            ).reshape(n_samples, -1)
+
+            previous = np.sort(self.indices_, axis=1)
+            self.indices_, self.distances_ = _merge_candidates(
+                self.indices_, self.distances_,
+                candidates, self._evaluate(features, candidates), k,
+            )
+            changed = np.count_nonzero(np.sort(self.indices_, axis=1) != previous)
+            self.logger.debug(f"NN-descent iteration {it + 1}: {changed} neighbour updates")
+            if changed <= self.delta * n_samples * k:
+                break
+
+        self.fingerprint_ = array_fingerprint(features)
+        self.indices_ = self.indices_.astype(np.int32 if n_samples < 2**31 else np.int64)
+        return self
+
+    def _reverse_sample(self, forward: np.ndarray, sample: int) -> np.ndarray:
+        """Up to ``sample`` points that list each point among their sampled neighbours"""
+        n_samples = forward.shape[0]
+        sources = np.repeat(np.arange(n_samples), forward.shape[1])
+        targets = forward.ravel()
+        order = np.argsort(targets, kind="stable")
+        targets, sources = targets[order], sources[order]
+        counts = np.bincount(targets, minlength=n_samples)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        position = np.arange(len(targets)) - starts[targets]
+        keep = position < sample
+
+        reverse = np.full((n_samples, sample), -1, dtype=np.int64)
+        reverse[targets[keep], position[keep]] = sources[keep]
+        return reverse
+
+    def estimate_recall(self, features: ArrayLike, n_queries: int = 1000, block_size: int = 1 << 24) -> float:
+        """
+        Recall against exact neighbours on a random sample of points.
+
+        Ties are common with categorical features, so an approximate neighbour
+        counts as a hit when it is no farther than the exact k-th neighbour.
+        """
+        n_samples = features.shape[0]
+        rng = check_random_state(self.random_state)
+        queries = rng.choice(n_samples, size=min(n_queries, n_samples), replace=False)
+        k = self.n_neighbors
+
+        hits = 0
+        step = max(1, block_size // n_samples)
+        for start in range(0, len(queries), step):
+            block = queries[start:start + step]
+            similarity = features[block] @ features.T
+            if issparse(similarity):
+                similarity = similarity.toarray()
+            distances = 1.0 - np.asarray(similarity, dtype=np.float32)
+            distances[np.arange(len(block)), block] = np.inf
+            kth = np.partition(distances, k - 1, axis=1)[:, k - 1]
+            hits += np.count_nonzero(self.distances_[block] <= kth[:, None] + 1e-6)
+
+        self.recall_ = hits / (len(queries) * k)
+        self.logger.info(f"Neighbour index recall is {self.recall_:.3f} on {len(queries)} sampled points")
+        return self.recall_
+
+    def query(self,
+              features: ArrayLike,
+              queries: ArrayLike,
+              n_neighbors: Optional[int] = None,
+              n_entry_points: int = 2048,
+              block_size: int = 1 << 24) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate neighbours of new points among the indexed features.
+
+        Every query starts from its closest entries in a random sample of indexed
+        points, then walks the neighbour graph best-first: neighbours of its
+        closest unexpanded entries become candidates until every entry near the
+        top of the list has been expanded.
+
+        Parameters:
+        - features (csr_matrix or np.ndarray): The row-normalised features the index was built on.
+        - queries (csr_matrix or np.ndarray): Row-normalised features of the new points.
+        - n_neighbors (int, optional): Neighbours per query, at most the index's ``n_neighbors``.
+        - n_entry_points (int): Size of the random sample the walks start from.
+        - block_size (int): Query-by-entry similarities computed per block.
+
+        Returns:
+        - Tuple[np.ndarray, np.ndarray]: ``(indices, distances)`` of shape
+          (n_queries, n_neighbors), ordered by distance.
+        """
+        k = n_neighbors or self.n_neighbors
+        n_samples, n_queries = features.shape[0], queries.shape[0]
+        rng = check_random_state(self.random_state)
+
+        # Entry points: the best of a shared random sample, scored block by block
+        entry = rng.choice(n_samples, size=min(n_entry_points, n_samples), replace=False)
+        entry_features = features[entry].T
+        n_seeds = min(k, len(entry))
+        seeds = np.empty((n_queries, n_seeds), dtype=np.int64)
+        seed_distances = np.empty((n_queries, n_seeds), dtype=np.float32)
+        step = max(1, block_size // len(entry))
+        for start in range(0, n_queries, step):
+            similarity = queries[start:start + step] @ entry_features
+            if issparse(similarity):
+                similarity = similarity.toarray()
+            best = np.argpartition(-similarity, n_seeds - 1, axis=1)[:, :n_seeds]
+            seeds[start:start + step] = entry[best]
+            seed_distances[start:start + step] = 1.0 - np.take_along_axis(similarity, best, axis=1)
+        indices, distances = _merge_candidates(
+            np.full((n_queries, k), -1, dtype=np.int64),
+            np.full((n_queries, k), np.inf, dtype=np.float32),
+            seeds, np.maximum(seed_distances, 0.0), k,
+        )
+
+        # Best-first walk: expand the closest entries not expanded yet, skipping known pairs
+        rows = np.arange(n_queries)
+        sample = min(self.sample_size, k)
+        expanded = np.zeros((n_queries, k), dtype=bool)
+        for it in range(self.n_iters):
+            columns = np.argsort(expanded, axis=1, kind="stable")[:, :sample]
+            best = np.take_along_axis(indices, columns, axis=1)
+            fresh = ~np.take_along_axis(expanded, columns, axis=1) & (best >= 0)
+            if not fresh.any():
+                break
+            np.put_along_axis(expanded, columns, True, axis=1)
+
+            candidates = np.where(fresh[:, :, None], self.indices_[np.maximum(best, 0)], -1)
+            candidates = np.sort(candidates.reshape(n_queries, -1), axis=1)
+            candidates[:, 1:][candidates[:, 1:] == candidates[:, :-1]] = -1
+            known = np.isin(rows[:, None] * n_samples + candidates, rows[:, None] * n_samples + indices)
+            candidates[known] = -1
+
+            query = np.repeat(rows, candidates.shape[1])
+            flat = candidates.ravel()
+            valid = flat >= 0
+            candidate_distances = np.full(flat.shape, np.inf, dtype=np.float32)
+            candidate_distances[valid] = pair_distances(features, query[valid], flat[valid], queries)
+
+            previous = rows[:, None] * n_samples + indices
+            indices, distances = _merge_candidates(
+                indices, distances,
+                candidates, candidate_distances.reshape(candidates.shape), k,
+            )
+            # Entries that survived the merge keep their expanded flag
+            expanded = np.isin(rows[:, None] * n_samples + indices, previous[expanded])
+            self.logger.debug(f"Query walk iteration {it + 1}: {np.count_nonzero(valid)} candidates")
+        return indices, distances
+
+    def extend(self, features: ArrayLike, indices: np.ndarray, distances: np.ndarray) -> "NeighbourIndex":
+        """
+        Append new points to the index using their neighbours from ``query``.
+
+        Parameters:
+        - features (csr_matrix or np.ndarray): Row-normalised features of the old
+          points followed by the new ones, for the fingerprint.
+        - indices (np.ndarray): Neighbours of the new points, (n_new, n_neighbors).
+        - distances (np.ndarray): Matching distances.
+
+        Returns:
+        - NeighbourIndex: ``self``. Old points keep their lists, so new points
+          only show up as neighbours once the index is rebuilt.
+        """
+        if indices.shape[1] != self.n_neighbors:
+            raise ValueError(
+                f"Index holds {self.n_neighbors} neighbours per point, got {indices.shape[1]}"
+            )
+        n_samples = self.indices_.shape[0] + indices.shape[0]
+        self.indices_ = np.vstack([self.indices_, indices]).astype(
+            np.int32 if n_samples < 2**31 else np.int64
+        )
+        self.distances_ = np.vstack([self.distances_, distances.astype(np.float32)])
+        self.fingerprint_ = array_fingerprint(features)
+        return self
+
+    def graph(self, n_neighbors: Optional[int] = None) -> csr_matrix:
+        """
+        Neighbour graph in the layout of ``affinities.cosine_knn_graph``.
+
+        Every row holds the point itself at distance zero followed by its
+        ``n_neighbors`` nearest neighbours, ordered by distance.
+        """
+        k = n_neighbors or self.n_neighbors
+        if k > self.n_neighbors:
+            raise ValueError(f"Index holds {self.n_neighbors} neighbours per point, {k} requested")
+        n_samples = self.indices_.shape[0]
+        indices = np.hstack([np.arange(n_samples)[:, None], self.indices_[:, :k]])
+        distances = np.hstack([np.zeros((n_samples, 1), dtype=np.float32), self.distances_[:, :k]])
+        indptr = np.arange(0, n_samples * (k + 1) + 1, k + 1)
+        return csr_matrix(
+            (distances.ravel(), indices.ravel(), indptr),
+            shape=(n_samples, n_samples),
+        )
+
+    def matches(self,
+                fingerprint: str,
+                n_neighbors: int,
+                n_trees: Optional[int] = None,
+                random_state: Optional[int] = None) -> bool:
+        """
+        Whether this index was built for the given features with enough neighbours.
+
+        ``n_trees`` and ``random_state``, when given, must match the build too:
+        an index with fewer trees has lower recall, and another seed finds
+        other neighbours.
+        """
+        return (
+            self.fingerprint_ == fingerprint
+            and self.n_neighbors >= n_neighbors
+            and (n_trees is None or self.n_trees == n_trees)
+            and (random_state is None or self.random_state == random_state)
+        )
+
+    def save(self, path: Path) -> None:
+        """Write the index as an uncompressed ``.npz`` archive"""
+        np.savez(
+            Path(path),
+            indices=self.indices_,
+            distances=self.distances_,
+            fingerprint=np.array(self.fingerprint_),
+            recall=np.array(np.nan if self.recall_ is None else self.recall_),
+            n_trees=np.array(self.n_trees),
+            # -1 for an unseeded build, which never matches a seed
+            random_state=np.array(self.random_state if isinstance(self.random_state, (int, np.integer)) else -1),
+        )
+        self.logger.info(f"Saved neighbour index to {path}")
+
+    @classmethod
+    def load(cls, path: Path, logger: Optional[logging.Logger] = None) -> "NeighbourIndex":
+        """Read an index written by ``save``"""
+        with np.load(Path(path)) as archive:
+            index = cls(
+                n_neighbors=archive["indices"].shape[1],
+                n_trees=int(archive["n_trees"]),
+                random_state=None,
+                logger=logger,
+            )
+            # Archives written before the seed was saved load as unseeded
+            if "random_state" in archive.files and int(archive["random_state"]) >= 0:
+                index.random_state = int(archive["random_state"])
+            index.indices_ = archive["indices"]
+            index.distances_ = archive["distances"]
+            index.fingerprint_ = str(archive["fingerprint"])
+            recall = float(archive["recall"])
+            index.recall_ = None if np.isnan(recall) else recall
+        return index
@@ -0,0 +1,152 @@
+# tsneakpeaks/octree.py
+"""
+Octree: level of detail for embeddings too large to draw at once
+The overview keeps every region's share of points, a region query returns all of them
+"""
+
+import numpy as np
+from typing import Optional, Tuple
+import logging
+
+# Levels of subdivision; 2**10 cells per axis fit a Morton code in 30 bits
+MAX_DEPTH = 10
+
+# Share of a thinning budget spent on keeping one point in every occupied cell;
+# the rest is drawn in proportion to density
+CELL_SHARE = 0.1
+
+
+def _spread_bits(values: np.ndarray) -> np.ndarray:
+    """Insert two zero bits after each of the low 10 bits"""
+    values = values.astype(np.uint64)
+    values = (values | (values << np.uint64(16))) & np.uint64(0x030000FF)
+    values = (values | (values << np.uint64(8))) & np.uint64(0x0300F00F)
+    values = (values | (values << np.uint64(4))) & np.uint64(0x030C30C3)
+    values = (values | (values << np.uint64(2))) & np.uint64(0x09249249)
+    return values
+
+
+def morton_codes(cells: np.ndarray) -> np.ndarray:
+    """Interleave integer cell coordinates of shape (n, 3) into Z-order codes"""
+    return (
+        _spread_bits(cells[:, 0])
+        | (_spread_bits(cells[:, 1]) << np.uint64(1))
+        | (_spread_bits(cells[:, 2]) << np.uint64(2))
+    )
+
+
+class Octree:
+    """
+    Points sorted along a Z-order curve, so every octree cell at every level is
+    one contiguous run of the sorted points.
+
+    ``overview`` thins the cloud cell by cell in proportion to how many points
+    each cell holds, keeping at least one point in every occupied cell, so
+    dense clusters stay dense and isolated points stay visible. ``query``
+    visits only the leaf cells whose bounding boxes meet the requested box.
+    """
+
+    def __init__(self,
+                 coords: np.ndarray,
+                 leaf_size: int = 4096,
+                 random_state: Optional[int] = 0,
+                 logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        coords = np.asarray(coords, dtype=np.float32)
+        self.n_points = len(coords)
+        self.low = coords.min(axis=0)
+        self.high = coords.max(axis=0)
+
+        span = np.maximum(self.high - self.low, np.finfo(np.float32).tiny)
+        side = 1 << MAX_DEPTH
+        cells = np.minimum(((coords - self.low) / span * side).astype(np.int64), side - 1)
+        codes = morton_codes(cells)
+        self.order = np.argsort(codes, kind="stable")
+        self.codes = codes[self.order]
+        self.coords = coords[self.order]
+        # Random priorities decide which points of a cell survive thinning
+        self.priority = np.random.default_rng(random_state).random(self.n_points, dtype=np.float32)
+
+        self.leaf_level = MAX_DEPTH
+        for level in range(MAX_DEPTH + 1):
+            starts = self.cell_starts(level)
+            if np.diff(np.append(starts, self.n_points)).max(initial=0) <= leaf_size:
+                self.leaf_level = level
+                break
+        self.leaf_starts = self.cell_starts(self.leaf_level)
+        self.leaf_low = np.minimum.reduceat(self.coords, self.leaf_starts, axis=0)
+        self.leaf_high = np.maximum.reduceat(self.coords, self.leaf_starts, axis=0)
+        self.logger.debug(
+            f"Octree over {self.n_points} points: {len(self.leaf_starts)} leaves at level {self.leaf_level}"
+        )
+
+    def cell_starts(self, level: int) -> np.ndarray:
+        """Positions in the sorted points where each occupied cell of ``level`` begins"""
+        if self.n_points == 0:
+            return np.empty(0, dtype=np.int64)
+        cell_codes = self.codes >> np.uint64(3 * (MAX_DEPTH - level))
+        return np.flatnonzero(np.r_[True, cell_codes[1:] != cell_codes[:-1]])
+
+    def _thin(self, positions: np.ndarray, budget: int) -> np.ndarray:
+        """About ``budget`` of the sorted ``positions``, drawn per cell in proportion to its size"""
+        if len(positions) <= budget:
+            return positions
+        # The deepest level whose occupied cells fit in their share of the budget
+        cell_codes = self.codes[positions]
+        level = 0
+        for candidate in range(MAX_DEPTH, -1, -1):
+            shifted = cell_codes >> np.uint64(3 * (MAX_DEPTH - candidate))
+            if np.count_nonzero(shifted[1:] != shifted[:-1]) + 1 <= budget * CELL_SHARE:
+                level = candidate
+                break
+        shifted = cell_codes >> np.uint64(3 * (MAX_DEPTH - level))
+        starts = np.flatnonzero(np.r_[True, shifted[1:] != shifted[:-1]])
+        counts = np.diff(np.append(starts, len(positions)))
+
+        # The first-ranked point of every cell is always kept; the rest of the
+        # budget is spread evenly, so each cell keeps its share of the points
+        priority = self.priority[positions]
+        keep = priority == np.repeat(np.minimum.reduceat(priority, starts), counts)
+        keep |= priority < max(budget - len(starts), 0) / len(positions)
+        return positions[keep]
+
+    def overview(self, budget: int) -> np.ndarray:
+        """
+        Density-preserving subsample for the zoomed-out view.
+
+        Parameters:
+        - budget (int): Approximate number of points to return.
+
+        Returns:
+        - np.ndarray: Sorted indices into the original ``coords``.
+        """
+        positions = self._thin(np.arange(self.n_points), budget)
+        return np.sort(self.order[positions])
+
+    def query(self, low, high, budget: Optional[int] = None) -> np.ndarray:
+        """
+        Every point inside an axis-aligned box, thinned only past ``budget``.
+
+        Returns:
+        - np.ndarray: Sorted indices into the original ``coords``.
+        """
+        low = np.asarray(low, dtype=np.float32)
+        high = np.asarray(high, dtype=np.float32)
+        hit = np.all((self.leaf_high >= low) & (self.leaf_low <= high), axis=1)
+        leaf_ends = np.append(self.leaf_starts[1:], self.n_points)
+        if not hit.any():
+            return np.empty(0, dtype=np.int64)
+        starts, counts = self.leaf_starts[hit], leaf_ends[hit] - self.leaf_starts[hit]
+        # Every position of every hit leaf, without a Python loop over leaves
+        positions = np.arange(counts.sum()) + np.repeat(starts - np.cumsum(counts) + counts, counts)
+        inside = np.all((self.coords[positions] >= low) & (self.coords[positions] <= high), axis=1)
+        positions = positions[inside]
+        if budget is not None:
+            positions = self._thin(positions, budget)
+        return np.sort(self.order[positions])
+
+    def box_around(self, index: int, fraction: float = 0.125) -> Tuple[np.ndarray, np.ndarray]:
+        """Box centred on point ``index`` spanning ``fraction`` of the cloud along each axis"""
+        centre = self.coords[np.flatnonzero(self.order == index)[0]]
+        half = (self.high - self.low) * fraction / 2
+        return centre - half, centre + half
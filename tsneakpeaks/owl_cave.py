@@ -3,9 +3,24 @@ The Owl Cave: Logging and configuration
 Where we find the map to guide us
 """
 
+import cProfile
+import functools
+import json
 import logging
+import pstats
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Dict, Iterator, List, Optional
+
+# Finished stage runs kept in memory; totals per stage are kept regardless
+METRICS_HISTORY = 1000
+
+# Functions listed in the text summary next to every stage profile
+PROFILE_TOP_FUNCTIONS = 40
 
 def setup_logging(debug: bool = False,
                  log_file: Optional[str] = None) -> logging.Logger:
@@ -33,12 +48,234 @@ def setup_logging(debug: bool = False,
     
     return logger
 
+def proc_memory(field: str) -> Optional[int]:
+    """A memory field of /proc/self/status (e.g. VmRSS, VmHWM) in bytes, None where unavailable"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """Restart the kernel's record of peak resident memory; False where Linux does not offer it"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return proc_memory("VmHWM") is not None
+
+
+class StageRecord:
+    """One run of a pipeline stage: timings, peak memory and counters"""
+
+    def __init__(self, name: str, parent: Optional[str], counters: Dict[str, float]):
+        self.name = name
+        self.parent = parent
+        self.counters = dict(counters)
+        self.started = time.time()
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.start_rss: Optional[int] = proc_memory("VmRSS")
+        self.peak_rss: Optional[int] = self.start_rss
+
+    def as_dict(self) -> dict:
+        return {
+            "stage": self.name,
+            "parent": self.parent,
+            "started": self.started,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_bytes": self.peak_rss,
+            "rss_growth_bytes": None if self.peak_rss is None else self.peak_rss - self.start_rss,
+            "counters": self.counters,
+        }
+
+
+class Metrics:
+    """
+    Wall time, CPU time, peak resident memory and counters of pipeline stages.
+
+    Components open a stage with ``stage`` (or decorate a method with
+    ``instrumented``) and add counters such as rows, nonzeros or iterations
+    with ``count``. Stages nest per thread: a stage opened inside another
+    records it as its parent. Peak memory is the process-wide high-water mark
+    Linux keeps, reset when a stage starts, so stages running concurrently in
+    other threads share it; CPU time is the whole process's.
+
+    Finished runs are appended to ``jsonl_path`` as JSON lines, and
+    ``to_prometheus`` renders per-stage totals as Prometheus text. With a
+    ``profile_dir`` every outermost stage runs under cProfile and its profile
+    is saved there, as a ``.prof`` file and a text summary.
+    """
+
+    def __init__(self,
+                 jsonl_path: Optional[Path] = None,
+                 profile_dir: Optional[Path] = None,
+                 history: int = METRICS_HISTORY,
+                 logger: Optional[logging.Logger] = None):
+        self.jsonl_path = Path(jsonl_path) if jsonl_path else None
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self.logger = logger or logging.getLogger(__name__)
+        self.records: "deque[StageRecord]" = deque(maxlen=history)
+        self.totals: Dict[str, dict] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiles = 0
+
+    def _open(self) -> List[StageRecord]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @staticmethod
+    def _update_peaks(stack: List[StageRecord]) -> None:
+        """Fold the high-water mark since the last reset into every open stage"""
+        peak = proc_memory("VmHWM")
+        if peak is None:
+            return
+        for record in stack:
+            record.peak_rss = max(record.peak_rss or 0, peak)
+
+    @contextmanager
+    def stage(self, name: str, **counters: float) -> Iterator[StageRecord]:
+        """Measure the enclosed block as stage ``name``, with initial counters"""
+        stack = self._open()
+        self._update_peaks(stack)
+        reset_peak_rss()
+        record = StageRecord(name, stack[-1].name if stack else None, counters)
+        profiler = self._start_profile() if not stack else None
+        stack.append(record)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_seconds = time.perf_counter() - wall
+            record.cpu_seconds = time.process_time() - cpu
+            self._update_peaks(stack)
+            stack.pop()
+            if profiler is not None:
+                profiler.disable()
+                self._save_profile(profiler, name)
+            self._finish(record)
+
+    def count(self, **counters: float) -> None:
+        """Set counters of the innermost open stage of this thread, if any"""
+        stack = self._open()
+        if stack:
+            stack[-1].counters.update(counters)
+
+    def _start_profile(self) -> Optional[cProfile.Profile]:
+        if self.profile_dir is None:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active
+            return None
+        return profiler
+
+    def _save_profile(self, profiler: cProfile.Profile, name: str) -> None:
+        with self._lock:
+            self._profiles += 1
+            stem = f"{self._profiles:03d}_{name}"
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(self.profile_dir / f"{stem}.prof")
+        with open(self.profile_dir / f"{stem}.txt", "w") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        self.logger.info(f"Profile of {name} saved to {self.profile_dir / stem}.prof")
+
+    def _finish(self, record: StageRecord) -> None:
+        line = record.as_dict()
+        with self._lock:
+            self.records.append(record)
+            total = self.totals.setdefault(record.name, {
+                "runs": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_bytes": 0, "counters": {},
+            })
+            total["runs"] += 1
+            total["wall_seconds"] += record.wall_seconds
+            total["cpu_seconds"] += record.cpu_seconds
+            total["peak_rss_bytes"] = max(total["peak_rss_bytes"], record.peak_rss or 0)
+            total["counters"].update(record.counters)
+            if self.jsonl_path is not None:
+                with open(self.jsonl_path, "a") as f:
+                    f.write(json.dumps(line) + "\n")
+        peak = "" if record.peak_rss is None else f", peak RSS {record.peak_rss / 2**20:.0f} MiB"
+        self.logger.debug(
+            f"Stage {record.name}: {record.wall_seconds:.3f}s wall, {record.cpu_seconds:.3f}s CPU{peak}"
+        )
+
+    def to_prometheus(self) -> str:
+        """
+        Per-stage totals in the Prometheus text format.
+
+        Runs, wall and CPU seconds are cumulative counters, peak RSS the
+        highest seen, and every stage counter the value of its latest run.
+        """
+        with self._lock:
+            totals = {name: dict(total, counters=dict(total["counters"])) for name, total in self.totals.items()}
+        families = [
+            ("runs_total", "counter", "Completed runs of each stage", "runs"),
+            ("wall_seconds_total", "counter", "Wall time spent in each stage", "wall_seconds"),
+            ("cpu_seconds_total", "counter", "Process CPU time spent in each stage", "cpu_seconds"),
+            ("peak_rss_bytes", "gauge", "Highest resident memory seen during each stage", "peak_rss_bytes"),
+        ]
+        lines = []
+        for suffix, kind, help_text, key in families:
+            lines += [f"# HELP tsneakpeaks_stage_{suffix} {help_text}", f"# TYPE tsneakpeaks_stage_{suffix} {kind}"]
+            lines += [f'tsneakpeaks_stage_{suffix}{{stage="{name}"}} {total[key]}' for name, total in totals.items()]
+        counter_names = sorted({counter for total in totals.values() for counter in total["counters"]})
+        for counter in counter_names:
+            metric = "tsneakpeaks_" + re.sub(r"[^a-zA-Z0-9_]", "_", counter)
+            lines += [f"# HELP {metric} Latest {counter} counter of each stage", f"# TYPE {metric} gauge"]
+            lines += [
+                f'{metric}{{stage="{name}"}} {total["counters"][counter]}'
+                for name, total in totals.items() if counter in total["counters"]
+            ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Path) -> None:
+        """Write ``to_prometheus`` to a text file, e.g. for a node exporter's textfile collector"""
+        Path(path).write_text(self.to_prometheus())
+
+
+def instrumented(name: str) -> Callable:
+    """Run a method as stage ``name`` of its object's ``metrics``"""
+    def decorate(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
 def get_config():
     """Load configuration (placeholder for future use)"""
     return {
         'default_perplexity': 30,
         'default_n_iter': 1000,
         'default_random_state': 42,
+        'default_engine': 'auto',
+        'cache_dir': None,  # defaults to <data_dir>/.tsneakpeaks_cache
+        'cache_max_bytes': 1 << 30,
+        'checkpoint_every': 250,
+        'chunk_rows': 1 << 20,  # rows per block when streaming labels and features
+        'dedup': False,  # embed identical label rows once, weighted by their counts
+        'landmarks': None,  # fraction of points embedded in full, the rest placed among them
+        'init': 'random',  # where t-SNE starts: 'random' or 'pca' (the preview, scaled down)
+        'schedule': 'fixed',  # 'adaptive' stops exaggeration and the run once the KL flattens
+        'stat_workers': None,  # threads stat'ing images when the manifest is refreshed
+        'palette_file': None,  # defaults to the palette of examples/generate_test.py
+        'grid': (2, 2),
+        'max_plot_points': 100_000,  # larger embeddings are drawn from an octree
+        'compact_figures': True,  # typed arrays and index hover instead of per-point text
+        'app_memory_budget': 2 << 30,  # bytes of loaded datasets app.py keeps before evicting
         'visualization_width': 1000,
         'visualization_height': 800,
     }
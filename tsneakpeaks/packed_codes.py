@@ -0,0 +1,204 @@
+# tsneakpeaks/packed_codes.py
+"""
+Packed Codes: all quadrant colours of an image in one small integer
+On one-hot codes cosine distance is the share of differing quadrants, so it is counted, not multiplied
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from typing import Optional, Tuple
+from .data_processing import encode_sparse_one_hot, iter_row_chunks
+
+# Pairs compared per block; small enough for the keys to stay in cache
+BLOCK_ENTRIES = 1 << 18
+
+
+# Set bits of every byte, for numpy versions without np.bitwise_count
+_BYTE_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def count_bits(values: np.ndarray) -> np.ndarray:
+    """Set bits of every element of an unsigned integer array, as uint8"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    as_bytes = values.view(np.uint8).reshape(values.shape + (values.itemsize,))
+    return _BYTE_POPCOUNT[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+
+def bits_per_quadrant(num_colors: int) -> int:
+    """
+    Bits holding one colour index, 4 for a 16-colour palette
+
+    Rounded up to a power of two, so folding a field onto its lowest bit by
+    repeated halving never reaches into the next field.
+    """
+    needed = max(1, int(num_colors - 1).bit_length())
+    return 1 << (needed - 1).bit_length()
+
+
+def code_dtype(n_bits: int) -> np.dtype:
+    """Smallest unsigned integer type holding ``n_bits``"""
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if n_bits <= np.iinfo(dtype).bits:
+            return np.dtype(dtype)
+    raise ValueError(f"{n_bits} bits do not fit in one packed code; use the one-hot encoding")
+
+
+class PackedLabels:
+    """
+    Quadrant labels packed into one unsigned integer per image.
+
+    Quadrant ``q`` occupies bits ``[q * bits, (q + 1) * bits)`` of the code, so
+    four quadrants of a 16-colour palette fit in a uint16: 2 bytes per image
+    instead of about 40 for a float32 one-hot CSR row. ``shape`` is the shape of
+    that one-hot matrix, and indexing with rows gives packed labels of those
+    rows, so the White Lodge can use either interchangeably.
+    """
+
+    def __init__(self, codes: np.ndarray, num_quadrants: int, num_colors: int):
+        self.codes = codes
+        self.num_quadrants = num_quadrants
+        self.num_colors = num_colors
+        self.bits = bits_per_quadrant(num_colors)
+
+    @classmethod
+    def from_labels(cls,
+                    labels: np.ndarray,
+                    num_colors: int,
+                    chunk_rows: Optional[int] = None) -> "PackedLabels":
+        """
+        Pack (n_images, num_quadrants) colour indices, ``chunk_rows`` rows at a time.
+
+        Raises:
+        - ValueError: For non-integer labels, colours outside the palette or
+          codes wider than 64 bits.
+        """
+        if np.asarray(labels[:1]).dtype.kind not in "ui":
+            raise ValueError("Only integer colour labels can be packed")
+        num_quadrants = labels.shape[1]
+        bits = bits_per_quadrant(num_colors)
+        dtype = code_dtype(bits * num_quadrants)
+        shifts = (np.arange(num_quadrants) * bits).astype(dtype)
+        codes = np.empty(len(labels), dtype=dtype)
+        start = 0
+        for chunk in iter_row_chunks(labels, chunk_rows):
+            if chunk.size and (chunk.min() < 0 or chunk.max() >= num_colors):
+                raise ValueError(
+                    f"Colour indices must lie in [0, {num_colors - 1}], "
+                    f"found values in [{chunk.min()}, {chunk.max()}]."
+                )
+            codes[start:start + len(chunk)] = np.bitwise_or.reduce(chunk.astype(dtype) << shifts, axis=1)
+            start += len(chunk)
+        return cls(codes, num_quadrants, num_colors)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (len(self.codes), self.num_quadrants * self.num_colors)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, rows) -> "PackedLabels":
+        return PackedLabels(np.atleast_1d(self.codes[rows]), self.num_quadrants, self.num_colors)
+
+    def unpack(self) -> np.ndarray:
+        """Colour indices of shape (n_images, num_quadrants)"""
+        shifts = (np.arange(self.num_quadrants) * self.bits).astype(self.codes.dtype)
+        mask = self.codes.dtype.type((1 << self.bits) - 1)
+        return ((self.codes[:, None] >> shifts) & mask).astype(np.uint8 if self.num_colors <= 256 else np.int64)
+
+    def to_one_hot(self) -> csr_matrix:
+        """The one-hot matrix these codes stand for, as from ``encode_sparse_one_hot``"""
+        return encode_sparse_one_hot(self.unpack(), self.num_colors, self.num_quadrants)
+
+    def mismatches(self, queries: "PackedLabels") -> np.ndarray:
+        """
+        Number of differing quadrants between every query and every code.
+
+        XOR leaves a nonzero field wherever two colours differ; folding each
+        field onto its lowest bit and counting the set bits counts those fields.
+
+        Returns:
+        - np.ndarray: uint8 array of shape (len(queries), len(self)).
+        """
+        dtype = self.codes.dtype.type
+        low_bits = dtype(sum(1 << (q * self.bits) for q in range(self.num_quadrants)))
+        differ = queries.codes[:, None] ^ self.codes[None, :]
+        shift = 1
+        while shift < self.bits:
+            differ |= differ >> dtype(shift)
+            shift *= 2
+        differ &= low_bits
+        return count_bits(differ)
+
+    def distances(self, queries: "PackedLabels") -> np.ndarray:
+        """Cosine distances of the one-hot codes, mismatches / num_quadrants, as float32"""
+        return self.mismatches(queries).astype(np.float32) / np.float32(self.num_quadrants)
+
+
+def match_knn_query(reference: PackedLabels,
+                    queries: PackedLabels,
+                    n_neighbors: int,
+                    chunk_rows: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact nearest reference codes of every query by matching quadrants.
+
+    Distances equal the cosine distances of the one-hot encodings. Queries are
+    processed in blocks: mismatch counts and column indices are combined into
+    one integer key per pair, so a partial sort picks the closest codes and
+    breaks ties by the lower index, deterministically.
+
+    Parameters:
+    - reference (PackedLabels): Codes searched.
+    - queries (PackedLabels): Codes whose neighbours are wanted.
+    - n_neighbors (int): Neighbours per query.
+    - chunk_rows (int, optional): Upper bound on queries per block; blocks are
+      also kept below ``BLOCK_ENTRIES`` pairs.
+
+    Returns:
+    - Tuple[np.ndarray, np.ndarray]: ``(indices, distances)`` of shape
+      (n_queries, n_neighbors), ordered by distance then index.
+    """
+    n_reference = len(reference)
+    index_bits = max(int(n_reference - 1).bit_length(), 1)
+    key_dtype = np.uint32 if index_bits + 8 <= 32 else np.uint64
+    columns = np.arange(n_reference, dtype=key_dtype)
+    shift = key_dtype(index_bits)
+    index_mask = key_dtype((1 << index_bits) - 1)
+
+    indices = np.empty((len(queries), n_neighbors), dtype=np.int32 if n_reference < 2**31 else np.int64)
+    distances = np.empty((len(queries), n_neighbors), dtype=np.float32)
+    step = max(1, min(chunk_rows or len(queries), BLOCK_ENTRIES // max(n_reference, 1)))
+    for start in range(0, len(queries), step):
+        keys = reference.mismatches(queries[start:start + step]).astype(key_dtype)
+        keys <<= shift
+        keys |= columns
+        if n_neighbors < n_reference:
+            keys = np.partition(keys, n_neighbors - 1, axis=1)[:, :n_neighbors]
+        keys.sort(axis=1)
+        indices[start:start + step] = keys & index_mask
+        distances[start:start + step] = (keys >> shift).astype(np.float32) / np.float32(reference.num_quadrants)
+    return indices, distances
+
+
+def match_knn_graph(codes: PackedLabels,
+                    n_neighbors: int,
+                    chunk_rows: Optional[int] = None) -> csr_matrix:
+    """
+    Neighbour graph of packed codes, laid out like ``cosine_knn_graph``.
+
+    Every row holds ``n_neighbors + 1`` entries including the point itself (or
+    an identical code), so ``joint_probabilities`` takes it unchanged.
+    """
+    n_samples = len(codes)
+    width = n_neighbors + 1
+    indices, distances = match_knn_query(codes, codes, width, chunk_rows)
+    indptr = np.arange(0, n_samples * width + 1, width, dtype=indices.dtype)
+    return csr_matrix(
+        (distances.ravel(), indices.ravel(), indptr),
+        shape=(n_samples, n_samples),
+    )
@@ -0,0 +1,104 @@
+# tsneakpeaks/preview.py
+"""
+Preview: a first look at the collection before t-SNE has finished its walk
+Randomized PCA of the normalised rows, streamed a block at a time
+"""
+
+import numpy as np
+from scipy.sparse import issparse
+from sklearn.preprocessing import normalize
+from typing import Iterator, Optional, Tuple
+from .packed_codes import PackedLabels
+
+# Extra random directions beyond the components wanted, for a stable subspace
+PREVIEW_OVERSAMPLES = 10
+
+# Power iterations sharpen the subspace when the spectrum decays slowly
+PREVIEW_POWER_ITERATIONS = 4
+
+# Rows per block when no chunk size is given
+PREVIEW_CHUNK_ROWS = 1 << 18
+
+# Spread of the first coordinate when the preview seeds t-SNE, as for its random start
+INIT_SCALE = 1e-4
+
+
+def _blocks(features, chunk_rows: int) -> Iterator[Tuple[slice, object]]:
+    """Consecutive row blocks of ``features``, L2-normalised like the t-SNE input"""
+    for start in range(0, features.shape[0], chunk_rows):
+        rows = slice(start, min(start + chunk_rows, features.shape[0]))
+        block = features[rows]
+        if isinstance(block, PackedLabels):
+            block = block.to_one_hot()
+        elif not issparse(block):
+            block = np.asarray(block, dtype=np.float64)
+        yield rows, normalize(block.astype(np.float64), norm="l2")
+
+
+def randomized_pca(features,
+                   n_components: int = 3,
+                   n_oversamples: int = PREVIEW_OVERSAMPLES,
+                   n_power_iter: int = PREVIEW_POWER_ITERATIONS,
+                   random_state: int = 0,
+                   chunk_rows: Optional[int] = None) -> np.ndarray:
+    """
+    Coordinates of every row on its leading principal components.
+
+    A randomized subspace iteration on the covariance of the L2-normalised
+    rows: each pass multiplies a few random directions by X^T X one block at a
+    time, with the mean subtracted afterwards so sparse rows stay sparse. Only
+    matrices of n_features by ``n_components + n_oversamples`` are held, plus
+    the output, so millions of one-hot rows take a few passes of seconds each.
+    Signs are fixed so every component's largest loading is positive.
+
+    Parameters:
+    - features (csr_matrix, np.ndarray or PackedLabels): Rows to project.
+    - n_components (int): Output dimensions; missing ones are zero when there
+      are fewer features.
+    - n_oversamples (int): Extra random directions.
+    - n_power_iter (int): Power iterations.
+    - random_state (int): Seed of the random directions.
+    - chunk_rows (int, optional): Rows per block.
+
+    Returns:
+    - np.ndarray: float64 coordinates of shape (n_samples, n_components).
+    """
+    n_samples, n_features = features.shape
+    chunk_rows = chunk_rows or PREVIEW_CHUNK_ROWS
+    rank = min(n_components, n_features, n_samples)
+    width = min(n_features, rank + n_oversamples)
+
+    def covariance_times(directions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        product = np.zeros((n_features, directions.shape[1]))
+        total = np.zeros(n_features)
+        for _, block in _blocks(features, chunk_rows):
+            product += block.T @ (block @ directions)
+            total += np.asarray(block.sum(axis=0)).ravel()
+        mean = total / n_samples
+        return product / n_samples - np.outer(mean, mean @ directions), mean
+
+    rng = np.random.default_rng(random_state)
+    basis, _ = np.linalg.qr(rng.standard_normal((n_features, width)))
+    for _ in range(n_power_iter):
+        basis, _ = np.linalg.qr(covariance_times(basis)[0])
+    # Rayleigh-Ritz: the best components within the subspace found
+    product, mean = covariance_times(basis)
+    eigenvalues, eigenvectors = np.linalg.eigh(basis.T @ product)
+    components = basis @ eigenvectors[:, np.argsort(eigenvalues)[::-1][:rank]]
+    signs = np.sign(components[np.argmax(np.abs(components), axis=0), np.arange(rank)])
+    components *= np.where(signs == 0, 1.0, signs)
+
+    coords = np.zeros((n_samples, n_components))
+    offset = mean @ components
+    for rows, block in _blocks(features, chunk_rows):
+        coords[rows, :rank] = block @ components - offset
+    return coords
+
+
+def pca_init(coords: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Preview coordinates rescaled into a t-SNE starting point, the first axis
+    with standard deviation ``INIT_SCALE``; None when every row coincides.
+    """
+    scale = coords[:, 0].std()
+    return coords * (INIT_SCALE / scale) if scale > 0 else None
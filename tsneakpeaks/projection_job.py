@@ -0,0 +1,177 @@
+# tsneakpeaks/projection_job.py
+"""
+Projection Job: loading and projecting in the background while the app serves
+Intermediate embeddings are kept as snapshots so the structure can be watched forming
+"""
+
+import threading
+import time
+import numpy as np
+from typing import Callable, Optional
+import logging
+from .checkpoints import IterationInfo
+from .laura import TSneakPeaks
+
+
+class ProjectionJob:
+    """
+    Runs ``load_data`` and ``reduce_dimensions`` of a TSneakPeaks instance on a
+    daemon thread.
+
+    Every ``snapshot_every`` iterations the current coordinates are copied into
+    a snapshot and ``version`` is bumped, so pollers only rebuild figures when
+    something new arrived. With ``preview`` the linear preview of the data is
+    the first snapshot, so viewers see the collection seconds after loading.
+    ``status`` reports the phase and progress.
+    """
+
+    def __init__(self,
+                 peaks: TSneakPeaks,
+                 snapshot_every: int = 50,
+                 preview: bool = True,
+                 on_loaded: Optional[Callable[[TSneakPeaks], None]] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.peaks = peaks
+        self.snapshot_every = snapshot_every
+        self.preview = preview
+        # Runs on the worker thread once the data is loaded, before the projection
+        self.on_loaded = on_loaded
+        self.logger = logger or peaks.logger
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.snapshot: Optional[np.ndarray] = None
+        self.info: Optional[IterationInfo] = None
+        self.version = 0
+        self.started: Optional[float] = None
+        # The overview figure of the latest snapshot, shared by every viewer
+        self._figure = None
+        self._figure_version = -1
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # Set once the optimiser has acted on a stop; from then on the job cannot resume
+        self._halted = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    @property
+    def running(self) -> bool:
+        """Whether the worker thread is still alive"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> "ProjectionJob":
+        """Start the worker thread; returns immediately"""
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="tsneakpeaks-projection", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Ask the optimiser to stop at its next snapshot and wait for the thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def resume(self) -> bool:
+        """
+        Withdraw a ``stop`` the optimiser has not acted on yet.
+
+        Returns True if the job carries on, or already finished, as though it was
+        never stopped; False once it has stopped early or failed.
+        """
+        with self._lock:
+            if self._halted or self.state == "failed":
+                return False
+            self._stop.clear()
+            return True
+
+    def _run(self) -> None:
+        try:
+            self._set_state("loading")
+            self.peaks.load_data()
+            if self.on_loaded is not None:
+                self.on_loaded(self.peaks)
+            if self.preview:
+                self._set_state("previewing")
+                preview = self.peaks.preview()
+                with self._lock:
+                    self.snapshot = preview
+                    self.version += 1
+            self._set_state("projecting")
+            self.peaks.reduce_dimensions(callbacks=[self._on_iteration], callback_every=self.snapshot_every)
+            with self._lock:
+                self.snapshot = self.peaks.coords_3d
+                self.version += 1
+            self._set_state("stopped" if self._halted else "ready")
+        except Exception as e:
+            self.logger.exception("Background projection failed")
+            with self._lock:
+                self.error = str(e)
+            self._set_state("failed")
+
+    def _set_state(self, state: str) -> None:
+        with self._lock:
+            self.state = state
+        self.logger.info(f"Projection job: {state}")
+
+    def _on_iteration(self, info: IterationInfo) -> bool:
+        # info.coords is the optimiser's live array
+        snapshot = info.coords.copy()
+        with self._lock:
+            self.snapshot = snapshot
+            self.info = info._replace(coords=snapshot)
+            self.version += 1
+            self._halted = self._stop.is_set()
+            return self._halted
+
+    def status(self) -> dict:
+        """JSON-ready phase and progress of the job"""
+        with self._lock:
+            info = self.info
+            return {
+                "state": self.state,
+                "ready": self.state == "ready",
+                "error": self.error,
+                "version": self.version,
+                "n_images": len(self.peaks.image_paths),
+                "iteration": None if info is None else info.iteration,
+                "n_iter": self.peaks.white_lodge.n_iter,
+                "kl_divergence": None if info is None else info.kl_divergence,
+                "elapsed": None if self.started is None else time.perf_counter() - self.started,
+            }
+
+    def figure(self, title: str = "TSneakPeaks: A Vision", region=None):
+        """
+        Figure of the latest snapshot, or None before the first one.
+
+        The overview is built once per snapshot and reused; region figures are
+        built on every call.
+        """
+        with self._lock:
+            snapshot, version = self.snapshot, self.version
+            if region is None and self._figure_version == version:
+                return self._figure
+        if snapshot is None:
+            return None
+        fig = self.peaks.visualizer.create_figure(
+            snapshot, self.peaks.labels, self.peaks.image_paths, title, region=region
+        )
+        if region is None:
+            with self._lock:
+                self._figure, self._figure_version = fig, version
+        return fig
+
+    def figure_bytes(self) -> int:
+        """Bytes of array data in the cached overview figure"""
+        with self._lock:
+            fig = self._figure
+        if fig is None:
+            return 0
+        return sum(
+            np.asarray(value).nbytes
+            for trace in fig.data
+            for value in (trace.x, trace.y, trace.z, trace.customdata, trace.marker.color)
+            if value is not None
+        )
@@ -17,46 +17,143 @@ The Red Room: Visualization components
 
 import plotly.graph_objects as go
 import numpy as np
-from typing import List, Optional
+from typing import List, Optional, Sequence, Tuple
 import logging
+import os
 from pathlib import Path
+from .octree import Octree
+from .owl_cave import Metrics, instrumented
 
 class Visualizer:
-    def __init__(self, logger: Optional[logging.Logger] = None):
+    def __init__(self,
+                 logger: Optional[logging.Logger] = None,
+                 *,
+                 max_points: Optional[int] = 100_000,
+                 compact: bool = True,
+                 metrics: Optional[Metrics] = None):
         self.logger = logger or logging.getLogger(__name__)
+        self.metrics = metrics or Metrics(logger=self.logger)
+        # Compact figures ship float32/uint8 arrays and only the file name as hover text
+        self.compact = compact
+        self.image_paths: List[str] = []
+        self._names = None
+        # Larger embeddings are drawn from an octree: a thinned overview, or every point of a region
+        self.max_points = max_points
+        self.octree = None
+        self._octree_coords = None
+
+    def image_name(self, index: int) -> str:
+        """File name of the image behind ``customdata`` index ``index`` of the last figure"""
+        return Path(self.image_paths[index]).name
+
+    def image_names(self, image_paths: List[str]) -> np.ndarray:
+        """File names of ``image_paths`` as a string array, built once per path list"""
+        if self._names is None or self._names[0] is not image_paths:
+            names = np.array([os.path.basename(path) for path in image_paths], dtype=str)
+            self._names = (image_paths, names)
+        return self._names[1]
+
+    def get_octree(self, coords_3d: np.ndarray) -> Octree:
+        """Octree over ``coords_3d``, rebuilt only when the coordinates change"""
+        if self._octree_coords is not coords_3d:
+            self.octree = Octree(coords_3d, logger=self.logger)
+            self._octree_coords = coords_3d
+        return self.octree
+
+    def visible_points(self,
+                       coords_3d: np.ndarray,
+                       region: Optional[Tuple[Sequence[float], Sequence[float]]] = None) -> np.ndarray:
+        """
+        Indices of the points to draw.
 
+        Parameters:
+        - coords_3d (np.ndarray): Full embedding.
+        - region (tuple, optional): (low, high) corners of a box to show at full
+          resolution; the whole embedding if omitted.
+
+        Returns:
+        - np.ndarray: Sorted point indices; everything when it fits in ``max_points``.
+        """
+        if region is None and (self.max_points is None or len(coords_3d) <= self.max_points):
+            return np.arange(len(coords_3d))
+        octree = self.get_octree(coords_3d)
+        if region is None:
+            return octree.overview(self.max_points)
+        return octree.query(region[0], region[1], budget=self.max_points)
+
+    @instrumented("create_figure")
     def create_figure(self,
                      coords_3d: np.ndarray,
                      labels: np.ndarray,
                      image_paths: List[str],
-                     title: str = "TSneakPeaks: A Vision") -> go.Figure:
+                     title: str = "TSneakPeaks: A Vision",
+                     region: Optional[Tuple[Sequence[float], Sequence[float]]] = None) -> go.Figure:
+        """
+        Clickable 3D scatter of the embedding.
+
+        Past ``max_points`` points only a level-of-detail subset is drawn, see
+        ``visible_points``. Each marker's ``customdata`` is its index in
+        ``coords_3d``, so clicks resolve to the right image either way; use
+        ``image_name`` to look the index up.
+
+        Compact figures serialise as base64 typed arrays: float32 coordinates,
+        uint8 colour codes and int32 indices, and each point's hover text is
+        just its file name. Otherwise every point carries its full hover text.
+        """
+        self.image_paths = image_paths
+        shown = self.visible_points(coords_3d, region)
+        if len(shown) < len(coords_3d):
+            self.logger.info(f"Drawing {len(shown)} of {len(coords_3d)} points")
+        self.metrics.count(rows=len(coords_3d), points=len(shown))
+        colour = np.sum(labels, axis=1)
+        # The full range, so colours do not shift between overview and regions
+        low, high = float(colour.min()), float(colour.max())
         
-        hover_texts = [
-            f"🌲 Image: {Path(path).name}\n"
-            for i, path in enumerate(image_paths)
-        ]
+        marker = dict(
+            size=5,
+            opacity=0.8,
+            colorscale=[
+                [0, 'rgb(20,20,20)'],
+                [0.5, 'rgb(140,0,0)'],
+                [1, 'rgb(255,255,255)']
+            ],
+            colorbar=dict(title="Dimensional Presence"),
+            showscale=True
+        )
+        if self.compact:
+            codes = (colour[shown] - low) * (255.0 / ((high - low) or 1.0))
+            marker.update(color=np.rint(codes).astype(np.uint8), cmin=0, cmax=255)
+            marker['colorbar'].update(tickvals=[0, 255], ticktext=[f"{low:g}", f"{high:g}"])
+            trace = go.Scatter3d(
+                x=coords_3d[shown, 0].astype(np.float32),
+                y=coords_3d[shown, 1].astype(np.float32),
+                z=coords_3d[shown, 2].astype(np.float32),
+                customdata=shown.astype(np.int32),
+                mode='markers',
+                marker=marker,
+                # Templates cannot index a lookup table, so the names travel with the points
+                text=self.image_names(image_paths)[shown],
+                hovertemplate='🌲 Image: %{text}<extra></extra>'
+            )
+        else:
+            hover_texts = [
+                f"🌲 Image: {Path(image_paths[i]).name}\n"
+                for i in shown
+            ]
+            marker.update(color=colour[shown], cmin=low, cmax=high)
+            trace = go.Scatter3d(
+                x=coords_3d[shown, 0],
+                y=coords_3d[shown, 1],
+                z=coords_3d[shown, 2],
+                customdata=shown,
+                mode='markers',
+                marker=marker,
+                hovertemplate='%{text}<extra></extra>',
+                text=hover_texts,
+                hoverinfo='text'
+            )
         
-        fig = go.Figure(data=[go.Scatter3d(
-            x=coords_3d[:, 0],
-            y=coords_3d[:, 1],
-            z=coords_3d[:, 2],
-            mode='markers',
-            marker=dict(
-                size=5,
-                opacity=0.8,
-                color=np.sum(labels, axis=1),
-                colorscale=[
-                    [0, 'rgb(20,20,20)'],
-                    [0.5, 'rgb(140,0,0)'],
-                    [1, 'rgb(255,255,255)']
-                ],
-                colorbar=dict(title="Dimensional Presence"),
-                showscale=True
-            ),
-            hovertemplate='%{text}<extra></extra>',
-            text=hover_texts,
-            hoverinfo='text'
-        )])
+        fig = go.Figure(data=[trace])
         
         fig.update_layout(
             title=dict(text=title, font=dict(size=24)),
@@ -72,5 +169,12 @@ class Visualizer:
             plot_bgcolor='rgb(10,10,10)',
             font=dict(color='white')
         )
+        if region is not None:
+            fig.update_scenes(
+                xaxis_range=[region[0][0], region[1][0]],
+                yaxis_range=[region[0][1], region[1][1]],
+                zaxis_range=[region[0][2], region[1][2]],
+                aspectmode='cube'
+            )
         
         return fig
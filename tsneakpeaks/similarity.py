@@ -0,0 +1,156 @@
+# tsneakpeaks/similarity.py
+"""
+Similarity: images that share quadrant colours, found through an inverted index
+Distance in the embedding is a picture of similarity, this is the measurement
+"""
+
+import time
+import numpy as np
+from scipy.sparse import csr_matrix
+from typing import Optional, Tuple
+import logging
+from .data_processing import iter_row_chunks, unique_rows
+
+METRICS = ("count", "cosine")
+
+
+class SimilarityIndex:
+    """
+    Inverted index from (quadrant, colour) terms to the images using them.
+
+    Images with identical labels are grouped into one distinct row first, so
+    posting lists point at distinct rows and a query scores at most
+    ``num_colors ** num_quadrants`` rows however many images there are. Each
+    distinct row then lists its images in id order. Rows are grouped by their
+    base-``num_colors`` code while it fits in 64 bits, by hashing them otherwise.
+
+    Scores are either the number of matching quadrants (``count``) or the
+    cosine of idf-weighted term vectors (``cosine``), where colours that are
+    rare in a quadrant weigh more than common ones.
+    """
+
+    def __init__(self,
+                 labels: np.ndarray,
+                 num_colors: int,
+                 chunk_rows: Optional[int] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        if np.asarray(labels[:1]).dtype.kind not in "ui":
+            raise ValueError("The similarity index needs integer colour labels")
+        started = time.perf_counter()
+        self.n_images, self.num_quadrants = labels.shape
+        self.num_colors = num_colors
+
+        if num_colors ** self.num_quadrants <= np.iinfo(np.int64).max:
+            # One integer per image, so identical rows can be grouped with one sort
+            radix = num_colors ** np.arange(self.num_quadrants, dtype=np.int64)
+            codes = np.empty(self.n_images, dtype=np.int64)
+            start = 0
+            for chunk in iter_row_chunks(labels, chunk_rows):
+                codes[start:start + len(chunk)] = np.asarray(chunk, dtype=np.int64) @ radix
+                start += len(chunk)
+            unique_codes, self.image_row, counts = np.unique(codes, return_inverse=True, return_counts=True)
+            self.rows = (unique_codes[:, None] // radix) % num_colors
+        else:
+            # Finer grids overflow a 64-bit code, so rows are grouped by hashing them instead
+            index, self.image_row, counts = unique_rows(labels, chunk_rows)
+            self.rows = np.asarray(labels[index], dtype=np.int64)
+        self.image_row = self.image_row.astype(np.int32)
+        self.member_ptr = np.concatenate([[0], np.cumsum(counts)])
+        self.members = np.argsort(self.image_row, kind="stable").astype(np.int64)
+
+        # Term t = quadrant * num_colors + colour, as in the one-hot encoding
+        n_rows = len(self.rows)
+        terms = (np.arange(self.num_quadrants) * num_colors + self.rows).ravel()
+        postings = csr_matrix(
+            (np.ones(len(terms), dtype=np.float32), terms, np.arange(0, len(terms) + 1, self.num_quadrants)),
+            shape=(n_rows, self.num_quadrants * num_colors),
+        ).tocsc()
+        self.term_ptr = postings.indptr
+        self.term_rows = postings.indices
+
+        document_frequency = np.bincount(terms, weights=np.repeat(counts, self.num_quadrants),
+                                         minlength=self.num_quadrants * num_colors)
+        self.idf = np.log((1 + self.n_images) / (1 + document_frequency)) + 1.0
+        self.row_norms = np.sqrt((self.idf[terms] ** 2).reshape(n_rows, self.num_quadrants).sum(axis=1))
+        self.logger.info(
+            f"Indexed {self.n_images} images as {n_rows} distinct label rows "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the index arrays"""
+        return sum(a.nbytes for a in (
+            self.image_row, self.rows, self.member_ptr, self.members,
+            self.term_ptr, self.term_rows, self.idf, self.row_norms,
+        ))
+
+    def _terms(self, row: np.ndarray) -> np.ndarray:
+        return np.arange(self.num_quadrants) * self.num_colors + np.asarray(row, dtype=np.int64)
+
+    def score_rows(self, row: np.ndarray, metric: str = "count") -> np.ndarray:
+        """Score of every distinct row against a label row of shape (num_quadrants,)"""
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric}, expected one of {METRICS}")
+        terms = self._terms(row)
+        weights = np.ones(len(terms)) if metric == "count" else self.idf[terms] ** 2
+        scores = np.zeros(len(self.rows))
+        for term, weight in zip(terms, weights):
+            scores[self.term_rows[self.term_ptr[term]:self.term_ptr[term + 1]]] += weight
+        if metric == "cosine":
+            scores /= self.row_norms * np.sqrt(weights.sum())
+        return scores
+
+    def query(self,
+              row: np.ndarray,
+              k: int = 10,
+              metric: str = "count",
+              exclude: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k images for a label row.
+
+        Parameters:
+        - row (np.ndarray): Colour of every quadrant.
+        - k (int): Number of images to return.
+        - metric (str): 'count' (matching quadrants) or 'cosine' (idf-weighted).
+        - exclude (int, optional): Image id left out of the results, e.g. the query image.
+
+        Returns:
+        - tuple: Image ids and their scores, best first; ties go to lower ids.
+          Images sharing no quadrant colour are never returned.
+        """
+        scores = self.score_rows(row, metric)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k + 1:
+            # Every row holds at least one image, so the best k + 1 rows (and
+            # rows tied with the last of them) always hold the answer
+            cut = -np.partition(-scores[candidates], k)[k]
+            candidates = candidates[scores[candidates] >= cut]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        levels = np.split(ranked, np.flatnonzero(np.diff(scores[ranked]) != 0) + 1)
+
+        ids, found = [], 0
+        for level in levels:
+            if found >= k or len(level) == 0:
+                break
+            # Members are stored in id order, so no row of the level can
+            # contribute more than its first few images
+            needed = k - found
+            starts = self.member_ptr[level]
+            lengths = np.minimum(self.member_ptr[level + 1] - starts, needed + 1)
+            offsets = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+            members = np.sort(self.members[offsets])
+            if exclude is not None:
+                members = members[members != exclude]
+            ids.append(members[:needed])
+            found += len(ids[-1])
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        return ids, scores[self.image_row[ids]]
+
+    def similar(self,
+                index: int,
+                k: int = 10,
+                metric: str = "count") -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k images most similar to image ``index``, excluding itself"""
+        return self.query(self.rows[self.image_row[index]], k, metric, exclude=index)
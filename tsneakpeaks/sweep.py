@@ -0,0 +1,193 @@
+# tsneakpeaks/sweep.py
+"""
+Sweep: many embeddings of one collection for the price of one neighbour search
+Affinities are shared with worker processes instead of being recomputed per run
+"""
+
+import itertools
+import json
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+from scipy.sparse import csr_matrix
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+import logging
+from .engines import get_engine, select_engine
+from .packed_codes import PackedLabels
+from .white_lodge import WhiteLodge
+
+# Summary written to the results directory next to one coordinate file per configuration
+SWEEP_RESULTS_FILE = "sweep.json"
+
+
+class SweepConfig(NamedTuple):
+    """One point of a parameter sweep"""
+    perplexity: float
+    random_state: int
+    learning_rate: Optional[float] = None
+    early_exaggeration: float = 12.0
+
+    @property
+    def name(self) -> str:
+        """File-name friendly identifier"""
+        learning_rate = "auto" if self.learning_rate is None else f"{self.learning_rate:g}"
+        return (
+            f"perplexity{self.perplexity:g}_seed{self.random_state}"
+            f"_lr{learning_rate}_exaggeration{self.early_exaggeration:g}"
+        )
+
+
+def parameter_grid(perplexities: Sequence[float],
+                   seeds: Sequence[int] = (42,),
+                   learning_rates: Sequence[Optional[float]] = (None,),
+                   exaggerations: Sequence[float] = (12.0,)) -> List[SweepConfig]:
+    """Every combination of the given values, grouped by perplexity"""
+    return [
+        SweepConfig(perplexity, seed, learning_rate, exaggeration)
+        for perplexity, seed, learning_rate, exaggeration
+        in itertools.product(perplexities, seeds, learning_rates, exaggerations)
+    ]
+
+
+def _share(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, dict]:
+    """Copy an array into a new shared memory block, returning the block and how to attach to it"""
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, {"name": block.name, "shape": array.shape, "dtype": array.dtype.str}
+
+
+def _attach(descriptor: dict) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """Map a block created by ``_share`` without taking ownership of it"""
+    try:
+        block = shared_memory.SharedMemory(name=descriptor["name"], track=False)
+    except TypeError:
+        # Before Python 3.13 attaching also registers the block for cleanup, which
+        # would unlink it when the worker exits; the creating process owns it
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            block = shared_memory.SharedMemory(name=descriptor["name"])
+        finally:
+            resource_tracker.register = register
+    array = np.ndarray(descriptor["shape"], dtype=np.dtype(descriptor["dtype"]), buffer=block.buf)
+    return block, array
+
+
+def _embed_config(task: dict) -> dict:
+    """Worker: embed one configuration from shared affinities and save its coordinates"""
+    config = SweepConfig(**task["config"])
+    blocks, arrays = [], {}
+    try:
+        for key, descriptor in task["affinities"].items():
+            block, arrays[key] = _attach(descriptor)
+            blocks.append(block)
+        P = csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=task["shape"],
+            copy=False,
+        )
+        engine = get_engine(
+            task["engine"],
+            learning_rate=config.learning_rate,
+            early_exaggeration=config.early_exaggeration,
+        )
+        started = time.perf_counter()
+        result = engine.embed(P, n_components=3, n_iter=task["n_iter"], random_state=config.random_state)
+        seconds = time.perf_counter() - started
+        del P
+    finally:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+
+    coords_file = f"{config.name}.npy"
+    np.save(Path(task["results_dir"]) / coords_file, result.coords)
+    return {
+        **config._asdict(),
+        "engine": task["engine"],
+        "kl_divergence": result.kl_divergence,
+        "n_iter": result.n_iter,
+        "seconds": seconds,
+        "coords": coords_file,
+    }
+
+
+def run_sweep(high_dim_data: Union[np.ndarray, csr_matrix, PackedLabels],
+              configs: Sequence[SweepConfig],
+              results_dir: Path,
+              engine: str = "auto",
+              n_iter: int = 1000,
+              neighbours: str = "auto",
+              index_path: Optional[Path] = None,
+              n_jobs: Optional[int] = None,
+              logger: Optional[logging.Logger] = None) -> List[dict]:
+    """
+    Embed the data once per configuration, sharing the expensive work.
+
+    One neighbour graph is built for the largest perplexity and truncated for the
+    others, P is computed once per perplexity and placed in shared memory, and
+    the seed, learning-rate and exaggeration variants run in a process pool.
+
+    Parameters:
+    - high_dim_data (np.ndarray, csr_matrix or PackedLabels): Features of shape (n_samples, n_features).
+    - configs (list of SweepConfig): Configurations to run, e.g. from ``parameter_grid``.
+    - results_dir (Path): Receives one ``<config name>.npy`` per configuration and ``sweep.json``.
+    - engine (str): Engine for every run, 'auto' picks one by dataset size.
+    - n_iter (int): Iterations per run.
+    - neighbours (str): 'auto', 'exact' or 'approximate' neighbour search.
+    - index_path (Path, optional): Where the approximate neighbour index is persisted.
+    - n_jobs (int, optional): Worker processes, all cores by default.
+
+    Returns:
+    - list of dict: One record per configuration with its parameters, KL divergence,
+      iterations, run time and coordinate file, sorted by KL divergence.
+    """
+    logger = logger or logging.getLogger(__name__)
+    results_dir = Path(results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    n_samples = high_dim_data.shape[0]
+    engine = select_engine(n_samples) if engine == "auto" else engine
+
+    by_perplexity: Dict[float, List[SweepConfig]] = {}
+    for config in configs:
+        by_perplexity.setdefault(config.perplexity, []).append(config)
+    lodges = {
+        perplexity: WhiteLodge(perplexity=perplexity, engine=engine, neighbours=neighbours, logger=logger)
+        for perplexity in by_perplexity
+    }
+    n_neighbors = max(lodge.n_neighbors(n_samples) for lodge in lodges.values())
+    graph = next(iter(lodges.values())).neighbour_graph(high_dim_data, n_neighbors, index_path)
+
+    logger.info(f"Sweeping {len(configs)} configurations over {len(by_perplexity)} perplexities")
+    records = []
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        for perplexity, group in by_perplexity.items():
+            P = lodges[perplexity].compute_affinities(high_dim_data, graph=graph)
+            blocks, descriptors = [], {}
+            try:
+                for key in ("data", "indices", "indptr"):
+                    block, descriptors[key] = _share(getattr(P, key))
+                    blocks.append(block)
+                tasks = [{
+                    "config": config._asdict(),
+                    "affinities": descriptors,
+                    "shape": P.shape,
+                    "engine": engine,
+                    "n_iter": n_iter,
+                    "results_dir": str(results_dir),
+                } for config in group]
+                for record in pool.map(_embed_config, tasks):
+                    logger.info(f"{record['coords']}: KL divergence {record['kl_divergence']:.4f}")
+                    records.append(record)
+            finally:
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+
+    records.sort(key=lambda record: record["kl_divergence"])
+    (results_dir / SWEEP_RESULTS_FILE).write_text(json.dumps(records, indent=2))
+    logger.info(f"Sweep results written to {results_dir}")
+    return records
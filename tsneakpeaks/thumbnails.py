@@ -0,0 +1,208 @@
+# tsneakpeaks/thumbnails.py
+"""
+Thumbnails: small copies of every image, and sprite atlases packing them together
+The app serves these instead of full-resolution files, from memory where it can
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import logging
+from PIL import Image
+
+# Directory under the data directory that receives thumbnails and atlases
+THUMBNAIL_DIR = "thumbnails"
+
+# Where atlas tiles are listed, next to the atlas images
+ATLAS_INDEX_FILE = "atlas.json"
+
+# Thumbnails are rewritten in place when their image changes, so browsers keep
+# them but revalidate every use; an unchanged ETag makes that an empty 304
+CACHE_CONTROL = "public, no-cache"
+
+
+def make_thumbnail(source: Union[str, Path], target: Union[str, Path], size: int = 128) -> bool:
+    """
+    Write a thumbnail of at most ``size`` pixels per side, unless an up-to-date one exists.
+
+    Returns:
+    - bool: True when the thumbnail was (re)written.
+    """
+    source, target = Path(source), Path(target)
+    if target.exists() and target.stat().st_mtime_ns >= source.stat().st_mtime_ns:
+        return False
+    with Image.open(source) as img:
+        # JPEGs decode straight at a fraction of their size
+        img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+        img.thumbnail((size, size))
+        staging = target.with_name(f".{target.name}")
+        img.save(staging, format="PNG", optimize=True)
+    os.replace(staging, target)
+    return True
+
+
+def generate_thumbnails(image_paths: Sequence[Union[str, Path]],
+                        thumbnail_dir: Union[str, Path],
+                        size: int = 128,
+                        n_workers: Optional[int] = None,
+                        logger: Optional[logging.Logger] = None) -> List[Path]:
+    """
+    Thumbnail every image in a thread pool, keeping the file names.
+
+    Parameters:
+    - image_paths (list): Source images.
+    - thumbnail_dir (Path): Receives one PNG per image.
+    - size (int): Longest side of a thumbnail.
+    - n_workers (int, optional): Pool size, Python's thread pool default if omitted.
+
+    Returns:
+    - list of Path: Thumbnail paths, in the order of ``image_paths``.
+    """
+    logger = logger or logging.getLogger(__name__)
+    thumbnail_dir = Path(thumbnail_dir)
+    thumbnail_dir.mkdir(parents=True, exist_ok=True)
+    targets = [thumbnail_dir / f"{Path(path).stem}.png" for path in image_paths]
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        written = sum(pool.map(make_thumbnail, image_paths, targets, [size] * len(targets)))
+    logger.info(f"Thumbnails: {written} written, {len(targets) - written} up to date in {thumbnail_dir}")
+    return targets
+
+
+def build_atlases(thumbnail_paths: Sequence[Union[str, Path]],
+                  thumbnail_dir: Union[str, Path],
+                  tile_size: int = 128,
+                  tiles_per_side: int = 16,
+                  n_workers: Optional[int] = None) -> Dict[str, dict]:
+    """
+    Pack thumbnails into square sprite atlases, built in parallel.
+
+    Each atlas holds ``tiles_per_side ** 2`` tiles in row-major order, every
+    thumbnail centred in its ``tile_size`` cell, so a client can draw any image
+    from one request per atlas instead of one per image.
+
+    Returns:
+    - dict: ``atlas.json`` content; thumbnail name -> {"atlas", "x", "y", "width", "height"}.
+    """
+    thumbnail_dir = Path(thumbnail_dir)
+    per_atlas = tiles_per_side * tiles_per_side
+
+    def pack(start: int) -> Dict[str, dict]:
+        name = f"atlas_{start // per_atlas:04d}.png"
+        atlas = Image.new("RGB", (tile_size * tiles_per_side, tile_size * tiles_per_side))
+        tiles = {}
+        for slot, path in enumerate(thumbnail_paths[start:start + per_atlas]):
+            with Image.open(path) as thumb:
+                x = (slot % tiles_per_side) * tile_size + (tile_size - thumb.width) // 2
+                y = (slot // tiles_per_side) * tile_size + (tile_size - thumb.height) // 2
+                atlas.paste(thumb.convert("RGB"), (x, y))
+                tiles[Path(path).name] = {
+                    "atlas": name, "x": x, "y": y, "width": thumb.width, "height": thumb.height,
+                }
+        staging = thumbnail_dir / f".{name}"
+        atlas.save(staging, format="PNG", optimize=True)
+        os.replace(staging, thumbnail_dir / name)
+        return tiles
+
+    index = {}
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for tiles in pool.map(pack, range(0, len(thumbnail_paths), per_atlas)):
+            index.update(tiles)
+    (thumbnail_dir / ATLAS_INDEX_FILE).write_text(json.dumps(index))
+    return index
+
+
+class ThumbnailStore:
+    """
+    Thumbnail and atlas bytes served from memory.
+
+    Files are read from ``thumbnail_dir`` on first request and kept in an LRU of
+    at most ``max_bytes``; an entry is read again once its file's mtime or size
+    changes. Every entry carries a strong ETag derived from its content, so
+    unchanged files can be answered with 304 Not Modified.
+    """
+
+    def __init__(self,
+                 thumbnail_dir: Union[str, Path],
+                 max_bytes: int = 64 << 20,
+                 logger: Optional[logging.Logger] = None):
+        self.thumbnail_dir = Path(thumbnail_dir)
+        self.max_bytes = max_bytes
+        self.logger = logger or logging.getLogger(__name__)
+        # name -> (content, etag, (mtime_ns, size) of the file it was read from)
+        self._entries: "OrderedDict[str, Tuple[bytes, str, Tuple[int, int]]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes currently held in memory"""
+        return self._size
+
+    def get(self, name: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Content and ETag of a file in the thumbnail directory.
+
+        Returns:
+        - tuple or None: (bytes, etag), or None for names outside the directory
+          and missing files.
+        """
+        if Path(name).name != name or name.startswith("."):
+            return None
+        path = self.thumbnail_dir / name
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[2] == version:
+                self._entries.move_to_end(name)
+                return entry[:2]
+
+        try:
+            content = path.read_bytes()
+        except OSError:
+            return None
+        entry = (content, hashlib.blake2b(content, digest_size=12).hexdigest(), version)
+
+        with self._lock:
+            stale = self._entries.pop(name, None)
+            if stale is not None:
+                self._size -= len(stale[0])
+            self._entries[name] = entry
+            self._size += len(content)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return entry[:2]
+
+
+def thumbnail_response(store: Optional[ThumbnailStore], name: str):
+    """
+    Flask response for one file of ``store``.
+
+    Responses carry an ETag and ask browsers to revalidate every use; requests
+    whose ``If-None-Match`` matches get an empty 304. Unknown stores and names give 404.
+    """
+    from flask import Response, abort, request
+
+    entry = None if store is None else store.get(name)
+    if entry is None:
+        abort(404)
+    content, etag = entry
+    headers = {"ETag": f'"{etag}"', "Cache-Control": CACHE_CONTROL}
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+    return Response(content, mimetype="image/png", headers=headers)
+
+
+def register_thumbnail_route(server, store: ThumbnailStore, route: str = "/thumbnails") -> None:
+    """Serve ``store`` at ``<route>/<name>`` on a Flask server, e.g. ``dash_app.server``"""
+    server.add_url_rule(f"{route}/<name>", "thumbnail", lambda name: thumbnail_response(store, name))
@@ -7,13 +7,34 @@ import numpy as np
 from typing import Optional, Tuple
 import logging
 from pathlib import Path
+from .data_processing import iter_row_chunks
+from .feature_extraction import label_dtype
+from .owl_cave import Metrics, instrumented
+
+# Labels are reduced and scaled in blocks of about this many bytes, so each
+# block is still in cache for its second operation and memory is read once
+SCAN_BLOCK_BYTES = 1 << 18
 
 class WaitingRoom:
     """Handles data preprocessing and validation"""
     
-    def __init__(self, logger: Optional[logging.Logger] = None):
+    def __init__(self,
+                 logger: Optional[logging.Logger] = None,
+                 *,
+                 chunk_rows: Optional[int] = None,
+                 num_colors: Optional[int] = None,
+                 metrics: Optional[Metrics] = None):
         self.logger = logger or logging.getLogger(__name__)
+        self.metrics = metrics or Metrics(logger=self.logger)
+        # Labels are scanned in blocks of this many rows, all at once if None
+        self.chunk_rows = chunk_rows
+        # Integer labels are colour indices and must lie below this palette size, if given
+        self.num_colors = num_colors
+        self.value_range: Optional[Tuple[float, float]] = None
+        # The labels last scanned and their range, so preprocessing need not read them again
+        self._scanned: Optional[Tuple[np.ndarray, Tuple[float, float]]] = None
         
+    @instrumented("validate_data")
     def validate_data(self, 
                      image_paths: list,
                      labels: Optional[np.ndarray] = None) -> bool:
@@ -27,15 +48,112 @@ class WaitingRoom:
                     f"Number of images ({len(image_paths)}) does not match "
                     f"number of labels ({len(labels)})"
                 )
+            # NaN and infinity carry through min and max, so the range scan finds them too
+            low, high = self.label_range(labels)
+            if not (np.isfinite(low) and np.isfinite(high)):
+                raise ValueError("Labels contain NaN or infinite values")
+            self._check_categorical(labels, low, high)
         
+        self.metrics.count(rows=len(image_paths))
         return True
-        
+
+    def _blocks(self, labels: np.ndarray):
+        """Row blocks of at most ``chunk_rows`` rows and about ``SCAN_BLOCK_BYTES`` bytes"""
+        row_bytes = max(labels.dtype.itemsize * int(np.prod(labels.shape[1:])), 1)
+        step = max(SCAN_BLOCK_BYTES // row_bytes, 1)
+        if self.chunk_rows:
+            step = min(step, self.chunk_rows)
+        return iter_row_chunks(labels, step)
+
+    def label_range(self, labels: np.ndarray) -> Tuple[float, float]:
+        """
+        Minimum and maximum label in one pass over memory
+
+        Both reductions run on each cache-sized block before moving on, and the
+        result is remembered for ``preprocess_labels`` on the same array.
+        """
+        if self._scanned is not None and self._scanned[0] is labels:
+            return self._scanned[1]
+        low, high = np.inf, -np.inf
+        for block in self._blocks(labels):
+            if len(block):
+                low = min(low, float(block.min()))
+                high = max(high, float(block.max()))
+        self._scanned = (labels, (low, high))
+        return low, high
+
+    def _check_categorical(self, labels: np.ndarray, low: float, high: float) -> None:
+        """Integer labels are colour indices, which must fit the palette"""
+        if labels.dtype.kind not in 'ui' or not len(labels):
+            return
+        if low < 0:
+            raise ValueError(f"Colour labels must not be negative, got {int(low)}")
+        if self.num_colors is not None and high >= self.num_colors:
+            raise ValueError(
+                f"Colour label {int(high)} is outside the palette of {self.num_colors} colours"
+            )
+
+    @instrumented("preprocess_labels")
     def preprocess_labels(self, 
-                         labels: np.ndarray) -> np.ndarray:
-        """Preprocess labels for dimension reduction"""
-        # Normalize if needed
-        if labels.max() > 1.0 or labels.min() < 0.0:
+                         labels: np.ndarray,
+                         value_range: Optional[Tuple[float, float]] = None,
+                         copy: bool = True) -> np.ndarray:
+        """
+        Preprocess labels for dimension reduction
+
+        Integer labels are colour indices: they are checked against the palette
+        and kept as they are, narrowed to the smallest unsigned type only when
+        stored wider. Other labels outside [0, 1] are min-max scaled into
+        float32, one cache-sized block at a time; with ``copy=False`` a writable
+        float32 array is scaled in place and nothing new is allocated.
+
+        Passing the ``value_range`` recorded for an earlier batch scales new
+        labels exactly like that batch, so appended images stay comparable.
+        """
+        if value_range is None:
+            low, high = self.label_range(labels)
+            if labels.dtype.kind in 'ui':
+                self._check_categorical(labels, low, high)
+                self.value_range = None
+                self._scanned = None
+                self.metrics.count(rows=len(labels))
+                return self._compact_codes(labels, high)
+            if high > 1.0 or low < 0.0:
+                value_range = (low, high)
+        if value_range is not None:
             self.logger.info("Normalizing labels to [0,1] range")
-            labels = (labels - labels.min()) / (labels.max() - labels.min())
+            labels = self._scale(labels, value_range, copy)
+        self.value_range = value_range
+        self._scanned = None
+        self.metrics.count(rows=len(labels))
             
         return labels
+
+    def _compact_codes(self, labels: np.ndarray, high: float) -> np.ndarray:
+        """Colour indices in the smallest unsigned type, the input itself when it already is"""
+        dtype = label_dtype(max(int(high) + 1, self.num_colors or 0))
+        if labels.dtype.kind == 'u' and labels.dtype.itemsize <= dtype.itemsize:
+            return labels
+        self.logger.info(f"Narrowing {labels.dtype} colour labels to {dtype}")
+        compact = np.empty(labels.shape, dtype=dtype)
+        start = 0
+        for block in self._blocks(labels):
+            compact[start:start + len(block)] = block
+            start += len(block)
+        return compact
+
+    def _scale(self, labels: np.ndarray, value_range: Tuple[float, float], copy: bool) -> np.ndarray:
+        """Map ``value_range`` onto [0, 1] in float32, block by block"""
+        low, high = value_range
+        # Labels that are all the same would divide by zero; they map to 0
+        span = high - low if high > low else np.inf
+        in_place = (not copy and isinstance(labels, np.ndarray) and labels.dtype == np.float32
+                    and labels.flags.writeable)
+        scaled = labels if in_place else np.empty(labels.shape, dtype=np.float32)
+        start = 0
+        for block in self._blocks(labels):
+            out = scaled[start:start + len(block)]
+            np.subtract(block, low, out=out, casting="unsafe")
+            out /= span
+            start += len(block)
+        return scaled
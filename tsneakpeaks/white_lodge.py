@@ -5,12 +5,40 @@ Like the White Lodge, this is where things become more comprehensible
 """
 
 import numpy as np
-from sklearn.manifold import TSNE
-from scipy.sparse import vstack
+from scipy.sparse import csr_matrix, issparse, vstack
+from scipy.spatial import cKDTree
 from pathlib import Path
-from typing import Optional, List
+from typing import Callable, Optional, List, Union
 import logging
-from .data_processing import convert_to_sparse_one_hot
+from .data_processing import array_fingerprint, encode_sparse_one_hot, unique_rows
+from .affinities import (
+    conditional_affinities,
+    cosine_knn_graph,
+    cosine_knn_query,
+    joint_probabilities,
+    n_neighbors_for_perplexity,
+    normalize_rows,
+    truncate_graph,
+)
+from .checkpoints import IterationInfo
+from .engines import ENGINES, SCHEDULES, EmbeddingResult, Engine, get_engine, place_points, select_engine
+from .landmarks import LANDMARK_METHODS, landmark_count, select_landmarks
+from .neighbour_index import NeighbourIndex
+from .owl_cave import Metrics, instrumented
+from .packed_codes import PackedLabels, bits_per_quadrant, match_knn_graph, match_knn_query
+from .preview import pca_init, randomized_pca
+
+# Above this many points "auto" switches from exact to approximate neighbours
+EXACT_NEIGHBOURS_MAX_SAMPLES = 20000
+
+# Points placed among the landmarks per pass, bounding the affinities held at once
+LANDMARK_PLACEMENT_ROWS = 1 << 16
+
+# Deduplication is skipped unless it leaves at most this share of the rows
+DEDUP_MAX_DISTINCT_SHARE = 0.75
+
+# Placement perplexity shrinks with the landmark fraction, but not below this
+MIN_PLACEMENT_PERPLEXITY = 2.0
 
 
 class WhiteLodge:
@@ -20,60 +48,677 @@ class WhiteLodge:
                  perplexity: float = 20.0,
                  n_iter: int = 3000,
                  random_state: int = 42,
-                 logger: Optional[logging.Logger] = None):
+                 logger: Optional[logging.Logger] = None,
+                 *,
+                 engine: str = "auto",
+                 init: str = "random",
+                 schedule: str = "fixed",
+                 neighbours: str = "auto",
+                 ann_trees: int = 8,
+                 checkpoint_path: Optional[Path] = None,
+                 checkpoint_every: int = 250,
+                 chunk_rows: Optional[int] = None,
+                 dedup: bool = False,
+                 dedup_spread: float = 0.1,
+                 landmarks: Optional[float] = None,
+                 landmark_method: str = "random",
+                 landmark_refine: int = 30,
+                 metrics: Optional[Metrics] = None):
+        if engine != "auto" and engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected 'auto' or one of {sorted(ENGINES)}")
+        if init not in ("random", "pca"):
+            raise ValueError(f"Unknown initialisation '{init}', expected 'random' or 'pca'")
+        if schedule not in SCHEDULES:
+            raise ValueError(f"Unknown schedule '{schedule}', expected one of {SCHEDULES}")
+        if neighbours not in ("auto", "exact", "approximate"):
+            raise ValueError(f"Unknown neighbour search '{neighbours}', expected 'auto', 'exact' or 'approximate'")
+        if landmark_method not in LANDMARK_METHODS:
+            raise ValueError(f"Unknown landmark method '{landmark_method}', expected one of {LANDMARK_METHODS}")
+        if landmarks is not None and not 0.0 < landmarks <= 1.0:
+            raise ValueError(f"The landmark fraction must lie in (0, 1], got {landmarks}")
         self.perplexity = perplexity
         self.n_iter = n_iter
         self.random_state = random_state
+        self.engine = engine
+        # Where t-SNE starts: a small random cloud, or the scaled PCA preview
+        self.init = init
+        # 'adaptive' ends exaggeration and the run once the KL flattens; n_iter only caps it
+        self.schedule = schedule
+        self.neighbours = neighbours
+        self.ann_trees = ann_trees
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        # Rows per pass when encoding, normalising and querying; all at once if None
+        self.chunk_rows = chunk_rows
+        # Embed every distinct row once, weighted by how many samples share it
+        self.dedup = dedup
+        # Spread of duplicates around their row, relative to the nearest other row
+        self.dedup_spread = dedup_spread
+        # Fraction of points embedded in full, the rest placed among them; all if None
+        self.landmarks = landmarks
+        self.landmark_method = landmark_method
+        # Iterations refining every placed point against the frozen landmarks
+        self.landmark_refine = landmark_refine
         self.logger = logger or logging.getLogger(__name__)
-        self.tsne = None
+        self.metrics = metrics or Metrics(logger=self.logger)
+        self.result: Optional[EmbeddingResult] = None
+        self.affinities: Optional[csr_matrix] = None
+        self.neighbour_index: Optional[NeighbourIndex] = None
+        self.features: Optional[Union[np.ndarray, csr_matrix, PackedLabels]] = None
+        self.transform_result: Optional[EmbeddingResult] = None
+        # Distinct row of every sample and samples per row, after a deduplicated project
+        self.row_inverse: Optional[np.ndarray] = None
+        self.row_counts: Optional[np.ndarray] = None
+        # Rows embedded in full by the last project in landmark mode
+        self.landmark_rows: Optional[np.ndarray] = None
 
-    def prepare_data(self, quadrant_labels: np.ndarray, num_quadrants: int, num_colors: int) -> np.ndarray:
+    @instrumented("prepare_data")
+    def prepare_data(self,
+                     quadrant_labels: np.ndarray,
+                     num_quadrants: int,
+                     num_colors: int,
+                     packed: bool = False) -> Union[csr_matrix, PackedLabels]:
         """
-        Convert quadrant labels (color indices) into a dense dataset for t-SNE.
+        Convert quadrant labels (color indices) into a sparse dataset for t-SNE.
         
         Parameters:
         - quadrant_labels (np.ndarray): Array of shape (n_images, num_quadrants),
           where each entry contains the color index for a quadrant.
         - num_quadrants (int): Number of quadrants in each image.
         - num_colors (int): Total number of colors in the palette.
+        - packed (bool): Pack every image into one integer code instead; neighbours
+          are then found by counting matching quadrants, which gives the same
+          distances as cosine on the one-hot rows.
 
         Returns:
-        - np.ndarray: Dense dataset ready for t-SNE.
+        - csr_matrix or PackedLabels: Sparse one-hot dataset of shape
+          (n_images, num_quadrants * num_colors), or its packed codes.
         """
+        if packed:
+            if quadrant_labels.shape[1] != num_quadrants:
+                raise ValueError(
+                    f"Expected {num_quadrants} quadrants per image, got {quadrant_labels.shape[1]}."
+                )
+            self.logger.info("Packing quadrant labels into integer codes...")
+            codes = PackedLabels.from_labels(quadrant_labels, num_colors, chunk_rows=self.chunk_rows)
+            self.logger.info(f"Packed {len(codes)} images into {codes.codes.dtype} codes ({codes.nbytes} bytes).")
+            self.metrics.count(rows=len(codes), bytes=codes.nbytes)
+            return codes
+        
         self.logger.info("Converting quadrant labels to sparse one-hot encoding...")
 
-        # Convert each image to a sparse matrix
-        sparse_matrices = [
-            convert_to_sparse_one_hot(image_data, num_quadrants, num_colors)
-            for image_data in quadrant_labels
-        ]
-        
-        # Stack all sparse matrices into one
-        sparse_dataset = vstack(sparse_matrices)
+        # Encode every image in one vectorized pass, one row per image
+        sparse_dataset = encode_sparse_one_hot(
+            quadrant_labels, num_colors, num_quadrants, chunk_size=self.chunk_rows
+        )
         self.logger.info(f"Generated sparse dataset with shape {sparse_dataset.shape}.")
+        self.metrics.count(rows=sparse_dataset.shape[0], nnz=sparse_dataset.nnz)
         
-        # Convert to dense format for t-SNE
-        dense_dataset = sparse_dataset.toarray()
-        self.logger.info("Converted sparse dataset to dense format.")
+        return sparse_dataset
+
+    def encode_labels(self,
+                      quadrant_labels: np.ndarray,
+                      num_colors: int,
+                      num_quadrants: Optional[int] = None) -> Union[csr_matrix, PackedLabels]:
+        """
+        One-hot features of colour labels, packed into integer codes when they fit.
+
+        Packed codes give the same neighbours at a fraction of the memory; grids
+        whose codes would need more than 64 bits fall back to the sparse matrix.
+
+        Parameters:
+        - quadrant_labels (np.ndarray): Colour indices of shape (n_images, num_quadrants).
+        - num_colors (int): Total number of colors in the palette.
+        - num_quadrants (int, optional): Quadrants per image, the label columns by default.
+
+        Returns:
+        - csr_matrix or PackedLabels: Features for ``project`` and ``transform``.
+        """
+        num_quadrants = num_quadrants or quadrant_labels.shape[1]
+        packed = bits_per_quadrant(num_colors) * num_quadrants <= 64
+        return self.prepare_data(quadrant_labels, num_quadrants, num_colors, packed=packed)
+
+    def _effective_perplexity(self, n_samples: int) -> float:
+        """Clamp perplexity so small datasets still have enough neighbours"""
+        limit = max((n_samples - 1) / 3.0, 1.0)
+        if self.perplexity > limit:
+            self.logger.warning(
+                f"Perplexity {self.perplexity} is too large for {n_samples} samples, using {limit:.2f}"
+            )
+            return limit
+        return self.perplexity
+    
+    def _resolve_engine(self, n_samples: int, with_counts: bool = False) -> Engine:
+        """Instantiate the configured engine, picking one by dataset size for 'auto'"""
+        name = select_engine(n_samples, with_counts) if self.engine == "auto" else self.engine
+        return get_engine(name, schedule=self.schedule, logger=self.logger)
+    
+    def dedup_skip_reason(self, n_samples: int, n_distinct: int) -> Optional[str]:
+        """
+        Why embedding ``n_distinct`` weighted rows would not beat embedding all
+        ``n_samples`` rows, or None if it would.
+
+        Deduplication pays only when it removes a good share of the rows, and
+        not when 'auto' would have to trade Barnes-Hut, which cannot weigh
+        rows, for the slower FFT engine on the distinct rows.
+        """
+        if n_distinct > DEDUP_MAX_DISTINCT_SHARE * n_samples:
+            return f"{n_distinct} of {n_samples} rows are distinct"
+        if self.engine == "auto" and self.landmarks is None:
+            plain, weighted = select_engine(n_samples), select_engine(n_distinct, with_counts=True)
+            if weighted not in (plain, "exact"):
+                return f"the distinct rows would need the {weighted} engine instead of {plain}"
+        return None
+
+    def _load_index(self, features, n_neighbors: int, index_path: Optional[Path]) -> NeighbourIndex:
+        """Reuse the persisted neighbour index if it still matches, else build and save one"""
+        if index_path is not None and Path(index_path).exists():
+            index = NeighbourIndex.load(index_path, logger=self.logger)
+            if index.matches(array_fingerprint(features), n_neighbors, self.ann_trees, self.random_state):
+                self.logger.info(f"Reusing neighbour index from {index_path}")
+                return index
+            self.logger.info(f"Neighbour index at {index_path} is stale, rebuilding")
         
-        return dense_dataset
+        index = NeighbourIndex(
+            n_neighbors,
+            n_trees=self.ann_trees,
+            random_state=self.random_state,
+            logger=self.logger,
+        ).build(features)
+        index.estimate_recall(features)
+        if index_path is not None:
+            index.save(index_path)
+        return index
     
-    def project(self, high_dim_data: np.ndarray) -> np.ndarray:
-        """Project high-dimensional data into 3D space"""
+    def _approximate(self, n_samples: int) -> bool:
+        """Whether neighbours among ``n_samples`` points come from the approximate index"""
+        return self.neighbours == "approximate" or (
+            self.neighbours == "auto" and n_samples > EXACT_NEIGHBOURS_MAX_SAMPLES
+        )
+    
+    def _neighbour_graph(self, features, n_neighbors: int, index_path: Optional[Path]) -> csr_matrix:
+        """Exact or approximate cosine neighbour graph, depending on settings and size"""
+        n_samples = features.shape[0]
+        exact = not self._approximate(n_samples) or n_neighbors >= n_samples - 1
+        if isinstance(features, PackedLabels):
+            if exact:
+                return match_knn_graph(features, n_neighbors, chunk_rows=self.chunk_rows)
+            # The neighbour index works on the one-hot rows
+            features = normalize_rows(features.to_one_hot(), self.chunk_rows)
+        if exact:
+            return cosine_knn_graph(features, n_neighbors, chunk_rows=self.chunk_rows)
+        
+        self.neighbour_index = self._load_index(features, n_neighbors, index_path)
+        return self.neighbour_index.graph(n_neighbors)
+    
+    def affinity_params(self) -> dict:
+        """Parameters that determine the affinity matrix, for cache keys"""
+        params = {
+            "perplexity": self.perplexity,
+            "metric": "cosine",
+            "neighbours": self.neighbours,
+            # Dense engines take P over all pairs, the others over the kNN graph;
+            # 'auto' picks by size, which the data fingerprint already fixes
+            "affinities": "auto" if self.engine == "auto" else (
+                "dense" if ENGINES[self.engine].dense_affinities else "knn"
+            ),
+        }
+        # Only added when set, so entries cached without deduplication stay valid
+        if self.dedup:
+            params["dedup"] = True
+        if self.neighbours != "exact":
+            # The approximate index depends on its trees and seed
+            params.update(ann_trees=self.ann_trees, random_state=self.random_state)
+        if self.landmarks is not None:
+            params.update(landmarks=self.landmarks, landmark_method=self.landmark_method,
+                          random_state=self.random_state)
+        return params
+    
+    def embedding_params(self) -> dict:
+        """Parameters that determine the embedding given its affinities, for cache keys"""
+        params = {
+            "n_iter": self.n_iter,
+            "random_state": self.random_state,
+            "engine": self.engine,
+        }
+        if self.dedup:
+            params["dedup_spread"] = self.dedup_spread
+        if self.landmarks is not None:
+            params["landmark_refine"] = self.landmark_refine
+        if self.init != "random":
+            params["init"] = self.init
+        if self.schedule != "fixed":
+            params["schedule"] = self.schedule
+        return params
+    
+    def n_neighbors(self, n_samples: int, with_counts: bool = False) -> int:
+        """Neighbours per point the affinities need, all other points for dense engines"""
+        if self._resolve_engine(n_samples, with_counts).dense_affinities:
+            return n_samples - 1
+        return n_neighbors_for_perplexity(self._effective_perplexity(n_samples), n_samples)
+    
+    @instrumented("neighbour_graph")
+    def neighbour_graph(self,
+                        high_dim_data: Union[np.ndarray, csr_matrix, PackedLabels],
+                        n_neighbors: int,
+                        index_path: Optional[Path] = None) -> csr_matrix:
+        """
+        Cosine neighbour graph of the data, exact or through the neighbour index.
+
+        A graph built for the largest neighbour count can be passed to
+        ``compute_affinities`` for any smaller perplexity.
+        """
+        features = normalize_rows(high_dim_data, self.chunk_rows)
+        self.features = features
+        if issparse(features):
+            self.logger.debug(f"Projecting sparse features with {features.nnz} nonzeros")
+        graph = self._neighbour_graph(features, n_neighbors, index_path)
+        self.logger.info(f"Built cosine neighbour graph with {n_neighbors} neighbours per point")
+        self.metrics.count(rows=graph.shape[0], neighbours=n_neighbors, nnz=graph.nnz)
+        return graph
+    
+    @instrumented("affinities")
+    def compute_affinities(self,
+                           high_dim_data: Union[np.ndarray, csr_matrix, PackedLabels],
+                           index_path: Optional[Path] = None,
+                           graph: Optional[csr_matrix] = None,
+                           counts: Optional[np.ndarray] = None) -> csr_matrix:
+        """
+        Sparse, perplexity-calibrated affinity matrix P for the data.
+
+        Rows are L2-normalised (in CSR form for sparse input), cosine neighbours
+        are found without densifying, and P only holds entries for neighbour pairs.
+
+        Parameters:
+        - high_dim_data (np.ndarray, csr_matrix or PackedLabels): Features of shape (n_samples, n_features).
+        - index_path (Path, optional): Where the approximate neighbour index is
+          persisted. An index already there is reused when it matches the features,
+          ``ann_trees`` and ``random_state``.
+        - graph (csr_matrix, optional): Neighbour graph from ``neighbour_graph`` with at
+          least as many neighbours as needed; skips the neighbour search.
+        - counts (np.ndarray, optional): Samples each (distinct) row stands for;
+          see ``joint_probabilities``.
+
+        Returns:
+        - csr_matrix: Symmetric joint probabilities summing to one.
+        """
+        n_samples = high_dim_data.shape[0]
+        perplexity = self._effective_perplexity(n_samples)
+        n_neighbors = self.n_neighbors(n_samples, counts is not None)
+        if graph is None:
+            graph = self.neighbour_graph(high_dim_data, n_neighbors, index_path)
+        else:
+            graph = truncate_graph(graph, n_neighbors + 1)
+        P = joint_probabilities(graph, perplexity, chunk_size=self.chunk_rows or 65536, counts=counts)
+        self.metrics.count(rows=n_samples, nnz=P.nnz)
+        return P
+    
+    @instrumented("project")
+    def project(self,
+                high_dim_data: Union[np.ndarray, csr_matrix, PackedLabels],
+                index_path: Optional[Path] = None,
+                affinities: Optional[csr_matrix] = None,
+                callbacks: Optional[List[Callable[[IterationInfo], Optional[bool]]]] = None,
+                callback_every: int = 1) -> np.ndarray:
+        """
+        Project high-dimensional data into 3D space.
+
+        The embedding is optimised by the configured engine from the sparse
+        affinity matrix of ``compute_affinities``. The matrix is kept in
+        ``self.affinities`` and the engine's result (coords, KL divergence,
+        iterations) in ``self.result``. With a ``checkpoint_path`` the optimiser
+        state is saved periodically, a run interrupted earlier resumes from it,
+        and it is removed once the projection completes.
+
+        With ``dedup`` identical rows are embedded once: affinities and the
+        optimisation run over the distinct rows, weighted by how many samples
+        share each, and ``expand`` places every sample around its row. The cost
+        then follows the number of distinct rows rather than of samples, and
+        ``self.result``, ``self.features`` and ``self.affinities`` describe
+        the distinct rows. Deduplication is skipped, with a log line, when it
+        would not be cheaper; see ``dedup_skip_reason``.
+
+        With a ``landmarks`` fraction only that share of the points (at least
+        ``MIN_LANDMARKS``) is embedded with full t-SNE. Every other point
+        starts at the affinity-weighted mean of its landmark neighbours and is
+        refined for ``landmark_refine`` iterations against the frozen
+        landmarks, as in ``transform``, at a perplexity scaled down by the
+        landmark fraction since each landmark stands for many points.
+        ``self.affinities`` then holds the landmark affinities and
+        ``self.landmark_rows`` the landmarks' rows.
+
+        With ``init='pca'`` the optimisation starts from the ``preview`` of
+        the rows it embeds, scaled down to the spread of the random start, so
+        the global layout is in place before the first iteration.
+
+        Parameters:
+        - high_dim_data (np.ndarray, csr_matrix or PackedLabels): Features of shape (n_samples, n_features).
+        - index_path (Path, optional): Where the approximate neighbour index is persisted.
+        - affinities (csr_matrix, optional): Previously computed affinities for the
+          same data and perplexity (of its distinct rows with ``dedup``, of its
+          landmarks with ``landmarks``); skips the neighbour search entirely.
+        - callbacks (list, optional): Progress callbacks receiving an ``IterationInfo``
+          (iteration, KL divergence, gradient norm, elapsed seconds, live coords);
+          returning True stops the optimisation early.
+        - callback_every (int): Iterations between callback calls.
+        """
         self.logger.info("Initiating projection through the White Lodge...")
         
-        self.tsne = TSNE(
-            n_components=3,
-            perplexity=self.perplexity,
-            n_iter=self.n_iter,
-            random_state=self.random_state,
-            metric="cosine"
+        counts = None
+        self.row_inverse = self.row_counts = None
+        if self.dedup:
+            rows = high_dim_data.codes if isinstance(high_dim_data, PackedLabels) else high_dim_data
+            index, inverse, row_counts = unique_rows(rows, self.chunk_rows)
+            skip_reason = self.dedup_skip_reason(high_dim_data.shape[0], len(index))
+            if skip_reason is not None:
+                self.logger.info(f"Embedding every sample without deduplication: {skip_reason}")
+            else:
+                self.logger.info(
+                    f"Embedding {len(index)} distinct rows standing for {high_dim_data.shape[0]} samples"
+                )
+                self.row_inverse, self.row_counts = inverse, row_counts
+                counts = row_counts.astype(np.float64)
+                high_dim_data = high_dim_data[index]
+                if callbacks:
+                    callbacks = [self._expanding(callbacks)]
+        
+        features, nearest = None, None
+        self.landmark_rows = None
+        n_landmarks = self._landmark_count(high_dim_data.shape[0])
+        if n_landmarks is not None:
+            features = normalize_rows(high_dim_data, self.chunk_rows)
+            self.landmark_rows, nearest = self._select_landmarks(features, n_landmarks, counts)
+            # Counts steer the choice of landmarks only; weighting the landmarks by the
+            # points they stand for forced the slower engines and blurred the overview
+            counts = None
+            high_dim_data = features[self.landmark_rows]
+            # The persisted index belongs to every point, not to the landmarks
+            index_path = None
+            if callbacks:
+                callbacks = [self._spreading(callbacks, nearest)]
+        
+        n_samples = high_dim_data.shape[0]
+        if affinities is None:
+            affinities = self.compute_affinities(high_dim_data, index_path, counts=counts)
+        elif affinities.shape != (n_samples, n_samples):
+            raise ValueError(
+                f"Affinities of shape {affinities.shape} do not match {n_samples} samples"
+            )
+        else:
+            self.features = normalize_rows(high_dim_data, self.chunk_rows)
+        self.affinities = affinities
+        
+        engine = self._resolve_engine(n_samples, counts is not None)
+        init = pca_init(self.preview(high_dim_data)) if self.init == "pca" else None
+        with self.metrics.stage("embed", rows=n_samples):
+            self.result = engine.embed(
+                affinities,
+                n_components=3,
+                n_iter=self.n_iter,
+                random_state=self.random_state,
+                init=init,
+                callbacks=callbacks,
+                callback_every=callback_every,
+                checkpoint_path=self.checkpoint_path,
+                checkpoint_every=self.checkpoint_every,
+                counts=counts,
+            )
+            self.metrics.count(iterations=self.result.n_iter, kl_divergence=self.result.kl_divergence)
+            if not self.result.interrupted and self.result.n_iter < self.n_iter:
+                saved = self.n_iter - self.result.n_iter
+                self.logger.info(f"Stopped early, saving {saved} of {self.n_iter} iterations")
+                self.metrics.count(iterations_saved=saved)
+        self.logger.info(f"Projection complete using the {engine.name} engine")
+        if features is not None:
+            self.features = features
+            self.result = self.result._replace(coords=self._place_around_landmarks(features, nearest))
+        self.metrics.count(
+            rows=len(self.row_inverse) if self.row_inverse is not None else len(self.result.coords),
+            distinct_rows=len(self.result.coords),
+            embedded_rows=n_samples,
+            nnz=affinities.nnz,
+            iterations=self.result.n_iter,
+        )
+        if self.checkpoint_path is not None and not self.result.interrupted:
+            Path(self.checkpoint_path).unlink(missing_ok=True)
+        
+        return self.expand(self.result.coords)
+    
+    @instrumented("preview")
+    def preview(self, high_dim_data: Union[np.ndarray, csr_matrix, PackedLabels]) -> np.ndarray:
+        """
+        Linear 3D preview of the data in seconds, long before t-SNE is done.
+
+        The rows are L2-normalised as for ``project`` and projected onto their
+        first three principal components by ``randomized_pca``, a block of
+        ``chunk_rows`` at a time, without densifying sparse or packed input.
+
+        Parameters:
+        - high_dim_data (np.ndarray, csr_matrix or PackedLabels): Features of shape (n_samples, n_features).
+
+        Returns:
+        - np.ndarray: Coordinates of shape (n_samples, 3), one row per sample.
+        """
+        self.logger.info(f"Previewing {high_dim_data.shape[0]} points by randomized PCA...")
+        coords = randomized_pca(high_dim_data, 3, random_state=self.random_state, chunk_rows=self.chunk_rows)
+        self.metrics.count(rows=high_dim_data.shape[0])
+        return coords
+    
+    def _landmark_count(self, n_samples: int) -> Optional[int]:
+        """Landmarks to embed among ``n_samples`` points, None when every point is embedded"""
+        if self.landmarks is None:
+            return None
+        n_landmarks = landmark_count(n_samples, self.landmarks)
+        return n_landmarks if n_landmarks < n_samples else None
+    
+    def _reference_affinities(self,
+                              reference,
+                              queries,
+                              index_path: Optional[Path] = None,
+                              extend_index: bool = False,
+                              perplexity: Optional[float] = None):
+        """
+        Conditional affinities of normalised ``queries`` to their neighbours in
+        ``reference``, and those neighbours; ``perplexity`` defaults to the
+        projection's, clamped to the reference size.
+        """
+        n_reference = reference.shape[0]
+        perplexity = perplexity or self._effective_perplexity(n_reference + 1)
+        n_neighbors = n_neighbors_for_perplexity(perplexity, n_reference + 1)
+        indices, distances = self._query_neighbours(reference, queries, n_neighbors, index_path, extend_index)
+        return conditional_affinities(indices, distances, perplexity, n_reference), indices
+    
+    @instrumented("landmarks")
+    def _select_landmarks(self, features, n_landmarks: int, counts: Optional[np.ndarray]):
+        """
+        Landmark rows and the landmark closest to every row.
+
+        Returns:
+        - tuple: Sorted landmark rows, and for every row the position of its
+          nearest landmark among them (landmarks are their own).
+        """
+        landmark_rows = select_landmarks(features, n_landmarks, self.landmark_method, counts, self.random_state)
+        self.logger.info(
+            f"Embedding {len(landmark_rows)} landmarks chosen by {self.landmark_method}, "
+            f"placing {features.shape[0] - len(landmark_rows)} points among them"
         )
+        reference = features[landmark_rows]
+        # As many neighbours as placement asks for, so an approximate index serves both
+        perplexity = self._placement_perplexity(len(landmark_rows), features.shape[0])
+        n_neighbors = n_neighbors_for_perplexity(perplexity, len(landmark_rows) + 1)
+        nearest = np.empty(features.shape[0], dtype=np.int64)
+        step = self.chunk_rows or LANDMARK_PLACEMENT_ROWS
+        for start in range(0, features.shape[0], step):
+            rows = np.arange(start, min(start + step, features.shape[0]))
+            indices, _ = self._query_neighbours(reference, features[rows], n_neighbors, None, False)
+            nearest[rows] = indices[:, 0]
+        nearest[landmark_rows] = np.arange(len(landmark_rows))
+        self.metrics.count(rows=features.shape[0], landmarks=len(landmark_rows))
+        return landmark_rows, nearest
+    
+    def _placement_perplexity(self, n_landmarks: int, n_samples: int) -> float:
+        """Perplexity of points placed among ``n_landmarks`` landmarks standing for ``n_samples`` points"""
+        perplexity = max(MIN_PLACEMENT_PERPLEXITY, self.perplexity * n_landmarks / n_samples)
+        return min(perplexity, self._effective_perplexity(n_landmarks + 1))
+    
+    def _spreading(self,
+                   callbacks: List[Callable[[IterationInfo], Optional[bool]]],
+                   nearest: np.ndarray):
+        """One callback handing every given callback all points, each at its nearest landmark"""
+        def spread(info: IterationInfo) -> bool:
+            info = info._replace(coords=info.coords[nearest])
+            return any([bool(callback(info)) for callback in callbacks])
+        return spread
+    
+    @instrumented("placement")
+    def _place_around_landmarks(self, features, nearest: np.ndarray) -> np.ndarray:
+        """
+        Coordinates of every row from the landmark embedding in ``self.result``.
+
+        Points are placed a block at a time like ``transform`` places new
+        points; after an interrupted run they sit on their nearest landmark.
+        """
+        landmark_coords = self.result.coords
+        coords = landmark_coords[nearest]
+        if self.result.interrupted:
+            return coords
+        reference = features[self.landmark_rows]
+        others = np.setdiff1d(np.arange(features.shape[0]), self.landmark_rows)
+        perplexity = self._placement_perplexity(len(self.landmark_rows), features.shape[0])
+        step = self.chunk_rows or LANDMARK_PLACEMENT_ROWS
+        for start in range(0, len(others), step):
+            rows = others[start:start + step]
+            P, _ = self._reference_affinities(reference, features[rows], perplexity=perplexity)
+            coords[rows] = place_points(
+                P,
+                landmark_coords,
+                init=P @ landmark_coords,
+                n_iter=self.landmark_refine,
+                logger=self.logger,
+            ).coords
+        self.metrics.count(rows=len(others), iterations=self.landmark_refine)
+        return coords
+    
+    def _expanding(self, callbacks: List[Callable[[IterationInfo], Optional[bool]]]):
+        """One callback handing every given callback per-sample coordinates"""
+        def expanded(info: IterationInfo) -> bool:
+            info = info._replace(coords=self.expand(info.coords))
+            return any([bool(callback(info)) for callback in callbacks])
+        return expanded
+    
+    def expand(self, coords: np.ndarray) -> np.ndarray:
+        """
+        Per-sample coordinates from coordinates of the distinct rows.
+
+        Samples sharing a row are scattered around it by a Gaussian whose scale
+        is ``dedup_spread`` times the distance to the nearest other row, so
+        groups show their size without reaching into neighbouring groups. The
+        scatter is seeded by ``random_state`` and the same on every call.
+        Coordinates are returned unchanged unless the last ``project`` was
+        deduplicated.
+        """
+        if self.row_inverse is None:
+            return coords
+        if len(coords) > 1:
+            nearest = cKDTree(coords).query(coords, k=2)[0][:, 1]
+        else:
+            nearest = np.ones(len(coords))
+        scale = np.where(self.row_counts > 1, self.dedup_spread * nearest, 0.0)
         
-        coords_3d = self.tsne.fit_transform(high_dim_data)
-        self.logger.info("Projection complete")
+        rng = np.random.default_rng(self.random_state)
+        expanded = np.empty((len(self.row_inverse), coords.shape[1]))
+        step = self.chunk_rows or max(len(expanded), 1)
+        for start in range(0, len(expanded), step):
+            rows = self.row_inverse[start:start + step]
+            offsets = rng.standard_normal((len(rows), coords.shape[1]))
+            expanded[start:start + step] = coords[rows] + scale[rows, None] * offsets
+        return expanded
+    
+    def _query_neighbours(self,
+                          reference,
+                          queries,
+                          n_neighbors: int,
+                          index_path: Optional[Path],
+                          extend_index: bool):
+        """Reference neighbours of new points, through the neighbour index for large references"""
+        n_reference = reference.shape[0]
+        exact = not self._approximate(n_reference) or n_neighbors >= n_reference - 1
+        if isinstance(reference, PackedLabels):
+            if exact:
+                return match_knn_query(reference, queries, n_neighbors, self.chunk_rows)
+            reference = normalize_rows(reference.to_one_hot(), self.chunk_rows)
+            queries = normalize_rows(queries.to_one_hot(), self.chunk_rows)
+        if exact:
+            return cosine_knn_query(reference, queries, n_neighbors)
+        
+        index = self.neighbour_index
+        if index is None or not index.matches(array_fingerprint(reference), n_neighbors,
+                                              self.ann_trees, self.random_state):
+            index = self._load_index(reference, n_neighbors, index_path)
+        indices, distances = index.query(reference, queries)
+        if extend_index:
+            combined = vstack([reference, queries]) if issparse(reference) else np.vstack([reference, queries])
+            index.extend(combined, indices, distances)
+            if index_path is not None:
+                index.save(index_path)
+        self.neighbour_index = index
+        return indices[:, :n_neighbors], distances[:, :n_neighbors]
+    
+    @instrumented("transform")
+    def transform(self,
+                  new_data: Union[np.ndarray, csr_matrix, PackedLabels],
+                  reference_data: Optional[Union[np.ndarray, csr_matrix, PackedLabels]] = None,
+                  reference_coords: Optional[np.ndarray] = None,
+                  n_iter: int = 100,
+                  index_path: Optional[Path] = None,
+                  extend_index: bool = False) -> np.ndarray:
+        """
+        Place new points into an existing embedding without moving it.
+
+        Each new point gets perplexity-calibrated affinities to its cosine
+        neighbours in the reference set (through the neighbour index for large
+        references), starts at the affinity-weighted mean of their coordinates and
+        is refined by a short optimisation in which only the new points move.
+
+        Parameters:
+        - new_data (np.ndarray, csr_matrix or PackedLabels): Features of the new points.
+        - reference_data (np.ndarray, csr_matrix or PackedLabels, optional): Features of the embedded
+          points; defaults to the data of the last ``project``.
+        - reference_coords (np.ndarray, optional): Their frozen coordinates; defaults
+          to the coordinates of the last ``project``.
+        - n_iter (int): Iterations of the placement optimisation.
+        - index_path (Path, optional): Where the approximate neighbour index is persisted.
+        - extend_index (bool): Append the new points to the neighbour index (and save it),
+          so the next batch can be placed against old and new points together.
+
+        Returns:
+        - np.ndarray: 3D coordinates of the new points.
+        """
+        reference = self.features if reference_data is None else normalize_rows(reference_data, self.chunk_rows)
+        if reference_coords is None and self.result is not None:
+            reference_coords = self.result.coords
+        if reference is None or reference_coords is None:
+            raise ValueError("No reference embedding. Call project() first or pass reference_data and reference_coords.")
+        n_reference = reference.shape[0]
+        if len(reference_coords) != n_reference:
+            raise ValueError(
+                f"Reference coordinates for {len(reference_coords)} points do not match {n_reference} samples"
+            )
+        
+        self.logger.info(f"Placing {new_data.shape[0]} new points into the White Lodge...")
+        queries = normalize_rows(new_data, self.chunk_rows)
+        P, _ = self._reference_affinities(reference, queries, index_path, extend_index)
         
-        return coords_3d
+        reference_coords = np.asarray(reference_coords, dtype=np.float64)
+        self.transform_result = place_points(
+            P,
+            reference_coords,
+            init=P @ reference_coords,
+            n_iter=n_iter,
+            logger=self.logger,
+        )
+        self.metrics.count(rows=new_data.shape[0], iterations=self.transform_result.n_iter)
+        return self.transform_result.coords
     
     def project_images(self, quadrant_labels: np.ndarray, num_quadrants: int, num_colors: int) -> np.ndarray:
         """
@@ -88,8 +733,8 @@ class WhiteLodge:
         - np.ndarray: 3D coordinates for each image.
         """
         self.logger.info("Starting full pipeline for image projection...")
-        dense_dataset = self.prepare_data(quadrant_labels, num_quadrants, num_colors)
-        return self.project(dense_dataset)
+        dataset = self.encode_labels(quadrant_labels, num_colors, num_quadrants)
+        return self.project(dataset)
     
     def visualize_clusters(self, coords_3d: np.ndarray, quadrant_labels: np.ndarray, output_path: Path):
         """
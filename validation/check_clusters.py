@@ -1,4 +1,7 @@
 import numpy as np
+from tsneakpeaks.data_processing import unique_rows
 labels = np.load("test_data/labels.npy")
 print(np.unique(labels, axis=0))
 
+_, _, counts = unique_rows(labels)
+print(f"{len(counts)} distinct rows for {len(labels)} images, largest group {counts.max()}")
@@ -0,0 +1,26 @@
+import argparse
+import logging
+import time
+import numpy as np
+from tsneakpeaks import WhiteLodge
+from tsneakpeaks.benchmark import synthesize_labels
+
+# Projection time with and without dedup; dedup must never be the slower one
+parser = argparse.ArgumentParser(description="Compare deduplicated and plain projections")
+parser.add_argument("--sizes", type=int, nargs="+", default=[3000], help="Collection sizes")
+parser.add_argument("--n-iter", type=int, default=300, help="Optimisation iterations")
+args = parser.parse_args()
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+for n_images in args.sizes:
+    labels = synthesize_labels(n_images)
+    distinct = len(np.unique(labels, axis=0))
+    seconds = {}
+    for dedup in (False, True):
+        wl = WhiteLodge(perplexity=30, n_iter=args.n_iter, dedup=dedup)
+        features = wl.prepare_data(labels, 4, 16)
+        started = time.perf_counter()
+        wl.project(features)
+        seconds[dedup] = time.perf_counter() - started
+    print(f"{n_images} images, {distinct} distinct rows: plain {seconds[False]:.1f}s, "
+          f"dedup {seconds[True]:.1f}s")
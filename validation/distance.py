@@ -1,16 +1,18 @@
-from sklearn.metrics import pairwise_distances
 from sklearn.manifold import TSNE
 import numpy as np
+from tsneakpeaks.packed_codes import PackedLabels, match_knn_graph
 
-# Load labels
+# Load labels and pack every image into one integer code
 labels = np.load("test_data/labels.npy")
+codes = PackedLabels.from_labels(labels, num_colors=int(labels.max()) + 1)
 
-# Compute pairwise distances (Euclidean)
-distance_matrix = pairwise_distances(labels, metric="euclidean")
+# Sparse neighbour graph of one-hot cosine distances, counted on the codes
+# instead of a dense N x N distance matrix
+perplexity = min(30.0, (len(labels) - 1) / 3.0)
+graph = match_knn_graph(codes, n_neighbors=min(len(labels) - 1, int(3 * perplexity + 1)))
 
 # Run t-SNE with precomputed distances
-tsne = TSNE(n_components=3, metric="precomputed", random_state=42, init="random")
-coords_3d = tsne.fit_transform(distance_matrix)
+tsne = TSNE(n_components=3, metric="precomputed", perplexity=perplexity, random_state=42, init="random")
+coords_3d = tsne.fit_transform(graph)
 
 print(coords_3d)
-
@@ -0,0 +1,29 @@
+import argparse
+import time
+import numpy as np
+from tsneakpeaks import Visualizer
+
+# Figure size and build time of the compact payload against per-point hover text
+parser = argparse.ArgumentParser(description="Measure Red Room figure payloads")
+parser.add_argument("--points", type=int, default=1_000_000, help="Points in the synthetic embedding")
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+coords_3d = rng.normal(size=(args.points, 3))
+labels = rng.integers(0, 16, (args.points, 4))
+image_paths = [f"test_data/image_{i:07d}.png" for i in range(args.points)]
+
+results = {}
+for compact in (False, True):
+    visualizer = Visualizer(max_points=None, compact=compact)
+    started = time.perf_counter()
+    fig = visualizer.create_figure(coords_3d, labels, image_paths)
+    built = time.perf_counter() - started
+    payload = fig.to_json()
+    total = time.perf_counter() - started
+    results[compact] = (len(payload), built, total)
+    print(f"{'compact' if compact else 'per-point text'}: {len(payload) / 1e6:.1f} MB, "
+          f"figure {built:.2f}s, figure + JSON {total:.2f}s")
+
+print(f"Payload {results[False][0] / results[True][0]:.1f}x smaller, "
+      f"figure + JSON {results[False][2] / results[True][2]:.1f}x faster")